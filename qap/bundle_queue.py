@@ -0,0 +1,283 @@
+import os
+import os.path as op
+import threading
+import time
+
+
+class BundleQueue(object):
+    """A file-locked queue of a run's bundles, shared by any number of
+    workers pulling bundles from it (cluster array tasks, or local
+    processes).
+
+    - The queue is a JSON file (in the run's log directory) holding the
+      status of each bundle: "pending", "claimed" (with the claiming worker
+      and its last heartbeat time), "finished" or "failed". Every update
+      happens under a lock file, so workers on different nodes sharing the
+      file system can use it.
+    - A claimed bundle whose worker has stopped sending heartbeats (for
+      example, a preempted cluster task) is reclaimed by the next worker
+      asking for work, up to a maximum number of attempts.
+    - Workers keep polling the queue while other workers' claims are still
+      live, so that a bundle whose worker is preempted is always picked up
+      again once its claim goes stale.
+    """
+
+    def __init__(self, queue_file, stale_after=600, max_attempts=3,
+                 lock_timeout=60, poll_interval=30):
+        """
+        :type queue_file: str
+        :param queue_file: The filepath of the queue's JSON file.
+        :type stale_after: int
+        :param stale_after: (default: 600) The number of seconds without a
+                            heartbeat after which a claim is stale.
+        :type max_attempts: int
+        :param max_attempts: (default: 3) The number of times a bundle can
+                             be claimed before it is marked as failed.
+        :type lock_timeout: int
+        :param lock_timeout: (default: 60) The number of seconds to wait for
+                             the lock before treating it as left behind by a
+                             dead worker, and breaking it.
+        :type poll_interval: float
+        :param poll_interval: (default: 30) The number of seconds a worker
+                              waits before asking for work again, when every
+                              unfinished bundle is claimed by another worker.
+        """
+
+        self.queue_file = queue_file
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    def _lock(self):
+        """Acquire the queue's lock file.
+
+        :rtype: lockfile.FileLock
+        :return: The acquired lock.
+        """
+
+        from lockfile import FileLock, AlreadyLocked
+
+        lock = FileLock(self.queue_file)
+        start = time.time()
+
+        # poll quickly - the lock is only ever held for a quick
+        # read-and-update
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except AlreadyLocked:
+                if time.time() - start > self.lock_timeout:
+                    # left behind by a worker that died while holding it
+                    lock.break_lock()
+                else:
+                    time.sleep(0.05)
+
+    def _read(self):
+        """Read the queue's state.
+
+        :rtype: dict
+        :return: A dictionary mapping bundle indices (as strings) to their
+                 status dictionaries.
+        """
+
+        from qap.qap_utils import read_json
+
+        if not op.isfile(self.queue_file):
+            return {}
+
+        return read_json(self.queue_file)
+
+    def _write(self, bundles):
+        """Write the queue's state, atomically.
+
+        :type bundles: dict
+        :param bundles: A dictionary mapping bundle indices (as strings) to
+                        their status dictionaries.
+        """
+
+        import json
+
+        tmp_file = "%s.%d.tmp" % (self.queue_file, os.getpid())
+        with open(tmp_file, "wt") as f:
+            json.dump(bundles, f, indent=2, sort_keys=True)
+        os.rename(tmp_file, self.queue_file)
+
+    def initialize(self, num_bundles):
+        """Add the bundles to the queue, if they are not already in it.
+
+        - Every worker can call this - bundles already in the queue keep
+          their status.
+
+        :type num_bundles: int
+        :param num_bundles: The number of bundles in the run.
+        """
+
+        queue_dir = op.dirname(op.abspath(self.queue_file))
+        if not op.isdir(queue_dir):
+            try:
+                os.makedirs(queue_dir)
+            except OSError:
+                if not op.isdir(queue_dir):
+                    raise
+
+        lock = self._lock()
+        try:
+            bundles = self._read()
+            for bundle_idx in range(1, num_bundles+1):
+                if str(bundle_idx) not in bundles.keys():
+                    bundles[str(bundle_idx)] = {"status": "pending",
+                                                "attempts": 0}
+            self._write(bundles)
+        finally:
+            lock.release()
+
+    def claim(self, worker_id):
+        """Claim the next bundle to run - the lowest-numbered pending bundle,
+        or else a bundle whose claim has gone stale.
+
+        :type worker_id: str
+        :param worker_id: A unique name for the worker.
+        :rtype: int
+        :return: The index of the claimed bundle, or None if there is no
+                 bundle to claim right now (see 'is_done' for whether any
+                 will become available).
+        """
+
+        lock = self._lock()
+        try:
+            bundles = self._read()
+            now = time.time()
+            claimed_idx = None
+
+            for bundle_idx in sorted(bundles.keys(), key=int):
+                bundle = bundles[bundle_idx]
+                if bundle["status"] == "claimed" and \
+                        now - bundle["heartbeat"] > self.stale_after:
+                    if bundle["attempts"] >= self.max_attempts:
+                        bundle["status"] = "failed"
+                        continue
+                elif bundle["status"] != "pending":
+                    continue
+
+                bundle.update({"status": "claimed", "worker": worker_id,
+                               "heartbeat": now,
+                               "attempts": bundle["attempts"] + 1})
+                claimed_idx = int(bundle_idx)
+                break
+
+            self._write(bundles)
+        finally:
+            lock.release()
+
+        return claimed_idx
+
+    def heartbeat(self, bundle_idx, worker_id):
+        """Record that a worker is still running its claimed bundle.
+
+        :type bundle_idx: int
+        :param bundle_idx: The index of the claimed bundle.
+        :type worker_id: str
+        :param worker_id: The worker's name.
+        :rtype: bool
+        :return: Whether the worker still holds the claim.
+        """
+
+        lock = self._lock()
+        try:
+            bundles = self._read()
+            bundle = bundles[str(bundle_idx)]
+            if bundle["status"] != "claimed" or \
+                    bundle.get("worker") != worker_id:
+                return False
+            bundle["heartbeat"] = time.time()
+            self._write(bundles)
+        finally:
+            lock.release()
+
+        return True
+
+    def release(self, bundle_idx, worker_id, status="finished"):
+        """Mark a claimed bundle as done.
+
+        :type bundle_idx: int
+        :param bundle_idx: The index of the claimed bundle.
+        :type worker_id: str
+        :param worker_id: The worker's name.
+        :type status: str
+        :param status: (default: "finished") The final status of the bundle,
+                       "failed" if its workflow failed.
+        """
+
+        lock = self._lock()
+        try:
+            bundles = self._read()
+            bundle = bundles[str(bundle_idx)]
+            # a late worker whose claim was reclaimed does not overwrite a
+            # finished result
+            if bundle["status"] != "finished":
+                bundle.update({"status": status, "worker": worker_id,
+                               "heartbeat": time.time()})
+            self._write(bundles)
+        finally:
+            lock.release()
+
+    def is_done(self):
+        """Check whether every bundle in the queue is finished or failed.
+
+        :rtype: bool
+        :return: Whether no bundle is pending or claimed.
+        """
+
+        return all([status in ["finished", "failed"]
+                    for status in self.status().values()])
+
+    def status(self):
+        """Get the status of each bundle in the queue.
+
+        :rtype: dict
+        :return: A dictionary mapping bundle indices to their status.
+        """
+
+        bundles = self._read()
+        return dict((int(idx), bundles[idx]["status"])
+                    for idx in bundles.keys())
+
+
+class QueueHeartbeat(threading.Thread):
+    """A background thread sending heartbeats for a claimed bundle while it
+    runs."""
+
+    def __init__(self, bundle_queue, bundle_idx, worker_id, interval=60):
+        """
+        :type bundle_queue: BundleQueue
+        :param bundle_queue: The bundle queue.
+        :type bundle_idx: int
+        :param bundle_idx: The index of the claimed bundle.
+        :type worker_id: str
+        :param worker_id: The worker's name.
+        :type interval: int
+        :param interval: (default: 60) The number of seconds between
+                         heartbeats.
+        """
+
+        super(QueueHeartbeat, self).__init__()
+        self.daemon = True
+        self.bundle_queue = bundle_queue
+        self.bundle_idx = bundle_idx
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.bundle_queue.heartbeat(self.bundle_idx, self.worker_id)
+            except Exception:
+                # try again at the next interval
+                pass
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
@@ -29,6 +29,7 @@ class QAProtocolCLI:
         else:
             self._cloudify = False
             self._bundle_idx = None
+            self._queue_worker = False
 
     def _parse_args(self):
 
@@ -44,6 +45,10 @@ class QAProtocolCLI:
                                 help='Bundle index to run')
         cloudgroup.add_argument('--log_dir', type=str,
                                 help='Directory for workflow logging')
+        cloudgroup.add_argument('--queue_worker', action='store_true',
+                                default=False,
+                                help='Pull bundles from the run\'s bundle '
+                                     'queue until none are left')
 
         # Subject list (YAML file)
         group.add_argument(
@@ -85,11 +90,42 @@ class QAProtocolCLI:
         else:
             self._bundle_idx = None
 
+        self._queue_worker = args.queue_worker
+
         if args.log_dir:
             self._run_log_dir = args.log_dir
         else:
             self._run_log_dir = self._config["output_directory"]
 
+    def task_time_limit_hours(self):
+        """Get the time limit of each cluster task, in hours.
+
+        - Either the configured cluster_time_limit_hours, or twice the
+          predicted wall time of a task plus an hour, with a floor of
+          MIN_TASK_HOURS. A bundle queue task runs bundles one after
+          another, so its prediction is the summed time of all of the
+          bundles.
+
+        :rtype: int
+        :return: The time limit, in whole hours.
+        """
+
+        from math import ceil
+        from qap.resource_estimates import MIN_TASK_HOURS
+
+        if self._config.get("cluster_time_limit_hours"):
+            return int(ceil(float(self._config["cluster_time_limit_hours"])))
+
+        bundle_hours = [cost[0] for cost in self._bundle_costs]
+        if self._config.get("bundle_queue", False):
+            # a task runs bundles one after another until the queue is
+            # empty - at worst, all of them
+            task_hours = sum(bundle_hours)
+        else:
+            task_hours = max(bundle_hours)
+
+        return max(MIN_TASK_HOURS, int(ceil(2 * task_hours)) + 1)
+
     def submit_cluster_batch_file(self, num_bundles):
         """Write the cluster batch file for the appropriate scheduler.
 
@@ -148,8 +184,7 @@ class QAProtocolCLI:
             confirm_str = '(?<=Your job-array )\d+'
             exec_cmd = 'qsub'
         elif self._platform == "SLURM":
-            hrs_limit = 8 * num_bundles
-            time_limit = '%d:00:00' % hrs_limit
+            time_limit = '%d:00:00' % self.task_time_limit_hours()
             config_dict["time_limit"] = time_limit
             env_arr_idx = '$SLURM_ARRAY_TASK_ID'
             batch_file_contents = cluster_templates.slurm_template
@@ -162,10 +197,19 @@ class QAProtocolCLI:
         # Populate string from config dict values
         batch_file_contents = batch_file_contents % config_dict
 
-        run_str = "qap_measures_pipeline.py --bundle_idx %s --log_dir %s %s "\
-                  "%s" % (env_arr_idx, self._run_log_dir,
-                          self._config["subject_list"],
-                          self._config["pipeline_config_yaml"])
+        if self._config.get("bundle_queue", False):
+            # each task pulls bundles from the queue until none are left,
+            # instead of running the bundle matching its task index
+            self.bundle_queue().initialize(num_bundles)
+            run_str = "qap_measures_pipeline.py --queue_worker --log_dir %s "\
+                      "%s %s" % (self._run_log_dir,
+                                 self._config["subject_list"],
+                                 self._config["pipeline_config_yaml"])
+        else:
+            run_str = "qap_measures_pipeline.py --bundle_idx %s --log_dir "\
+                      "%s %s %s" % (env_arr_idx, self._run_log_dir,
+                                    self._config["subject_list"],
+                                    self._config["pipeline_config_yaml"])
 
         batch_file_contents = "\n".join([batch_file_contents, run_str])
 
@@ -201,8 +245,13 @@ class QAProtocolCLI:
         config_options = ["pipeline_name",
                           "num_processors",
                           "num_sessions_at_once",
+                          "num_bundles_at_once",
+                          "bundle_queue",
+                          "execution_engine",
+                          "warm_worker_pool",
                           "available_memory",
                           "cluster_system",
+                          "cluster_time_limit_hours",
                           "output_directory",
                           "working_directory",
                           "template_head_for_anat",
@@ -212,6 +261,13 @@ class QAProtocolCLI:
                           "write_report",
                           "write_graph",
                           "write_all_outputs",
+                          "memmap_timeseries",
+                          "compute_precision",
+                          "image_cache",
+                          "image_cache_size_gb",
+                          "results_store",
+                          "result_cache_dir",
+                          "result_cache_size_gb",
                           "upload_to_s3",
                           "bucket_prefix",
                           "bucket_out_prefix",
@@ -228,8 +284,17 @@ class QAProtocolCLI:
                   "configuration template.\n"
             err += "\n".join([x for x in invalid])
             raise Exception(err)
-        else:
-            return 0
+        if self._config.get("execution_engine", "nipype") not in \
+                ["nipype", "direct"]:
+            err = "\n[!] The execution_engine in your configuration file " \
+                  "must be either 'nipype' or 'direct'.\n"
+            raise Exception(err)
+        if self._config.get("compute_precision", "float64") not in \
+                ["float64", "float32"]:
+            err = "\n[!] The compute_precision in your configuration file " \
+                  "must be either 'float64' or 'float32'.\n"
+            raise Exception(err)
+        return 0
 
     def create_session_dict(self, subdict):
         """Collapse the participant resource pools so that each participant-
@@ -353,23 +418,42 @@ class QAProtocolCLI:
 
         return subdict
 
-    def create_bundles(self):
+    def create_bundles(self, packing=None):
         """Create a list of participant "bundles".
 
+        - The number of bundles is set by the number of sessions per bundle
+          (set by the user), but the sessions are bin-packed into the
+          bundles by their predicted cost (from the scans' header
+          dimensions, time point counts and scan types), so that each
+          bundle has about the same predicted wall time and memory.
+        - The predicted (wall time in hours, memory in GB) of each bundle is
+          kept in self._bundle_costs, and the packing in
+          self._bundle_packing.
+        - If a packing is provided (as written by 'write_bundle_packing' at
+          submission time), the bundles are rebuilt from it instead, without
+          reading any scan headers - so that every cluster task agrees on
+          what each bundle contains.
+
+        :type packing: dict
+        :param packing: (default: None) A bundle packing, as read by
+                        'read_bundle_packing'.
         :rtype: list
         :return: A list of bundles - each bundle being a dictionary that is a
-                 starting resource pool for N sub-session-scan combos with N
-                 being the number of participants per bundle (set by the user)
+                 starting resource pool for the sub-session-scan combos
+                 packed into it
         """
 
+        from math import ceil
         from qap.qap_utils import raise_smart_exception
+        from qap.resource_estimates import estimate_session_cost, \
+            estimate_bundle_hours, pack_bundles
 
-        i = 0
-        bundles = []
+        sessions = []
+        session_costs = []
+        session_tuples = []
 
-        for session_tuple in self._sub_dict.keys():
-            if i == 0:
-                new_bundle = {}
+        for session_tuple in sorted(self._sub_dict.keys()):
+            new_session = {}
             sub = session_tuple[0]
             ses = session_tuple[1]
             site_name = None
@@ -380,24 +464,95 @@ class QAProtocolCLI:
                     # to avoid fields in sub_dict[session_tuple] that are
                     # strings (such as site_name or creds_path)
                     sub_info_tuple = (sub, ses, scan)
-                    new_bundle[sub_info_tuple] = \
+                    new_session[sub_info_tuple] = \
                         self._sub_dict[session_tuple][scan]
                     if site_name:
-                        new_bundle[sub_info_tuple].update({"site_name": site_name})
-            i += 1
-            if i == self._config["num_sessions_at_once"]:
-                bundles.append(new_bundle)
-                i = 0
+                        new_session[sub_info_tuple].update({"site_name": site_name})
+            sessions.append(new_session)
+            session_tuples.append(session_tuple)
+            if not packing:
+                session_costs.append(
+                    estimate_session_cost(self._sub_dict[session_tuple]))
+
+        if len(sessions) == 0:
+            msg = "No bundles created."
+            raise_smart_exception(locals(),msg)
 
-        if i > 0:
+        if packing:
+            session_idx = dict((session_tuple, idx) for idx, session_tuple
+                               in enumerate(session_tuples))
+            try:
+                packed = [[session_idx[tuple(session)] for session in bundle]
+                          for bundle in packing["bundles"]]
+            except KeyError as e:
+                msg = "The bundle packing of this run includes a session " \
+                      "which is not in the participant list: %s" % str(e)
+                raise_smart_exception(locals(), msg)
+            bundle_costs = [tuple(cost) for cost in packing["costs"]]
+        else:
+            num_bundles = int(ceil(
+                len(sessions) / float(self._config["num_sessions_at_once"])))
+            packed = pack_bundles(session_costs, num_bundles)
+            bundle_costs = []
+            for bundle_sessions in packed:
+                costs = [session_costs[idx] for idx in bundle_sessions]
+                bundle_costs.append(
+                    (estimate_bundle_hours(costs,
+                                           self._config.get("num_processors",
+                                                            1)),
+                     sum([cost[1] for cost in costs])))
+
+        bundles = []
+        for bundle_sessions in packed:
+            new_bundle = {}
+            for idx in bundle_sessions:
+                new_bundle.update(sessions[idx])
             bundles.append(new_bundle)
 
-        if len(bundles) == 0:
-            msg = "No bundles created."
-            raise_smart_exception(locals(),msg)
+        self._bundle_costs = bundle_costs
+        self._bundle_packing = \
+            {"bundles": [[list(session_tuples[idx]) for idx in bundle]
+                         for bundle in packed],
+             "costs": [list(cost) for cost in bundle_costs]}
 
         return bundles
 
+    def bundle_packing_file(self):
+        """Get the filepath of the run's bundle packing, kept in the run's
+        log directory.
+
+        :rtype: str
+        :return: The filepath of the bundle packing JSON file.
+        """
+
+        return op.join(self._run_log_dir, "bundle_packing.json")
+
+    def write_bundle_packing(self):
+        """Write which sessions are in each bundle (and the bundles'
+        predicted costs) to the run's log directory, for the run's cluster
+        tasks to read back.
+        """
+
+        import json
+
+        with open(self.bundle_packing_file(), "wt") as f:
+            json.dump(self._bundle_packing, f, indent=2)
+
+    def read_bundle_packing(self):
+        """Read the bundle packing written when the run was submitted.
+
+        :rtype: dict
+        :return: The bundle packing, or None if there is none.
+        """
+
+        from qap.qap_utils import read_json
+
+        if not self._run_log_dir or \
+                not op.isfile(self.bundle_packing_file()):
+            return None
+
+        return read_json(self.bundle_packing_file())
+
     def run_one_bundle(self, bundle_idx, run=True):
         """Execute one bundle's workflow on one node/slot of a cluster/grid.
 
@@ -463,6 +618,259 @@ class QAProtocolCLI:
         else:
             return wfargs
 
+    def _run_one_bundle_in_process(self, bundle_idx, results_queue):
+        """Execute one bundle's workflow in a child process of a local run,
+        and send the results back to the parent process.
+
+        :type bundle_idx: int
+        :param bundle_idx: The bundle ID number.
+        :type results_queue: multiprocessing.Queue
+        :param results_queue: The queue to put the (bundle_idx, results)
+                              tuple onto.
+        """
+
+        try:
+            rt = self.run_one_bundle(bundle_idx)
+        except Exception as e:
+            rt = {'status': 'failed', 'error': str(e)}
+        results_queue.put((bundle_idx, rt))
+
+    def run_bundles_locally(self, num_bundles):
+        """Execute all of the bundles on the local machine, running up to
+        'num_bundles_at_once' bundles at the same time.
+
+        - Each bundle runs in its own process, with its own share of the
+          core and memory budget (already set in self.runargs). As soon as
+          a bundle finishes, the next one is started, so that the serial
+          tail of one bundle's workflow overlaps with the others.
+        - Each bundle writes its own workflow_results.json, as in a serial
+          run.
+
+        :type num_bundles: int
+        :param num_bundles: The total number of bundles in the run.
+        :rtype: list
+        :return: A list of the dictionaries with information about each
+                 bundle's workflow run, in bundle order.
+        """
+
+        import multiprocessing
+        from Queue import Empty
+
+        if self._num_bundles_at_once <= 1:
+            return [self.run_one_bundle(idx)
+                    for idx in range(1, num_bundles+1)]
+
+        results_queue = multiprocessing.Queue()
+        pending = range(1, num_bundles+1)
+        running = {}
+        results = {}
+
+        while pending or running:
+            # keep the bundle slots full
+            while pending and len(running) < self._num_bundles_at_once:
+                idx = pending.pop(0)
+                # not a Pool - the workers need to be able to start their own
+                # MultiProc processes
+                proc = multiprocessing.Process(
+                    target=self._run_one_bundle_in_process,
+                    args=(idx, results_queue))
+                proc.start()
+                running[idx] = proc
+
+            try:
+                idx, rt = results_queue.get(timeout=5)
+                results[idx] = rt
+                running.pop(idx).join()
+            except Empty:
+                # catch bundle processes that died without reporting back -
+                # a process that exited normally has already flushed its
+                # results onto the queue
+                exited = [idx for idx in running.keys()
+                          if not running[idx].is_alive()]
+                try:
+                    while True:
+                        idx, rt = results_queue.get_nowait()
+                        results[idx] = rt
+                        running.pop(idx).join()
+                except Empty:
+                    pass
+                for idx in exited:
+                    if idx in results:
+                        continue
+                    proc = running.pop(idx)
+                    proc.join()
+                    results[idx] = {'status': 'failed',
+                                    'error': 'bundle process exited with '
+                                             'code %s' % proc.exitcode}
+
+        return [results[idx] for idx in sorted(results.keys())]
+
+    def bundle_queue(self):
+        """Get the run's bundle queue, kept in the run's log directory.
+
+        :rtype: BundleQueue
+        :return: The bundle queue.
+        """
+
+        from qap.bundle_queue import BundleQueue
+        return BundleQueue(op.join(self._run_log_dir, "bundle_queue.json"))
+
+    def run_queue_worker(self):
+        """Claim and execute bundles from the run's bundle queue until none
+        are left.
+
+        - While a bundle runs, a background thread sends heartbeats, so that
+          the bundle is only reclaimed by another worker if this one stops
+          (for example, if its cluster task is preempted).
+        - When every unfinished bundle is claimed by another worker, this
+          worker waits and asks again, and only stops once every bundle is
+          finished or failed - so a preempted worker's bundle is still
+          reclaimed once its claim goes stale.
+
+        :rtype: list
+        :return: A list of the dictionaries with information about each
+                 bundle's workflow run, for the bundles this worker ran.
+        """
+
+        import time
+        import socket
+        from qap.bundle_queue import QueueHeartbeat
+
+        queue = self.bundle_queue()
+        queue.initialize(len(self._bundles_list))
+        worker_id = "%s:%d" % (socket.gethostname(), os.getpid())
+
+        results = []
+        while True:
+            bundle_idx = queue.claim(worker_id)
+            if bundle_idx is None:
+                if queue.is_done():
+                    break
+                time.sleep(queue.poll_interval)
+                continue
+
+            heartbeat = QueueHeartbeat(queue, bundle_idx, worker_id,
+                                       interval=queue.stale_after / 4)
+            heartbeat.start()
+            try:
+                rt = self.run_one_bundle(bundle_idx)
+            except Exception as e:
+                rt = {'status': 'failed', 'error': str(e)}
+            finally:
+                heartbeat.stop()
+
+            status = "failed" if rt.get('status') == 'failed' else "finished"
+            queue.release(bundle_idx, worker_id, status)
+
+            rt['bundle_idx'] = bundle_idx
+            results.append(rt)
+
+        return results
+
+    def _run_queue_worker_in_process(self, results_queue):
+        """Run a bundle queue worker in a child process of a local run, and
+        send the results back to the parent process.
+
+        :type results_queue: multiprocessing.Queue
+        :param results_queue: The queue to put the list of results onto.
+        """
+
+        try:
+            results = self.run_queue_worker()
+        except Exception as e:
+            results = [{'status': 'failed', 'error': str(e)}]
+        results_queue.put(results)
+
+    def run_queue_workers_locally(self, num_bundles):
+        """Execute all of the bundles on the local machine with
+        'num_bundles_at_once' bundle queue workers, each pulling bundles
+        from the run's bundle queue until none are left.
+
+        :type num_bundles: int
+        :param num_bundles: The total number of bundles in the run.
+        :rtype: list
+        :return: A list of the dictionaries with information about each
+                 bundle's workflow run, in bundle order.
+        """
+
+        import multiprocessing
+        from Queue import Empty
+
+        self.bundle_queue().initialize(num_bundles)
+
+        results_queue = multiprocessing.Queue()
+        workers = []
+        for worker in range(0, self._num_bundles_at_once):
+            proc = multiprocessing.Process(
+                target=self._run_queue_worker_in_process,
+                args=(results_queue,))
+            proc.start()
+            workers.append(proc)
+
+        results = []
+        remaining = len(workers)
+        while remaining:
+            try:
+                results += results_queue.get(timeout=5)
+                remaining -= 1
+            except Empty:
+                # a worker that died without reporting back leaves its
+                # bundle claimed in the queue
+                if not any([proc.is_alive() for proc in workers]):
+                    try:
+                        while True:
+                            results += results_queue.get_nowait()
+                    except Empty:
+                        break
+        for proc in workers:
+            proc.join()
+
+        return sorted(results, key=lambda rt: rt.get('bundle_idx'))
+
+    def split_local_resources(self, num_bundles):
+        """Split the core and memory budget across the bundles running at
+        once locally.
+
+        - Every bundle is given at least the predicted peak memory of the
+          most memory-hungry node of the run's sessions. If the memory
+          budget cannot cover that for 'num_bundles_at_once' bundles, fewer
+          bundles are run at once. If it cannot cover even one, one bundle
+          runs at a time with the whole budget (its node estimates are
+          capped to it), and a warning is printed.
+
+        :type num_bundles: int
+        :param num_bundles: The number of bundles in the run.
+        """
+
+        from qap.resource_estimates import estimate_peak_node_memory
+
+        available_memory = float(self._config["available_memory"])
+        num_processors = self._config["num_processors"]
+
+        num_at_once = max(1, min(self._num_bundles_at_once, num_bundles,
+                                 num_processors))
+
+        node_memory = \
+            estimate_peak_node_memory(self._sub_dict.values())
+        if node_memory > available_memory:
+            print "\n[!] WARNING: The largest node of this run is predicted " \
+                  "to need %.1f GB of memory, more than the %s GB of " \
+                  "'available_memory' - running one bundle at a time.\n" \
+                  % (node_memory, self._config["available_memory"])
+            num_at_once = 1
+        elif node_memory > 0 and \
+                available_memory / num_at_once < node_memory:
+            num_at_once = max(1, int(available_memory / node_memory))
+            print "Running %d bundles at once, so that each bundle has the " \
+                  "%.1f GB of memory its largest node needs." \
+                  % (num_at_once, node_memory)
+
+        self._num_bundles_at_once = num_at_once
+        self.runargs['plugin_args']['n_procs'] = \
+            max(1, num_processors / num_at_once)
+        self.runargs['plugin_args']['memory_gb'] = \
+            available_memory / num_at_once
+
     def run(self, config_file=None, partic_list=None):
         """Establish where and how we're running the pipeline and set up the
         run. (Entry point)
@@ -503,7 +911,8 @@ class QAProtocolCLI:
         check_config_settings(self._config, "output_directory")
         check_config_settings(self._config, "working_directory")
 
-        self._num_bundles_at_once = 1
+        self._num_bundles_at_once = \
+            int(self._config.get("num_bundles_at_once", 1))
         write_report = self._config.get('write_report', False)
 
         if "cluster_system" in self._config.keys() and not self._bundle_idx:
@@ -574,11 +983,18 @@ class QAProtocolCLI:
         # flatten the participant dictionary
         self._sub_dict = self.create_session_dict(subdict)
 
-        # create the list of bundles
-        self._bundles_list = self.create_bundles()
+        # create the list of bundles - a cluster task uses the packing
+        # written when the run was submitted
+        packing = None
+        if self._bundle_idx or self._queue_worker:
+            packing = self.read_bundle_packing()
+        self._bundles_list = self.create_bundles(packing)
         num_bundles = len(self._bundles_list)
 
-        if not self._bundle_idx:
+        if not self._platform and not self._bundle_idx:
+            self.split_local_resources(num_bundles)
+
+        if not self._bundle_idx and not self._queue_worker:
             # want to initialize the run-level log directory (not the bundle-
             # level) only the first time we run the script, due to the
             # timestamp. if sub-nodes are being kicked off by a batch file on
@@ -600,15 +1016,24 @@ class QAProtocolCLI:
                     else:
                         pass
 
+        if not self._bundle_idx and not self._queue_worker:
+            self.write_bundle_packing()
+
         if num_bundles == 1:
             self._config["num_sessions_at_once"] = \
                 len(self._bundles_list[0])
 
         # Start the magic
-        if not self._platform and not self._bundle_idx:
+        if self._queue_worker:
+            # a cluster task pulling bundles from the run's bundle queue
+            results = self.run_queue_worker()
+
+        elif not self._platform and not self._bundle_idx:
             # not a cluster/grid run
-            for idx in range(1, num_bundles+1):
-                results.append(self.run_one_bundle(idx))
+            if self._config.get("bundle_queue", False):
+                results = self.run_queue_workers_locally(num_bundles)
+            else:
+                results = self.run_bundles_locally(num_bundles)
 
         elif not self._bundle_idx:
             # there is a self._bundle_idx only if the pipeline runner is run
@@ -640,6 +1065,98 @@ def starter_node_func(starter):
     return starter
 
 
+def restore_cached_results(cached, resource_pool, output_dir, id_string,
+                           keep_outputs=False):
+    """Update a participant's resource pool with the results found in the
+    result cache, and write them back into the output directory.
+
+    :type cached: dict
+    :param cached: The cache entry, as returned by ResultCache.get, or None
+                   if there is no entry.
+    :type resource_pool: dict
+    :param resource_pool: The participant's resource pool.
+    :type output_dir: str
+    :param output_dir: The participant's output directory.
+    :type id_string: str
+    :param id_string: The participant's "sub session scan" JSON key.
+    :type keep_outputs: bool
+    :param keep_outputs: (default: False) Whether to also restore the cached
+                         intermediate outputs (write_all_outputs).
+    :rtype: dict
+    :return: The updated resource pool.
+    """
+
+    import shutil
+    from qap.qap_utils import write_json
+    from qap.result_cache import CACHED_SECTIONS
+
+    if not cached:
+        return resource_pool
+
+    results = cached["results"]
+    top_level = dict((key, value) for key, value in results.items()
+                     if key not in CACHED_SECTIONS.keys())
+
+    for section in results.keys():
+        if section not in CACHED_SECTIONS.keys():
+            continue
+        json_name, resource = CACHED_SECTIONS[section]
+        entry = dict(top_level)
+        entry[section] = results[section]
+        write_json({id_string: entry}, op.join(output_dir, json_name))
+        resource_pool[resource] = results[section]
+
+    if keep_outputs:
+        for resource, cached_file in cached["outputs"].items():
+            if resource in resource_pool.keys():
+                continue
+            resource_dir = op.join(output_dir, resource)
+            out_file = op.join(resource_dir, op.basename(cached_file))
+            if not op.isfile(out_file):
+                if not op.isdir(resource_dir):
+                    os.makedirs(resource_dir)
+                shutil.copy(cached_file, out_file)
+            resource_pool[resource] = out_file
+
+    return resource_pool
+
+
+def store_cached_results(result_cache, cache_key, output_dir, id_string,
+                         keep_outputs=False):
+    """Store a participant's results from its output directory into the
+    result cache.
+
+    :type result_cache: ResultCache
+    :param result_cache: The result cache.
+    :type cache_key: str
+    :param cache_key: The participant's cache key.
+    :type output_dir: str
+    :param output_dir: The participant's output directory.
+    :type id_string: str
+    :param id_string: The participant's "sub session scan" JSON key.
+    :type keep_outputs: bool
+    :param keep_outputs: (default: False) Whether to also store the
+                         intermediate outputs (write_all_outputs).
+    """
+
+    from qap.qap_utils import read_json
+    from qap.result_cache import CACHED_SECTIONS
+
+    results = {}
+    for json_name in set([val[0] for val in CACHED_SECTIONS.values()]):
+        json_file = op.join(output_dir, json_name)
+        if op.isfile(json_file):
+            results.update(read_json(json_file).get(id_string, {}))
+
+    if not results:
+        return
+
+    if keep_outputs:
+        result_cache.put(cache_key, results, output_dir)
+    else:
+        result_cache.put(cache_key, results)
+
+
 def run_workflow(args, run=True):
     """Connect and execute the QAP Nipype workflow for one bundle of data.
 
@@ -726,6 +1243,26 @@ def run_workflow(args, run=True):
     starter_node.inputs.starter = ""
 
     new_outputs = 0
+    participant_scans = {}
+
+    # content-addressed cache of previous results, if enabled
+    result_cache = None
+    cache_entries = {}
+    if config.get('result_cache_dir'):
+        from qap.result_cache import ResultCache
+        result_cache = ResultCache(config['result_cache_dir'],
+                                   config.get('result_cache_size_gb', 5))
+
+    # append-only store of the results written by the bundle, if enabled
+    results_store = None
+    output_dirs = []
+    if config.get('results_store', False):
+        from qap.results_store import ResultsStore
+        config['results_store_file'] = op.join(bundle_log_dir,
+                                               "qap_results.jsonl")
+        results_store = ResultsStore(config['results_store_file'])
+        # the records of an earlier run of this bundle are not exported
+        results_store.rotate()
 
     # iterate over each subject in the bundle
     logger.info("Starting bundle %s out of %s.." % (str(bundle_idx),
@@ -797,11 +1334,17 @@ def run_workflow(args, run=True):
         rt[name] = {'id': sub_id, 'session': session_id, 'scan': scan_id,
                     'resource_pool': str(resource_pool)}
 
+        # the raw scans, to scale the node resource estimates from
+        participant_scans[name] = \
+            dict((key, resource_pool[key]) for key in resource_pool.keys()
+                 if key in ["anatomical_scan", "functional_scan"])
+
         logger.info("Participant info: %s" % name)
 
         # set output directory
         output_dir = op.join(config["output_directory"], run_name,
                              sub_id, session_id, scan_id)
+        output_dirs.append(output_dir)
 
         try:
             os.makedirs(output_dir)
@@ -826,9 +1369,25 @@ def run_workflow(args, run=True):
                      "functional_spatial", 
                      "functional_temporal"]
 
+        if result_cache:
+            # the cache decides what is already done, instead of what is
+            # found in the output directory - the output directory contents
+            # may be from different input files
+            cache_key = result_cache.key(resource_pool, config)
+            cache_entries[name] = (cache_key, output_dir,
+                                   "%s %s %s" % (sub_id, session_id, scan_id))
+            resource_pool = restore_cached_results(result_cache.get(cache_key),
+                                                   resource_pool, output_dir,
+                                                   cache_entries[name][2],
+                                                   keep_outputs)
+            logger.info("Result cache key for %s: %s" % (name, cache_key))
+            existing_outputs = []
+        else:
+            existing_outputs = os.listdir(output_dir)
+
         # update that resource pool with what's already in the output
         # directory
-        for resource in os.listdir(output_dir):
+        for resource in existing_outputs:
             if (op.exists(op.join(output_dir, resource)) and
                     resource not in resource_pool.keys()):
                 try:
@@ -961,17 +1520,58 @@ def run_workflow(args, run=True):
                                     "".join([run_name, ".dot"])),
                 simple_form=False)
         if run:
+            # per-node memory and thread estimates for the MultiProc
+            # scheduler
+            from qap.resource_estimates import set_node_resources
+            node_resources = set_node_resources(
+                workflow, participant_scans, runargs.get("plugin_args", {}),
+                op.join(config["output_directory"], "callback.log"))
+            logger.info("Node resource estimates (GB, threads): %s"
+                        % str(node_resources))
             try:
-                logger.info("Running with plugin %s" % runargs["plugin"])
-                logger.info("Using plugin args %s" % runargs["plugin_args"])
-                workflow.run(plugin=runargs["plugin"],
-                             plugin_args=runargs["plugin_args"])
+                if config.get('execution_engine', 'nipype') == 'direct':
+                    from qap.direct_executor import run_workflow_directly
+                    logger.info("Running with the direct executor")
+                    run_workflow_directly(
+                        workflow,
+                        runargs["plugin_args"].get("n_procs", 1),
+                        runargs["plugin_args"].get("memory_gb"),
+                        warm_pool=config.get('warm_worker_pool', False))
+                else:
+                    logger.info("Running with plugin %s" % runargs["plugin"])
+                    logger.info("Using plugin args %s"
+                                % runargs["plugin_args"])
+                    plugin = runargs["plugin"]
+                    if config.get('warm_worker_pool', False) and \
+                            plugin == 'MultiProc':
+                        # re-use this process's pre-imported workers
+                        from qap.worker_pool import WarmMultiProcPlugin
+                        plugin = WarmMultiProcPlugin(
+                            plugin_args=runargs["plugin_args"])
+                    workflow.run(plugin=plugin,
+                                 plugin_args=runargs["plugin_args"])
+                if results_store:
+                    results_store.export(output_dirs)
+                    results_store.compact()
                 rt['status'] = 'finished'
                 logger.info("Workflow run finished for bundle %s."
                             % str(bundle_idx))
+                if result_cache:
+                    for cache_key, output_dir, id_string in \
+                            cache_entries.values():
+                        store_cached_results(result_cache, cache_key,
+                                             output_dir, id_string,
+                                             keep_outputs)
             except Exception as e:  # TODO We should be more specific here ...
                 errmsg = e
                 rt.update({'status': 'failed'})
+                if results_store:
+                    # keep the results of the participants which finished
+                    try:
+                        results_store.export(output_dirs)
+                    except Exception as export_err:
+                        logger.error("Results store export failed: %s"
+                                     % export_err)
                 logger.info("Workflow run failed for bundle %s."
                             % str(bundle_idx))
                 # ... however this is run inside a pool.map: do not raise
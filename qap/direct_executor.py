@@ -0,0 +1,228 @@
+import os
+import os.path as op
+
+
+def run_node_interface(interface, node_dir):
+    """Run one node's interface in its own working directory.
+
+    :type interface: Nipype interface object
+    :param interface: The node's interface, with all of its inputs set.
+    :type node_dir: str
+    :param node_dir: The node's working directory.
+    :rtype: dict
+    :return: A dictionary of the interface's outputs.
+    """
+
+    if not op.isdir(node_dir):
+        try:
+            os.makedirs(node_dir)
+        except OSError:
+            if not op.isdir(node_dir):
+                raise
+
+    cwd = os.getcwd()
+    os.chdir(node_dir)
+    try:
+        result = interface.run()
+    finally:
+        os.chdir(cwd)
+
+    if result.outputs is None:
+        return {}
+
+    try:
+        return result.outputs.get()
+    except TypeError:
+        return result.outputs.dictcopy()
+
+
+def run_node_in_worker(interface, node_dir):
+    """Run one node's interface in a pool worker, catching its failure so
+    that the executor is called back for failed nodes too.
+
+    :type interface: Nipype interface object
+    :param interface: The node's interface, with all of its inputs set.
+    :type node_dir: str
+    :param node_dir: The node's working directory.
+    :rtype: tuple
+    :return: A tuple of the interface's output dictionary and None, or of
+             None and the error message if the node failed.
+    """
+
+    import pickle
+
+    try:
+        outputs = run_node_interface(interface, node_dir)
+        # outputs which cannot be sent back would never reach the callback
+        pickle.dumps(outputs, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        return None, str(e)
+
+    return outputs, None
+
+
+def connect_node_inputs(graph, node, node_outputs):
+    """Set a node's connected inputs from the outputs of the nodes upstream
+    of it, the way Nipype does when it loads their results files.
+
+    :type graph: NetworkX graph
+    :param graph: The workflow's flat dependency graph.
+    :type node: Nipype node object
+    :param node: The node to set the inputs of.
+    :type node_outputs: dict
+    :param node_outputs: A dictionary mapping the nodes already run to their
+                         output dictionaries.
+    """
+
+    from nipype.interfaces.base import isdefined
+    from nipype.pipeline.engine.utils import evaluate_connect_function
+
+    for upstream in graph.predecessors(node):
+        outputs = node_outputs[upstream]
+        for source_info, dest_name in graph[upstream][node]['connect']:
+            if isinstance(source_info, tuple):
+                value = outputs.get(source_info[0])
+                if value is None or not isdefined(value):
+                    continue
+                value = evaluate_connect_function(source_info[1],
+                                                  source_info[2], value)
+            else:
+                value = outputs.get(source_info)
+            node.set_input(dest_name, value)
+
+
+def run_workflow_directly(workflow, n_procs=1, memory_gb=None,
+                          warm_pool=False):
+    """Execute a Nipype workflow's dependency graph with direct calls to its
+    nodes' interfaces, bypassing the Nipype execution engine.
+
+    - The same graph (and resource pool connections) built for Nipype is
+      run, and each node runs in the same working directory Nipype would
+      use, so the DataSink nodes write the same output layout.
+    - There is no node hashing, pickled results files, per-node "_report"
+      directories, or re-use of previous results in the working directory -
+      every node runs each time.
+    - Independent nodes run on a process pool of 'n_procs' processes,
+      keeping within the nodes' num_threads and estimated_memory_gb.
+    - The executor waits on the pool's callbacks for finished nodes, rather
+      than polling for them.
+    - Like a Nipype run, the nodes downstream of a failed node are skipped,
+      the rest of the graph still runs, and an exception is raised at the
+      end.
+
+    :type workflow: Nipype workflow object
+    :param workflow: The workflow to run, with all of its nodes connected.
+    :type n_procs: int
+    :param n_procs: (default: 1) The number of processors to run nodes on.
+    :type memory_gb: float
+    :param memory_gb: (default: None) The memory budget for the nodes
+                      running at once, in GB.
+    :type warm_pool: bool
+    :param warm_pool: (default: False) Run the nodes on the process's
+                      persistent pool of pre-imported workers (see
+                      qap.worker_pool), instead of on a new pool.
+    :rtype: dict
+    :return: A dictionary mapping node names to their output dictionaries.
+    """
+
+    import multiprocessing
+    try:
+        import Queue as queue
+    except ImportError:
+        import queue
+    import networkx as nx
+
+    graph = workflow._create_flat_graph()
+    order = list(nx.topological_sort(graph))
+    for node in order:
+        node.base_dir = workflow.base_dir
+
+    n_procs = max(1, int(n_procs or 1))
+    pool = None
+    if n_procs > 1 and warm_pool:
+        from qap.worker_pool import get_warm_pool
+        pool = get_warm_pool(n_procs)
+    elif n_procs > 1:
+        pool = multiprocessing.Pool(n_procs)
+
+    node_outputs = {}
+    failed = {}
+    pending = list(order)
+    running = set()
+    finished = queue.Queue()
+    busy_procs = 0
+    busy_memory_gb = 0.0
+
+    try:
+        while pending or running:
+            # skip the nodes downstream of a failed node
+            for node in list(pending):
+                if any([upstream in failed for upstream in
+                        graph.predecessors(node)]):
+                    pending.remove(node)
+                    failed[node] = "an upstream node failed"
+
+            for node in list(pending):
+                if not all([upstream in node_outputs for upstream in
+                            graph.predecessors(node)]):
+                    continue
+
+                num_threads = min(n_procs, node.interface.num_threads)
+                node_memory_gb = node.interface.estimated_memory_gb
+                if running and (busy_procs + num_threads > n_procs or
+                                (memory_gb and busy_memory_gb +
+                                 node_memory_gb > memory_gb)):
+                    continue
+
+                pending.remove(node)
+                connect_node_inputs(graph, node, node_outputs)
+
+                if pool is None:
+                    try:
+                        node_outputs[node] = \
+                            run_node_interface(node.interface,
+                                               node.output_dir())
+                    except Exception as e:
+                        failed[node] = str(e)
+                    continue
+
+                pool.apply_async(
+                    run_node_in_worker, (node.interface, node.output_dir()),
+                    callback=lambda result, node=node:
+                        finished.put((node, result)))
+                running.add(node)
+                busy_procs += num_threads
+                busy_memory_gb += node_memory_gb
+
+            if not running:
+                continue
+
+            # block until a node finishes, then collect any others which
+            # have finished meanwhile
+            done = [finished.get()]
+            while not finished.empty():
+                done.append(finished.get())
+
+            for node, (outputs, error) in done:
+                running.remove(node)
+                if error is None:
+                    node_outputs[node] = outputs
+                else:
+                    failed[node] = error
+                busy_procs -= min(n_procs, node.interface.num_threads)
+                busy_memory_gb -= node.interface.estimated_memory_gb
+
+    finally:
+        if pool is not None and not warm_pool:
+            pool.close()
+            pool.join()
+
+    if failed:
+        err = "\n\n[!] Workflow did not execute cleanly. The following " \
+              "nodes failed:\n%s\n\n" \
+              % "\n".join(["%s: %s" % (node.name, failed[node])
+                           for node in failed.keys()])
+        raise RuntimeError(err)
+
+    return dict((node.name, node_outputs[node])
+                for node in node_outputs.keys())
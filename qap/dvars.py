@@ -1,25 +1,34 @@
 import numpy as np
 
 
-def remove_zero_variance_voxels(func_timeseries, mask):
+def remove_zero_variance_voxels(func_timeseries, mask, slices_per_block=8):
     """Modify a head mask to exclude timeseries voxels which have zero 
     variance.
 
+    - The variance over time is computed for blocks of slices (along the
+      first axis) at a time, so that only one block's worth of temporary
+      arrays is held in memory.
+    - As before, voxels whose variance truncates to zero (i.e. is below 1)
+      are excluded. The variance is accumulated in float64, whatever the
+      dtype of the timeseries.
+
     :type func_timeseries: Nibabel data
     :param func_timeseries: The 4D functional timeseries.
     :type mask: Nibabel data
     :param mask: The binary head mask.
+    :type slices_per_block: int
+    :param slices_per_block: (default: 8) How many slices of the first axis
+                             to compute the variance over at once.
     :rtype: Nibabel data
     :return: The binary head mask, but with voxels of zero variance excluded.
     """
 
-    # this needs optimization/refactoring
-    for i in range(0, len(func_timeseries)):
-        for j in range(0, len(func_timeseries[0])):
-            for k in range(0, len(func_timeseries[0][0])):
-                var = func_timeseries[i][j][k].var()
-                if int(var) == 0:
-                    mask[i][j][k] = mask[i][j][k] * 0
+    slices_per_block = max(int(slices_per_block), 1)
+
+    for start in range(0, func_timeseries.shape[0], slices_per_block):
+        stop = start + slices_per_block
+        var = func_timeseries[start:stop].var(axis=-1, dtype=np.float64)
+        mask[start:stop][var < 1] = 0
 
     return mask
 
@@ -42,27 +51,218 @@ def load(func_file, mask_file, check4d=True):
              variance excluded.
     """
 
-    import nibabel as nib
-    from qap_utils import raise_smart_exception
+    func_ts = MaskedTimeseries(func_file, mask_file, check4d=check4d)
 
-    try:
-        func_img = nib.load(func_file)
-        mask_img = nib.load(mask_file)
-    except:
-        raise_smart_exception(locals())
+    return func_ts.data
 
-    mask = mask_img.get_data()
-    func = func_img.get_data().astype(np.float)
 
-    if check4d and len(func.shape) != 4:
-        err = "Input functional %s should be 4-dimensional" % func_file
-        raise_smart_exception(locals(),err)
+def iter_volume_chunks(func_img, volumes_per_chunk=16):
+    """Read a 4D NIFTI image a few volumes at a time, in one pass over its
+    file.
+
+    - The volumes are stored one after another in the file, so reading them
+      in order reads a gzipped file through once, and only one chunk of
+      volumes is held in memory at a time.
 
-    mask_var_filtered = remove_zero_variance_voxels(func, mask)
+    :type func_img: Nibabel image
+    :param func_img: The 4D functional timeseries image.
+    :type volumes_per_chunk: int
+    :param volumes_per_chunk: (default: 16) How many volumes to read at
+                              once.
+    :rtype: generator
+    :return: Tuples of the index of the first volume of the chunk, and the
+             chunk as an (x, y, z, nvols) array in the compute precision.
+    """
+
+    import nibabel as nib
+    from nibabel.openers import ImageOpener
+    from nibabel.volumeutils import array_from_file, apply_read_scaling
+    from qap.qap_utils import get_compute_dtype
+
+    dtype = get_compute_dtype()
+    vol_shape = tuple(func_img.shape[:3])
+    ntpts = func_img.shape[3]
+    proxy = func_img.dataobj
+
+    if not nib.is_proxy(proxy):
+        # already in memory
+        for start in range(0, ntpts, volumes_per_chunk):
+            yield start, np.asarray(
+                proxy[..., start:start + volumes_per_chunk], dtype=dtype)
+        return
+
+    vol_bytes = int(np.prod(vol_shape)) * proxy.dtype.itemsize
+
+    with ImageOpener(func_img.file_map["image"].filename, "rb") as fileobj:
+        for start in range(0, ntpts, volumes_per_chunk):
+            num_vols = min(volumes_per_chunk, ntpts - start)
+            raw = array_from_file(vol_shape + (num_vols,), proxy.dtype,
+                                  fileobj, proxy.offset + start * vol_bytes,
+                                  order="F", mmap=False)
+            yield start, np.asarray(apply_read_scaling(raw, proxy.slope,
+                                                       proxy.inter),
+                                    dtype=dtype)
+
+
+class MaskedTimeseries(object):
+    """The functional timeseries of one scan, loaded, validated and masked
+    once so that it can be shared by all of the temporal QAP measures.
+
+    - The NIFTI file is only decompressed and upcast once, and the
+      zero-variance voxel filtering is only run once, no matter how many
+      measures are calculated from it.
+    - The timeseries is held in the compute precision set with
+      'qap_utils.set_compute_precision' (float64 by default).
+    - The image is read a few volumes at a time (see 'iter_volume_chunks')
+      straight into the 4D array, so only one full copy of the timeseries is
+      ever made.
+    - If a spill directory is provided, the arrays are memory-mapped files
+      in that directory, filled chunk by chunk and then served as read-only
+      views, for runs too large to comfortably hold in RAM - the peak memory
+      use is then bounded by the chunk size. Call 'close' when done to
+      remove them.
+
+    Attributes
+      - func: The full 4D functional timeseries.
+      - mask: The binary brain mask, with zero-variance voxels excluded.
+      - data: The masked timeseries, with shape (ntpts, nvoxs).
+    """
 
-    func = func[mask_var_filtered.nonzero()].T # will have ntpts x nvoxs
-    
-    return func
+    def __init__(self, func_file, mask_file, check4d=True, spill_dir=None,
+                 image_cache=None):
+        """Load the functional timeseries and brain mask, and extract the
+        masked timeseries.
+
+        :type func_file: str
+        :param func_file: Filepath to the NIFTI file containing the 4D
+                          functional timeseries.
+        :type mask_file: str
+        :param mask_file: Filepath to the NIFTI file containing the binary
+                          functional brain mask.
+        :type check4d: bool
+        :param check4d: (default: True) Check the timeseries data to ensure
+                        it is four dimensional.
+        :type spill_dir: str
+        :param spill_dir: (default: None) A directory to write memory-mapped
+                          copies of the arrays to, instead of holding them in
+                          memory.
+        :type image_cache: ImageCache
+        :param image_cache: (default: None) The run's image cache, to read
+                            the timeseries and mask through.
+        """
+
+        import nibabel as nib
+        from qap_utils import raise_smart_exception
+        from qap.qap_utils import get_compute_dtype
+
+        self.func_file = func_file
+        self.mask_file = mask_file
+        self._spill_dir = None
+
+        try:
+            if image_cache:
+                func_img = image_cache.load(func_file)
+                mask_img = image_cache.load(mask_file)
+            else:
+                func_img = nib.load(func_file)
+                mask_img = nib.load(mask_file)
+        except:
+            raise_smart_exception(locals())
+
+        mask = mask_img.get_data()
+        if image_cache:
+            # a read-only view of the cached copy - the zero-variance voxels
+            # are removed in place
+            mask = np.array(mask)
+
+        if check4d and len(func_img.shape) != 4:
+            err = "Input functional %s should be 4-dimensional" % func_file
+            raise_smart_exception(locals(),err)
+
+        dtype = get_compute_dtype()
+        if spill_dir:
+            import tempfile
+            self._spill_dir = tempfile.mkdtemp(prefix="qap_timeseries_",
+                                               dir=spill_dir)
+            func = self._spill_empty("func", func_img.shape, dtype)
+        else:
+            func = np.empty(func_img.shape, dtype=dtype)
+
+        if len(func_img.shape) == 4:
+            for start, chunk in iter_volume_chunks(func_img):
+                func[..., start:start + chunk.shape[-1]] = chunk
+        else:
+            func[...] = func_img.get_data()
+
+        if self._spill_dir:
+            func = self._read_only(func)
+
+        self.func = func
+        self.mask = remove_zero_variance_voxels(func, mask)
+
+        if self._spill_dir:
+            # extracted in slabs, straight into the memory-mapped file
+            data = self._spill_empty("data", (func.shape[-1],
+                                              np.count_nonzero(self.mask)),
+                                     dtype)
+            offset = 0
+            for start in range(0, func.shape[0], 8):
+                slab_idx = self.mask[start:start + 8].nonzero()
+                num_voxels = len(slab_idx[0])
+                data[:, offset:offset + num_voxels] = \
+                    func[start:start + 8][slab_idx].T
+                offset += num_voxels
+            data = self._read_only(data)
+        else:
+            data = func[self.mask.nonzero()].T # will have ntpts x nvoxs
+        self.data = data
+
+    def _spill_empty(self, name, shape, dtype):
+        """Create a writable memory-mapped array in the spill directory.
+
+        :type name: str
+        :param name: The name of the array, used for the filename.
+        :type shape: tuple
+        :param shape: The shape of the array.
+        :type dtype: NumPy dtype
+        :param dtype: The dtype of the array.
+        :rtype: NumPy memmap
+        :return: The writable memory-mapped array.
+        """
+
+        import os
+
+        filepath = os.path.join(self._spill_dir, "%s.dat" % name)
+
+        return np.memmap(filepath, dtype=dtype, mode="w+", shape=shape)
+
+    def _read_only(self, array):
+        """Flush a memory-mapped array filled in from '_spill_empty' and
+        return a read-only view of it.
+
+        :type array: NumPy memmap
+        :param array: The written memory-mapped array.
+        :rtype: NumPy memmap
+        :return: A read-only memory-mapped view of the written array.
+        """
+
+        array.flush()
+
+        return np.memmap(array.filename, dtype=array.dtype, mode="r",
+                         shape=array.shape)
+
+    def close(self):
+        """Release the arrays, and remove any memory-mapped spill files."""
+
+        import shutil
+
+        self.func = None
+        self.mask = None
+        self.data = None
+
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
 
 
 def robust_stdev(func):
@@ -111,31 +311,247 @@ def ar_nitime(x, order=1, center=False):
     return ak[0]
 
 
-def ar1(func, method=ar_nitime):
-    """Apply the 'ar_nitime' function across the centered functional 
+def ar_yule_walker(func, order=1, center=False, voxels_per_chunk=10000):
+    """Estimate the first AR(p) model coefficient of every voxel's timeseries
+    at once, using the Yule-Walker equations.
+
+    - Gives the same values as applying 'ar_nitime' to each voxel's
+      timeseries, but the autocorrelations are computed as matrix reductions
+      over chunks of voxels instead of with one FFT per voxel.
+    - For order 1 the coefficient is the ratio of the lag-1 to the lag-0
+      autocorrelation; for higher orders, the Toeplitz systems of all of the
+      voxels in a chunk are solved together.
+    - Each chunk is worked on in the compute precision (see
+      'qap_utils.set_compute_precision'), but the autocorrelations are
+      always accumulated in float64.
+
+    :type func: NumPy array
+    :param func: The functional timeseries data, with shape (ntpts, nvoxs).
+    :type order: int
+    :param order: (default: 1) The order of the autoregressive model.
+    :type center: bool
+    :param center: (default: False) Whether to center (demean) each
+                   timeseries first.
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 10000) How many voxels to process at
+                             once, to bound the size of temporary arrays.
+    :rtype: NumPy array
+    :return: The vector of the first AR coefficient of each voxel.
+    """
+
+    from qap.qap_utils import get_compute_dtype
+
+    ntpts, nvoxs = func.shape
+    ar_vals = np.empty(nvoxs)
+    dtype = get_compute_dtype()
+
+    for start in range(0, nvoxs, voxels_per_chunk):
+        chunk = np.asarray(func[:, start:start + voxels_per_chunk],
+                           dtype=dtype)
+        if center:
+            chunk = chunk - chunk.mean(0, dtype=np.float64).astype(dtype)
+
+        # biased autocorrelation at lags 0..order, as in nitime.utils
+        r_m = np.empty((order + 1, chunk.shape[1]))
+        for lag in range(0, order + 1):
+            r_m[lag] = np.einsum('ij,ij->j', chunk[lag:],
+                                 chunk[:ntpts - lag],
+                                 dtype=np.float64) / ntpts
+
+        if order == 1:
+            ar_vals[start:start + chunk.shape[1]] = r_m[1] / r_m[0]
+        else:
+            lags = np.abs(np.subtract.outer(np.arange(order),
+                                            np.arange(order)))
+            # (nvoxs, order, order) stack of Toeplitz matrices
+            Tm = r_m[lags].transpose(2, 0, 1)
+            y = r_m[1:].T[:, :, np.newaxis]
+            ak = np.linalg.solve(Tm, y)
+            ar_vals[start:start + chunk.shape[1]] = ak[:, 0, 0]
+
+    return ar_vals
+
+
+def ar1(func, method=None):
+    """Calculate the AR1 value of each voxel across the centered functional
     timeseries.
 
+    - By default this uses the vectorized 'ar_yule_walker' estimator. Any
+      per-voxel function (such as 'ar_nitime', kept as the reference
+      implementation) can be passed in as the method instead, and it will be
+      applied to each voxel's timeseries in turn.
+
     :type func: Nibabel data
     :param func: The functional timeseries data.
     :type method: Python function
-    :param method: (default: ar_nitime) The algorithm to use to calculate AR1.
+    :param method: (default: None) A per-voxel algorithm to use to calculate
+                   AR1, instead of the vectorized estimator.
     :rtype: NumPy array
     :return: The vector of AR1 values.
     """
-    func_centered = func - func.mean(0)
-    ar_vals = np.apply_along_axis(method, 0, func_centered)
+    func_centered = func - func.mean(0, dtype=np.float64).astype(func.dtype)
+    if method is None:
+        ar_vals = ar_yule_walker(func_centered, order=1)
+    else:
+        ar_vals = np.apply_along_axis(method, 0, func_centered)
     return ar_vals
 
 
-def calc_dvars(func_file, mask_file, output_all=False):
-    """Calculate the standardized DVARS metric.
+def iter_voxel_blocks(func, voxels_per_chunk=10000):
+    """Read a masked functional timeseries in blocks of voxels.
+
+    :type func: NumPy array
+    :param func: The masked functional timeseries data, with shape
+                 (ntpts, nvoxs) - in memory, or memory-mapped.
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 10000) How many voxels to read at
+                             once.
+    :rtype: generator
+    :return: The blocks of the timeseries, as (ntpts, nvoxs_block) arrays
+             in the compute precision.
+    """
+
+    from qap.qap_utils import get_compute_dtype
+
+    dtype = get_compute_dtype()
+
+    for start in range(0, func.shape[1], voxels_per_chunk):
+        yield np.asarray(func[:, start:start + voxels_per_chunk],
+                         dtype=dtype)
+
+
+def iter_image_blocks(func_file, mask_file, slices_per_block=8,
+                      check4d=True, image_cache=None):
+    """Read the masked functional timeseries of a NIFTI file in blocks of
+    slices, without loading the whole image.
+
+    - Each block is a slab of slices along the last spatial axis, which is
+      contiguous in the file for every timepoint. Voxels with zero variance
+      are excluded, as in 'remove_zero_variance_voxels'.
+    - Uncompressed images (including the copies in the run's image cache)
+      are memory-mapped, so only the slab being read is in memory. Without
+      an image cache, a gzipped timeseries is decompressed once into a
+      temporary directory in the current working directory (instead of up
+      to the slab on every read), which is removed when the generator is
+      exhausted or closed.
 
     :type func_file: str
-    :param func_file: The filepath to the NIFTI file containing the functional
-                       timeseries.
+    :param func_file: Filepath to the NIFTI file containing the 4D functional
+                      timeseries.
     :type mask_file: str
-    :param mask_file: The filepath to the NIFTI file containing the binary
+    :param mask_file: Filepath to the NIFTI file containing the binary
                       functional brain mask.
+    :type slices_per_block: int
+    :param slices_per_block: (default: 8) How many slices to read at once.
+    :type check4d: bool
+    :param check4d: (default: True) Check the timeseries data to ensure it is
+                    four dimensional.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        timeseries and mask through.
+    :rtype: generator
+    :return: The blocks of the masked timeseries, as (ntpts, nvoxs_block)
+             arrays in the compute precision.
+    """
+
+    import os
+    import shutil
+    import tempfile
+    import nibabel as nib
+    from qap_utils import raise_smart_exception
+    from qap.qap_utils import get_compute_dtype
+
+    temp_dir = None
+    if not image_cache and func_file.endswith(".gz"):
+        from qap.image_cache import ImageCache
+        temp_dir = tempfile.mkdtemp(prefix="qap_blocks_", dir=os.getcwd())
+        image_cache = ImageCache(temp_dir)
+
+    try:
+        try:
+            if image_cache:
+                func_img = image_cache.load(func_file)
+                mask_img = image_cache.load(mask_file)
+            else:
+                func_img = nib.load(func_file, mmap=True)
+                mask_img = nib.load(mask_file)
+        except:
+            raise_smart_exception(locals())
+
+        if check4d and len(func_img.shape) != 4:
+            err = "Input functional %s should be 4-dimensional" % func_file
+            raise_smart_exception(locals(),err)
+
+        mask = mask_img.get_data()
+        slices_per_block = max(int(slices_per_block), 1)
+        dtype = get_compute_dtype()
+
+        for start in range(0, func_img.shape[2], slices_per_block):
+            stop = start + slices_per_block
+            slab_mask = np.array(mask[:, :, start:stop])
+            if not slab_mask.any():
+                continue
+            slab = np.asarray(func_img.dataobj[:, :, start:stop],
+                              dtype=dtype)
+            slab_mask[slab.var(axis=-1, dtype=np.float64) < 1] = 0
+            yield slab[slab_mask.nonzero()].T
+    finally:
+        if temp_dir:
+            image_cache.release_all()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _accumulate_row_moments(moments, block):
+    """Merge the mean and the sum of squared deviations of each row of a
+    block into running totals over all of the blocks seen so far.
+
+    - The totals are combined with the pairwise update of Chan et al., which
+      stays accurate however many blocks are merged. The block may be in
+      float32, but the moments are always accumulated in float64.
+
+    :type moments: list
+    :param moments: The running [count, mean, sum of squared deviations] of
+                    the rows, or None for the first block.
+    :type block: NumPy array
+    :param block: The block, with one row per timepoint.
+    :rtype: list
+    :return: The updated [count, mean, sum of squared deviations].
+    """
+
+    count = block.shape[1]
+    mean = block.mean(axis=1, dtype=np.float64)
+    deviations = block - mean[:, np.newaxis].astype(block.dtype)
+    m2 = np.einsum('ij,ij->i', deviations, deviations, dtype=np.float64)
+
+    if moments is None:
+        return [count, mean, m2]
+
+    total_count, total_mean, total_m2 = moments
+    new_count = total_count + count
+    delta = mean - total_mean
+    total_mean = total_mean + delta * count / float(new_count)
+    total_m2 = total_m2 + m2 + \
+        delta ** 2 * total_count * count / float(new_count)
+
+    return [new_count, total_mean, total_m2]
+
+
+def calc_dvars_from_blocks(blocks, output_all=False):
+    """Calculate the standardized DVARS metric from a masked functional
+    timeseries read in blocks of voxels, holding only one block at a time.
+
+    - The robust standard deviation, AR1 and predicted standard deviation of
+      the temporal derivative are per-voxel, so they are computed block by
+      block. Across the voxels, only the running mean and sum of squared
+      deviations of each timepoint's derivative (plain and voxelwise-
+      standardized) and the sum of the predicted standard deviations are
+      kept, which is all that the three DVARS versions need.
+    - Peak memory is bounded by the block size, however long the run.
+
+    :type blocks: iterable
+    :param blocks: The blocks of the masked timeseries, as (ntpts,
+                   nvoxs_block) arrays (see 'iter_voxel_blocks' and
+                   'iter_image_blocks').
     :type output_all: bool
     :param output_all: (default: False) Whether to output all versions of
                        DVARS measure (non-standardized, standardized and
@@ -146,31 +562,48 @@ def calc_dvars(func_file, mask_file, output_all=False):
 
     from qap_utils import raise_smart_exception
 
-    # load data
-    func = load(func_file, mask_file)
+    deriv_moments = None
+    deriv_vx_stdz_moments = None
+    sum_sd_pd = 0.0
+
+    for func in blocks:
+        if func.shape[1] == 0:
+            continue
 
-    # Robust standard deviation
-    func_sd = robust_stdev(func)
-    
-    # AR1
-    func_ar1 = ar1(func)
+        # Robust standard deviation
+        func_sd = robust_stdev(func)
 
-    # Predicted standard deviation of temporal derivative
-    func_sd_pd = np.sqrt(2 * (1 - func_ar1)) * func_sd
-    diff_sd_mean= func_sd_pd.mean()
+        # AR1
+        func_ar1 = ar1(func)
 
-    # Compute temporal difference time series 
-    func_deriv = np.diff(func, axis=0)
+        # Predicted standard deviation of temporal derivative
+        func_sd_pd = np.sqrt(2 * (1 - func_ar1)) * func_sd
+        sum_sd_pd += func_sd_pd.sum()
+
+        # Compute temporal difference time series
+        func_deriv = np.diff(func, axis=0)
+        deriv_moments = _accumulate_row_moments(deriv_moments, func_deriv)
+
+        # voxelwise standardization
+        func_deriv /= func_sd_pd
+        deriv_vx_stdz_moments = \
+            _accumulate_row_moments(deriv_vx_stdz_moments, func_deriv)
+
+    if deriv_moments is None:
+        err = "The masked functional timeseries has no voxels."
+        raise_smart_exception(locals(),err)
+
+    nvoxs = deriv_moments[0]
+    diff_sd_mean = sum_sd_pd / nvoxs
 
     # DVARS
     # (no standardization)
-    dvars_plain = func_deriv.std(1, ddof=1) # TODO: Why are we not ^2 this & getting the sqrt?
+    dvars_plain = np.sqrt(deriv_moments[2] / (nvoxs - 1)) # TODO: Why are we not ^2 this & getting the sqrt?
     # standardization
-    dvars_stdz  = dvars_plain/diff_sd_mean
+    dvars_stdz = dvars_plain/diff_sd_mean
     # voxelwise standardization
-    diff_vx_stdz = func_deriv/func_sd_pd
-    dvars_vx_stdz = diff_vx_stdz.std(1, ddof=1)
-    
+    dvars_vx_stdz = np.sqrt(deriv_vx_stdz_moments[2] / (nvoxs - 1))
+
     if output_all:
         try:
             out = np.vstack((dvars_stdz, dvars_plain, dvars_vx_stdz))
@@ -181,5 +614,66 @@ def calc_dvars(func_file, mask_file, output_all=False):
             out = dvars_stdz.reshape(len(dvars_stdz), 1)
         except:
             raise_smart_exception(locals())
-    
+
     return out
+
+
+def calc_dvars(func_file, mask_file, output_all=False, slices_per_block=8,
+               image_cache=None):
+    """Calculate the standardized DVARS metric.
+
+    - The timeseries is read and processed in blocks of slices (see
+      'iter_image_blocks' and 'calc_dvars_from_blocks'), so the whole image
+      is never held in memory.
+
+    :type func_file: str
+    :param func_file: The filepath to the NIFTI file containing the functional
+                       timeseries.
+    :type mask_file: str
+    :param mask_file: The filepath to the NIFTI file containing the binary
+                      functional brain mask.
+    :type output_all: bool
+    :param output_all: (default: False) Whether to output all versions of
+                       DVARS measure (non-standardized, standardized and
+                       voxelwise standardized).
+    :type slices_per_block: int
+    :param slices_per_block: (default: 8) How many slices of the timeseries
+                             to process at once, to bound memory use.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        timeseries and mask through.
+    :rtype: NumPy array
+    :return: The output DVARS values vector.
+    """
+
+    blocks = iter_image_blocks(func_file, mask_file, slices_per_block,
+                               image_cache=image_cache)
+
+    return calc_dvars_from_blocks(blocks, output_all=output_all)
+
+
+def calc_dvars_from_data(func, output_all=False, voxels_per_chunk=10000):
+    """Calculate the standardized DVARS metric from an already-loaded masked
+    functional timeseries.
+
+    - The timeseries is processed in blocks of voxels (see
+      'calc_dvars_from_blocks'), so the temporary arrays are bounded by the
+      block size, and a memory-mapped timeseries is only read a block at a
+      time.
+
+    :type func: NumPy array
+    :param func: The masked functional timeseries data, with shape
+                 (ntpts, nvoxs), such as the 'data' of a MaskedTimeseries.
+    :type output_all: bool
+    :param output_all: (default: False) Whether to output all versions of
+                       DVARS measure (non-standardized, standardized and
+                       voxelwise standardized).
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 10000) How many voxels to process at
+                             once, to bound the size of temporary arrays.
+    :rtype: NumPy array
+    :return: The output DVARS values vector.
+    """
+
+    return calc_dvars_from_blocks(iter_voxel_blocks(func, voxels_per_chunk),
+                                  output_all=output_all)
@@ -0,0 +1,319 @@
+import os
+import os.path as op
+import socket
+import time
+
+
+class ImageCache(object):
+    """A run's cache of decompressed NIFTI images, so that each gzipped input
+    is inflated once and every later load is a read-only memory map of the
+    uncompressed copy (served from the page cache).
+
+    - The cache is a directory of uncompressed ".nii" files named by a hash
+      of each input's path, size and modification time, shared by all of
+      the processes of the run. Copies are written atomically, so processes
+      decompressing the same input at once do not clash.
+    - Uncompressed inputs are memory-mapped where they are, without a copy.
+    - Every load takes a reference on its copy, which is dropped with
+      release(). While a process holds a reference, it keeps a lease file
+      next to the copy, which pins it for every process sharing the cache.
+      Once the cache is over its size cap, the least recently used copies
+      without a lease are removed. Leases and evictions are taken under a
+      lock on the cache directory, so a copy cannot be removed between a
+      load finding it and reading it.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=2, lease_timeout=86400,
+                 lock_timeout=60):
+        """
+        :type cache_dir: str
+        :param cache_dir: The directory to keep the decompressed copies in.
+        :type max_size_gb: float
+        :param max_size_gb: (default: 2) The size cap of the cache, in GB.
+        :type lease_timeout: int
+        :param lease_timeout: (default: 86400) The number of seconds after
+                              which a lease held by a process on another
+                              host (which cannot be checked) is treated as
+                              left behind.
+        :type lock_timeout: int
+        :param lock_timeout: (default: 60) The number of seconds to wait for
+                             the cache's lock before treating it as left
+                             behind by a dead process, and breaking it.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_size_gb = float(max_size_gb)
+        self.lease_timeout = lease_timeout
+        self.lock_timeout = lock_timeout
+        self._refcounts = {}
+        self._host = socket.gethostname()
+
+        if not op.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not op.isdir(self.cache_dir):
+                    raise
+
+    def cached_path(self, image_file):
+        """Get the filepath of an image's uncompressed copy.
+
+        :type image_file: str
+        :param image_file: The filepath of the NIFTI image.
+        :rtype: str
+        :return: The filepath of the uncompressed image to memory-map - the
+                 image itself if it is not compressed.
+        """
+
+        import hashlib
+
+        image_file = op.realpath(image_file)
+        if not image_file.endswith(".gz"):
+            return image_file
+
+        stat = os.stat(image_file)
+        key = hashlib.sha1("%s %d %r" % (image_file, stat.st_size,
+                                         stat.st_mtime)).hexdigest()
+
+        return op.join(self.cache_dir, "%s.nii" % key)
+
+    def _lock(self):
+        """Acquire the lock on the cache directory.
+
+        :rtype: lockfile.FileLock
+        :return: The acquired lock.
+        """
+
+        from lockfile import FileLock, AlreadyLocked
+
+        lock = FileLock(op.join(self.cache_dir, "image_cache"))
+        start = time.time()
+
+        # the lock is only ever held to take leases or remove copies
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except AlreadyLocked:
+                if time.time() - start > self.lock_timeout:
+                    lock.break_lock()
+                else:
+                    time.sleep(0.05)
+
+    def _lease_path(self, cached_file):
+        """Get the filepath of this process's lease on a copy.
+
+        :type cached_file: str
+        :param cached_file: The filepath of the uncompressed copy.
+        :rtype: str
+        :return: The filepath of the lease file.
+        """
+
+        return "%s.%d@%s.lease" % (cached_file, os.getpid(), self._host)
+
+    def _take_lease(self, cached_file):
+        """Pin a copy for every process sharing the cache.
+
+        :type cached_file: str
+        :param cached_file: The filepath of the uncompressed copy.
+        """
+
+        lock = self._lock()
+        try:
+            with open(self._lease_path(cached_file), "a"):
+                pass
+            os.utime(self._lease_path(cached_file), None)
+        finally:
+            lock.release()
+
+    def _drop_lease(self, cached_file):
+        """Unpin a copy pinned by this process.
+
+        :type cached_file: str
+        :param cached_file: The filepath of the uncompressed copy.
+        """
+
+        try:
+            os.remove(self._lease_path(cached_file))
+        except OSError:
+            pass
+
+    def _lease_is_live(self, lease_file):
+        """Check whether the process holding a lease may still be using
+        its copy.
+
+        :type lease_file: str
+        :param lease_file: The filepath of the lease file.
+        :rtype: bool
+        :return: Whether the lease still pins its copy.
+        """
+
+        pid, host = lease_file[:-len(".lease")].rsplit(".nii.", 1)[1].split(
+            "@", 1)
+
+        if host == self._host:
+            try:
+                os.kill(int(pid), 0)
+            except OSError:
+                return False
+            return True
+
+        try:
+            return time.time() - os.path.getmtime(lease_file) < \
+                self.lease_timeout
+        except OSError:
+            return False
+
+    def _decompress(self, image_file, cached_file):
+        """Write the uncompressed copy of a gzipped image.
+
+        :type image_file: str
+        :param image_file: The filepath of the gzipped NIFTI image.
+        :type cached_file: str
+        :param cached_file: The filepath of the uncompressed copy.
+        """
+
+        import gzip
+        import shutil
+
+        tmp_file = "%s.%d.tmp" % (cached_file, os.getpid())
+        in_file = gzip.open(image_file, "rb")
+        try:
+            with open(tmp_file, "wb") as out_file:
+                shutil.copyfileobj(in_file, out_file, 16*1024*1024)
+        finally:
+            in_file.close()
+        os.rename(tmp_file, cached_file)
+
+    def load(self, image_file):
+        """Load an image, decompressing it into the cache on first use.
+
+        :type image_file: str
+        :param image_file: The filepath of the NIFTI image.
+        :rtype: Nibabel image
+        :return: The image, with its data as a read-only memory map (unless
+                 the header's scaling has to be applied).
+        """
+
+        import nibabel as nb
+
+        cached_file = self.cached_path(image_file)
+        in_cache = cached_file != op.realpath(image_file)
+
+        if in_cache and not self._refcounts.get(cached_file, 0):
+            # pinned before it is looked for, so no other process can
+            # remove it from here on
+            self._take_lease(cached_file)
+        self._refcounts[cached_file] = \
+            self._refcounts.get(cached_file, 0) + 1
+
+        if not op.isfile(cached_file):
+            self._decompress(image_file, cached_file)
+        elif in_cache:
+            # mark it as recently used
+            os.utime(cached_file, None)
+
+        self.evict()
+
+        return nb.load(cached_file, mmap="r")
+
+    def release(self, image_file):
+        """Drop a reference taken by load().
+
+        :type image_file: str
+        :param image_file: The filepath of the NIFTI image.
+        """
+
+        cached_file = self.cached_path(image_file)
+
+        if self._refcounts.get(cached_file, 0) > 1:
+            self._refcounts[cached_file] -= 1
+        elif self._refcounts.pop(cached_file, None) is not None:
+            self._drop_lease(cached_file)
+
+    def release_all(self):
+        """Drop every reference taken by this cache object."""
+
+        for cached_file in self._refcounts.keys():
+            self._drop_lease(cached_file)
+        self._refcounts = {}
+
+    def _entries(self):
+        """List the copies in the cache.
+
+        :rtype: list
+        :return: A list of (last use time, size in bytes, filepath) tuples.
+        """
+
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".nii"):
+                continue
+            filepath = op.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+
+        return entries
+
+    def size(self):
+        """Get the total size of the cache's copies.
+
+        :rtype: float
+        :return: The size of the cache, in GB.
+        """
+
+        return sum([entry[1] for entry in self._entries()]) / 1024.0**3
+
+    def _leased(self):
+        """Find the copies pinned by a live lease, and clear the leases left
+        behind by dead processes.
+
+        :rtype: set
+        :return: The filepaths of the pinned copies.
+        """
+
+        leased = set()
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".lease"):
+                continue
+            lease_file = op.join(self.cache_dir, filename)
+            if self._lease_is_live(lease_file):
+                leased.add("%s.nii" % lease_file.rsplit(".nii.", 1)[0])
+            else:
+                try:
+                    os.remove(lease_file)
+                except OSError:
+                    pass
+
+        return leased
+
+    def evict(self):
+        """Remove the least recently used copies without a lease until the
+        cache is within its size cap."""
+
+        max_size = self.max_size_gb * 1024**3
+        if sum([entry[1] for entry in self._entries()]) <= max_size:
+            return
+
+        lock = self._lock()
+        try:
+            entries = sorted(self._entries())
+            total_size = sum([entry[1] for entry in entries])
+            leased = self._leased()
+
+            for last_used, size, filepath in entries:
+                if total_size <= max_size:
+                    break
+                if filepath in leased:
+                    continue
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+                total_size -= size
+        finally:
+            lock.release()
@@ -1,4 +1,72 @@
 
+COMPUTE_PRECISIONS = ["float64", "float32"]
+
+_compute_precision = "float64"
+
+
+def set_compute_precision(precision):
+    """Set the floating point precision the QAP measures are computed in.
+
+    - In "float32" mode the image data are worked on in single precision,
+      which halves the working set of the voxel-wise calculations; sums,
+      means and variances are still accumulated in float64.
+
+    :type precision: str
+    :param precision: Either "float64" (the default) or "float32".
+    """
+
+    from qap.qap_utils import raise_smart_exception
+
+    global _compute_precision
+
+    if precision not in COMPUTE_PRECISIONS:
+        err = "\n\n[!] The compute precision must be one of %s, got: " \
+              "%s\n\n" % (", ".join(COMPUTE_PRECISIONS), precision)
+        raise_smart_exception(locals(), err)
+
+    _compute_precision = precision
+
+
+def compute_precision(precision):
+    """Compute the QAP measures in the given precision within a with-block,
+    and restore the previous precision when the block exits, even if it
+    fails.
+
+    - Nipype runs several nodes in the same process with the Linear and
+      direct executors, so a node must not leave its precision behind.
+
+    :type precision: str
+    :param precision: Either "float64" or "float32".
+    :rtype: context manager
+    :return: A context manager scoping the compute precision.
+    """
+
+    from contextlib import contextmanager
+
+    @contextmanager
+    def scope():
+        previous = _compute_precision
+        set_compute_precision(precision)
+        try:
+            yield
+        finally:
+            set_compute_precision(previous)
+
+    return scope()
+
+
+def get_compute_dtype():
+    """Return the dtype the QAP measures are currently computed in.
+
+    :rtype: NumPy dtype
+    :return: The working dtype set by set_compute_precision.
+    """
+
+    import numpy as np
+
+    return np.dtype(_compute_precision)
+
+
 def create_expr_string(clip_level_value):
     """Create the expression arg string to run AFNI 3dcalc via Nipype.
 
@@ -13,11 +81,14 @@ def create_expr_string(clip_level_value):
     return expr_string
 
 
-def read_nifti_image(nifti_infile):
+def read_nifti_image(nifti_infile, image_cache=None):
     """Read a NIFTI file into Nibabel-format image data.
 
     :type nifti_infile: str
     :param nifti_infile: The filepath of the NIFTI image to read in.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        image through.
     :rtype: Nibabel image
     :return: Image data in Nibabel format.
     """
@@ -26,7 +97,10 @@ def read_nifti_image(nifti_infile):
     from qap.qap_utils import raise_smart_exception
 
     try:
-        nifti_img = nb.load(nifti_infile)
+        if image_cache:
+            nifti_img = image_cache.load(nifti_infile)
+        else:
+            nifti_img = nb.load(nifti_infile)
     except:
         err = "\n\n[!] Could not load the NIFTI image using Nibabel:\n" \
               "%s\n\n" % nifti_infile
@@ -79,6 +153,40 @@ def read_json(json_filename):
     return json_dict
 
 
+def json_value(value):
+    """Convert a QAP measure or header value into a plain Python number for
+    the JSON output files, so that it is stored as a number and not a
+    string.
+
+    - NaN and infinite values (e.g. a measure undefined for an empty mask)
+      are returned as None, which is written as null: NaN and Infinity are
+      not valid JSON.
+
+    :type value: object
+    :param value: The measure or header value (a Python or NumPy scalar, a
+                  0-d array, or anything else).
+    :rtype: int, float, str or None
+    :return: The value as an int or a float if it is a single finite number,
+             None if it is a NaN or infinite number, and a string otherwise.
+    """
+
+    import numpy as np
+
+    if isinstance(value, basestring):
+        return str(value)
+
+    array = np.asarray(value)
+    if array.ndim == 0:
+        if array.dtype.kind in "biu":
+            return int(array)
+        if array.dtype.kind == "f":
+            if not np.isfinite(array):
+                return None
+            return float(array)
+
+    return str(value)
+
+
 def write_json(output_dict, json_file):
     """Either update or write a dictionary to a JSON file.
 
@@ -123,12 +231,39 @@ def write_json(output_dict, json_file):
         return json_file
 
 
-def load_image(image_file):
+def append_json_record(output_dict, json_file, results_store_file):
+    """Record a dictionary meant for a JSON file in the run's append-only
+    results store, instead of updating the JSON file itself.
+
+    - The JSON file is written when the store is exported (see
+      qap.results_store.ResultsStore).
+
+    :type output_dict: dict
+    :param output_dict: The dictionary to write or append to the JSON file.
+    :type json_file: str
+    :param json_file: The filepath of the JSON file the results belong to.
+    :type results_store_file: str
+    :param results_store_file: The filepath of the results store's log.
+    :rtype: str
+    :return: Filepath of the JSON file the results belong to.
+    """
+
+    from qap.results_store import ResultsStore
+
+    ResultsStore(results_store_file).append(json_file, output_dict)
+
+    return json_file
+
+
+def load_image(image_file, image_cache=None):
     """Load a raw scan image from a NIFTI file and check it.
 
     :type image_file: str
     :param image_file: Path to the image, usually a structural or functional
                        scan.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        image through.
     :rtype: Nibabel data
     :return: Image data in Nibabel format.
     """
@@ -138,7 +273,10 @@ def load_image(image_file):
     from qap.qap_utils import raise_smart_exception
 
     try:
-        img = nib.load(image_file)
+        if image_cache:
+            img = image_cache.load(image_file)
+        else:
+            img = nib.load(image_file)
     except:
         raise_smart_exception(locals())
 
@@ -166,51 +304,97 @@ def load_image(image_file):
     return dat
 
 
-def load_mask(mask_file, ref_file):
+# the reference image headers already read by this process, by filepath
+_reference_headers = {}
+
+
+def read_reference_header(ref_file, image_cache=None):
+    """Read the shape and affine of a reference image from its header,
+    caching them for the next mask checked against the same image.
+
+    :type ref_file: str
+    :param ref_file: Filepath to the reference image.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        image through.
+    :rtype: tuple
+    :return: The image's shape, and its affine matrix.
+    """
+
+    import os
+
+    from qap.qap_utils import read_nifti_image
+
+    # a file re-written in place gets a new entry
+    key = (os.path.realpath(ref_file), os.path.getmtime(ref_file))
+    if key not in _reference_headers.keys():
+        ref_img = read_nifti_image(ref_file, image_cache)
+        _reference_headers[key] = (ref_img.shape, ref_img.get_affine())
+
+    return _reference_headers[key]
+
+
+def load_mask(mask_file, ref_file, image_cache=None):
     """Load a mask from a NIFTI file and check the shape and dimensions.
 
+    - The mask's shape and affine are checked against the reference image's
+      from the headers alone, before any data is read.
+    - The mask is checked to be binary (only 0s and 1s, and both of them)
+      with counting passes over the data, instead of sorting it.
+
     :type mask_file: str
     :param mask_file: Filepath to the binarized mask file.
     :type ref_file: str
     :param ref_file: Filepath to the anatomical file the mask is meant for.
-    :rtype: Nibabel data
-    :return: The mask data in Nibabel format.
+    :type image_cache: ImageCache
+    :param image_cache: (default: None) The run's image cache, to read the
+                        mask and reference image through.
+    :rtype: NumPy array
+    :return: The mask data, as an array of uint8 0s and 1s.
     """
 
     import nibabel as nib
     import numpy as np
 
-    from qap.qap_utils import raise_smart_exception
+    from qap.qap_utils import raise_smart_exception, read_reference_header
 
     try:
-        mask_img = nib.load(mask_file)
+        if image_cache:
+            mask_img = image_cache.load(mask_file)
+        else:
+            mask_img = nib.load(mask_file)
     except:
         raise_smart_exception(locals())
 
-    mask_dat = mask_img.get_data()
-    ref_img = nib.load(ref_file)
-
-    # Check that the specified mask is binary.
-    mask_vals = np.unique(mask_dat)
-    if (mask_vals.size != 2) or not (mask_vals == [0, 1]).all():
-        err = "Error: Mask is not binary, has %i unique val(s) of %s " \
-              "(see file %s)" % (mask_vals.size, mask_vals, mask_file)
-        raise_smart_exception(locals(),err)
+    ref_shape, ref_affine = read_reference_header(ref_file, image_cache)
 
     # Verify that the mask and anatomical images have the same dimensions.
-    if ref_img.shape != mask_img.shape:
+    if ref_shape != mask_img.shape:
         err = "Error: Mask and anatomical image are different dimensions " \
               "for %s" % mask_file
         raise_smart_exception(locals(),err)
 
     # Verify that the mask and anatomical images are in the same space
     # (have the same affine matrix)
-    if (mask_img.get_affine() == ref_img.get_affine()).all == False:
+    if not np.allclose(mask_img.get_affine(), ref_affine, atol=1e-4):
         err = "Error: Mask and anatomical image are not in the same space " \
               "for %s vs %s" % (mask_file, ref_file)
         raise_smart_exception(locals(),err)
 
-    return mask_dat
+    mask_dat = mask_img.get_data()
+
+    # Check that the specified mask is binary.
+    mask_bool = mask_dat == 1
+    num_ones = np.count_nonzero(mask_bool)
+    num_zeros = np.count_nonzero(mask_dat == 0)
+    if num_ones == 0 or num_zeros == 0 or \
+            num_ones + num_zeros != mask_dat.size:
+        mask_vals = np.unique(mask_dat)
+        err = "Error: Mask is not binary, has %i unique val(s) of %s " \
+              "(see file %s)" % (mask_vals.size, mask_vals, mask_file)
+        raise_smart_exception(locals(),err)
+
+    return mask_bool.view(np.uint8)
 
 
 def create_anatomical_background_mask(anatomical_data, fg_mask_data, 
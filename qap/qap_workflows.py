@@ -242,6 +242,48 @@ def run_qap_mask(anatomical_reorient, allineate_out_xfm,
         return workflow, workflow.base_dir
 
 
+def create_json_writer_node(node_name, out_json, config):
+    """Create the node which writes a dictionary of results to an output
+    JSON file.
+
+    - If the "results_store" option is enabled, the node records the
+      dictionary in the bundle's append-only results store instead, which
+      is exported to the JSON files when the bundle finishes.
+
+    :type node_name: str
+    :param node_name: The name of the node.
+    :type out_json: str
+    :param out_json: The filepath of the output JSON file.
+    :type config: dict
+    :param config: A dictionary defining the configuration settings for the
+                   workflow.
+    :rtype: Nipype node object
+    :return: The node, with an "output_dict" input to connect.
+    """
+
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.utility as niu
+    from qap_utils import write_json, append_json_record
+
+    if config.get('results_store_file'):
+        json_node = pe.Node(niu.Function(
+                                input_names=["output_dict", "json_file",
+                                             "results_store_file"],
+                                output_names=["json_file"],
+                                function=append_json_record),
+                            name=node_name)
+        json_node.inputs.results_store_file = config['results_store_file']
+    else:
+        json_node = pe.Node(niu.Function(
+                                input_names=["output_dict", "json_file"],
+                                output_names=["json_file"],
+                                function=write_json),
+                            name=node_name)
+    json_node.inputs.json_file = out_json
+
+    return json_node
+
+
 def qap_gather_header_info(workflow, resource_pool, config, name="_",
                            data_type="anatomical"):
     """Build and run a Nipype workflow to extract the NIFTI header information
@@ -293,7 +335,6 @@ def qap_gather_header_info(workflow, resource_pool, config, name="_",
     import nipype.pipeline.engine as pe
     import nipype.interfaces.utility as niu
     from qap_workflows_utils import create_header_dict_entry
-    from qap_utils import write_json
 
     gather_header = pe.Node(niu.Function(
                              input_names=['in_file', 'subject', 'session',
@@ -318,13 +359,8 @@ def qap_gather_header_info(workflow, resource_pool, config, name="_",
         config["subject_id"], config["session_id"], config["scan_id"])
     out_json = op.join(out_dir, "qap_%s.json" % data_type)
 
-    header_to_json = pe.Node(niu.Function(
-                                 input_names=["output_dict",
-                                              "json_file"],
-                                 output_names=["json_file"],
-                                 function=write_json),
-                             name="qap_header_to_json%s" % name)
-    header_to_json.inputs.json_file = out_json
+    header_to_json = create_json_writer_node(
+        "qap_header_to_json%s" % name, out_json, config)
 
     workflow.connect(gather_header, 'qap_dict', header_to_json, 'output_dict')
     resource_pool['%s_header_info' % data_type] = out_json
@@ -392,7 +428,7 @@ def qap_anatomical_spatial_workflow(workflow, resource_pool, config, name="_",
     import nipype.interfaces.utility as niu
     from qap_workflows_utils import qap_anatomical_spatial
     from qap.viz.interfaces import PlotMosaic
-    from qap_utils import check_config_settings, write_json
+    from qap_utils import check_config_settings
 
     check_config_settings(config, "template_head_for_anat")
 
@@ -437,6 +473,7 @@ def qap_anatomical_spatial_workflow(workflow, resource_pool, config, name="_",
                      'anatomical_gm_mask', 'anatomical_wm_mask',
                      'anatomical_csf_mask', 'subject_id', 'session_id',
                      'scan_id', 'site_name', 'exclude_zeroes',
+                     'image_cache_dir', 'image_cache_size_gb', 'precision',
                      'starter'],
         output_names=['qc'], function=qap_anatomical_spatial),
         name='qap_anatomical_spatial%s' % name)
@@ -446,6 +483,12 @@ def qap_anatomical_spatial_workflow(workflow, resource_pool, config, name="_",
     spatial.inputs.session_id = config['session_id']
     spatial.inputs.scan_id = config['scan_id']
     spatial.inputs.exclude_zeroes = config['exclude_zeros']
+    spatial.inputs.precision = config.get('compute_precision', 'float64')
+    if config.get('image_cache', False):
+        spatial.inputs.image_cache_dir = \
+            op.join(config['working_directory'], 'image_cache')
+        spatial.inputs.image_cache_size_gb = \
+            config.get('image_cache_size_gb', 2)
 
     node, out_file = resource_pool['starter']
     workflow.connect(node, out_file, spatial, 'starter')
@@ -522,13 +565,8 @@ def qap_anatomical_spatial_workflow(workflow, resource_pool, config, name="_",
         config["subject_id"], config["session_id"], config["scan_id"])
     out_json = op.join(out_dir, "qap_anatomical.json")
 
-    spatial_to_json = pe.Node(niu.Function(
-                                  input_names=["output_dict",
-                                               "json_file"],
-                                  output_names=["json_file"],
-                                  function=write_json),
-                              name="qap_anatomical_spatial_to_json%s" % name)
-    spatial_to_json.inputs.json_file = out_json
+    spatial_to_json = create_json_writer_node(
+        "qap_anatomical_spatial_to_json%s" % name, out_json, config)
 
     workflow.connect(spatial, 'qc', spatial_to_json, 'output_dict')
     resource_pool['qap_anatomical_spatial'] = out_json
@@ -792,7 +830,6 @@ def qap_functional_spatial_workflow(workflow, resource_pool, config, name="_"):
     import nipype.pipeline.engine as pe
     import nipype.interfaces.utility as niu
     from qap_workflows_utils import qap_functional_spatial
-    from qap_utils import write_json
     from qap.viz.interfaces import PlotMosaic
 
     if 'mean_functional' not in resource_pool.keys():
@@ -813,7 +850,8 @@ def qap_functional_spatial_workflow(workflow, resource_pool, config, name="_"):
 
     spatial_epi = pe.Node(niu.Function(
         input_names=['mean_epi', 'func_brain_mask', 'direction', 'subject_id',
-                     'session_id', 'scan_id', 'site_name', 'starter'],
+                     'session_id', 'scan_id', 'site_name', 'image_cache_dir',
+                     'image_cache_size_gb', 'precision', 'starter'],
         output_names=['qc'], function=qap_functional_spatial),
         name='qap_functional_spatial%s' % name)
 
@@ -825,6 +863,12 @@ def qap_functional_spatial_workflow(workflow, resource_pool, config, name="_"):
     spatial_epi.inputs.subject_id = config['subject_id']
     spatial_epi.inputs.session_id = config['session_id']
     spatial_epi.inputs.scan_id = config['scan_id']
+    spatial_epi.inputs.precision = config.get('compute_precision', 'float64')
+    if config.get('image_cache', False):
+        spatial_epi.inputs.image_cache_dir = \
+            op.join(config['working_directory'], 'image_cache')
+        spatial_epi.inputs.image_cache_size_gb = \
+            config.get('image_cache_size_gb', 2)
 
     if 'site_name' in config.keys():
         spatial_epi.inputs.site_name = config['site_name']
@@ -865,13 +909,8 @@ def qap_functional_spatial_workflow(workflow, resource_pool, config, name="_"):
         config["subject_id"], config["session_id"], config["scan_id"])
     out_json = op.join(out_dir, "qap_functional.json")
 
-    spatial_epi_to_json = pe.Node(niu.Function(
-                                  input_names=["output_dict",
-                                               "json_file"],
-                                  output_names=["json_file"],
-                                  function=write_json),
-                              name="qap_functional_spatial_to_json%s" % name)
-    spatial_epi_to_json.inputs.json_file = out_json
+    spatial_epi_to_json = create_json_writer_node(
+        "qap_functional_spatial_to_json%s" % name, out_json, config)
 
     workflow.connect(spatial_epi, 'qc', spatial_epi_to_json, 'output_dict')
 
@@ -1130,7 +1169,6 @@ def qap_functional_temporal_workflow(workflow, resource_pool, config, name="_"):
     import nipype.interfaces.utility as niu
 
     from qap_workflows_utils import qap_functional_temporal
-    from qap_utils import write_json
     from temporal_qc import fd_jenkinson
     from qap.viz.interfaces import PlotMosaic, PlotFD
 
@@ -1159,8 +1197,10 @@ def qap_functional_temporal_workflow(workflow, resource_pool, config, name="_"):
             return workflow, resource_pool
 
     fd = pe.Node(niu.Function(
-        input_names=['in_file'], output_names=['out_file'],
+        input_names=['in_file', 'out_array'], output_names=['out_file'],
         function=fd_jenkinson), name='generate_FD_file%s' % name)
+    # pass the FD values on in memory, unless the FD plot needs the file
+    fd.inputs.out_array = not config.get('write_report', False)
 
     if 'mcflirt_rel_rms' in resource_pool.keys():
         fd.inputs.in_file = resource_pool['mcflirt_rel_rms']
@@ -1174,13 +1214,23 @@ def qap_functional_temporal_workflow(workflow, resource_pool, config, name="_"):
     temporal = pe.Node(niu.Function(
         input_names=['func_timeseries', 'func_brain_mask',
                      'bg_func_brain_mask', 'fd_file', 'subject_id',
-                     'session_id', 'scan_id', 'site_name', 'starter'],
+                     'session_id', 'scan_id', 'site_name',
+                     'spill_timeseries', 'image_cache_dir',
+                     'image_cache_size_gb', 'precision', 'starter'],
         output_names=['qc'],
         function=qap_functional_temporal),
         name='qap_functional_temporal%s' % name)
     temporal.inputs.subject_id = config['subject_id']
     temporal.inputs.session_id = config['session_id']
     temporal.inputs.scan_id = config['scan_id']
+    temporal.inputs.spill_timeseries = \
+        config.get('memmap_timeseries', False)
+    temporal.inputs.precision = config.get('compute_precision', 'float64')
+    if config.get('image_cache', False):
+        temporal.inputs.image_cache_dir = \
+            op.join(config['working_directory'], 'image_cache')
+        temporal.inputs.image_cache_size_gb = \
+            config.get('image_cache_size_gb', 2)
     workflow.connect(fd, 'out_file', temporal, 'fd_file')
 
     if 'site_name' in config.keys():
@@ -1228,13 +1278,8 @@ def qap_functional_temporal_workflow(workflow, resource_pool, config, name="_"):
         config["subject_id"], config["session_id"], config["scan_id"])
     out_json = op.join(out_dir, "qap_functional.json")
 
-    temporal_to_json = pe.Node(niu.Function(
-                                  input_names=["output_dict",
-                                               "json_file"],
-                                  output_names=["json_file"],
-                                  function=write_json),
-                              name="qap_functional_temporal_to_json%s" % name)
-    temporal_to_json.inputs.json_file = out_json
+    temporal_to_json = create_json_writer_node(
+        "qap_functional_temporal_to_json%s" % name, out_json, config)
 
     workflow.connect(temporal, 'qc', temporal_to_json, 'output_dict')
     resource_pool['qap_functional_temporal'] = out_json
@@ -91,9 +91,9 @@ def calculate_plane_coords(coords_list, infile_dims):
                         points of the triangular plane.
     :type infile_dims: list
     :param infile_dims: A list of the NIFTI file's dimensions.
-    :rtype: dict
-    :return: A dictionary mapping the z coordinates to the (x,y) coordinate
-             pairs.
+    :rtype: NumPy array
+    :return: A 2D array (x by y) of the z coordinate of the plane above each
+             (x,y) coordinate pair.
     """
 
     import numpy as np
@@ -115,33 +115,23 @@ def calculate_plane_coords(coords_list, infile_dims):
     constant = np.dot(n, np.asarray(coords_list[0]))
 
     # now determine the z-coordinate for each pair of x,y
-    plane_dict = {}
-
-    for yvox in range(0, infile_dims[1]):
-
-        for xvox in range(0, infile_dims[0]):
-
-            zvox = (constant - (n[0] * xvox + n[1] * yvox)) / n[2]
+    xvox = np.arange(0, infile_dims[0])[:, np.newaxis]
+    yvox = np.arange(0, infile_dims[1])[np.newaxis, :]
 
-            zvox = np.floor(zvox)
+    plane_heights = np.floor((constant - (n[0] * xvox + n[1] * yvox)) / n[2])
+    plane_heights = np.clip(plane_heights, 1, infile_dims[2])
 
-            if zvox < 1:
-                zvox = 1
-            elif zvox > infile_dims[2]:
-                zvox = infile_dims[2]
+    return plane_heights
 
-            plane_dict[(xvox, yvox)] = zvox
 
-    return plane_dict
-
-
-def create_slice_mask(plane_dict, infile_dims):
+def create_slice_mask(plane_heights, infile_dims):
     """Create a binary array defining a mask covering the area below a given
     plane in the 3D image.
 
-    :type plane_dict: dict
-    :param plane_dict: A dictionary matching z voxel coordinates to
-                       corresponding (x,y) coordinates.
+    :type plane_heights: NumPy array
+    :param plane_heights: A 2D array (x by y) of the z coordinate of the plane
+                          above each (x,y) coordinate pair, as produced by
+                          'calculate_plane_coords'.
     :type infile_dims: list
     :param infile_dims: A list of the NIFTI file's dimensions.
     :rtype: NumPy array
@@ -150,16 +140,10 @@ def create_slice_mask(plane_dict, infile_dims):
 
     import numpy as np
 
-    mask_array = np.zeros(infile_dims)
-
-    for x in range(0, infile_dims[0]):
+    zvox = np.arange(0, infile_dims[2])[np.newaxis, np.newaxis, :]
 
-        for y in range(0, infile_dims[1]):
-
-            for z in range(0, infile_dims[2]):
-
-                if plane_dict[(x, y)] > z:
-                    mask_array[x, y, z] = 1
+    mask_array = np.zeros(infile_dims)
+    mask_array[plane_heights[:, :, np.newaxis] > zvox] = 1
 
     return mask_array
 
@@ -216,10 +200,10 @@ def slice_head_mask(infile, transform):
         [allineate_mat] * 3, [infile_affine] * 3, [infile_dims] * 3)
 
     # calculate normalized vector and get z coordinate for each x,y pair
-    plane_dict = calculate_plane_coords(coords_list, infile_dims)
+    plane_heights = calculate_plane_coords(coords_list, infile_dims)
 
     # create the mask
-    mask_array = create_slice_mask(plane_dict, infile_dims)
+    mask_array = create_slice_mask(plane_heights, infile_dims)
 
     # create new slice mask img file
     new_mask_img = nb.Nifti1Image(mask_array, infile_affine, infile_header)
@@ -255,7 +239,7 @@ def create_header_dict_entry(in_file, subject, session, scan, type):
 
     import os
     import nibabel as nb
-    from qap.qap_utils import raise_smart_exception
+    from qap.qap_utils import json_value, raise_smart_exception
 
     if not os.path.isfile(in_file):
         err = "Filepath doesn't exist!\nFilepath: %s" % in_file
@@ -284,7 +268,7 @@ def create_header_dict_entry(in_file, subject, session, scan, type):
     for info_label in info_labels:
         try:
             qap_dict[id_string][subkey][info_label] = \
-                str(img_header[info_label])
+                json_value(img_header[info_label])
         except:
             print "\n\n%s field not in NIFTI header of %s\n\n" % \
                   (info_label, in_file)
@@ -293,10 +277,10 @@ def create_header_dict_entry(in_file, subject, session, scan, type):
 
     try:
         pixdim = img_header['pixdim']
-        qap_dict[id_string][subkey]["pix_dimx"] = str(pixdim[1])
-        qap_dict[id_string][subkey]["pix_dimy"] = str(pixdim[2])
-        qap_dict[id_string][subkey]["pix_dimz"] = str(pixdim[3])
-        qap_dict[id_string][subkey]["tr"] = str(pixdim[4])
+        qap_dict[id_string][subkey]["pix_dimx"] = json_value(pixdim[1])
+        qap_dict[id_string][subkey]["pix_dimy"] = json_value(pixdim[2])
+        qap_dict[id_string][subkey]["pix_dimz"] = json_value(pixdim[3])
+        qap_dict[id_string][subkey]["tr"] = json_value(pixdim[4])
     except:
         print "\n\npix_dim/TR fields not in NIFTI header of %s\n\n" % in_file
         pass
@@ -316,7 +300,9 @@ def qap_anatomical_spatial(anatomical_reorient, qap_head_mask_path,
                            anatomical_gm_mask, anatomical_wm_mask,
                            anatomical_csf_mask, subject_id, session_id,
                            scan_id, site_name=None, exclude_zeroes=False,
-                           out_vox=True, starter=None):
+                           out_vox=True, image_cache_dir=None,
+                           image_cache_size_gb=2, precision="float64",
+                           starter=None):
     """Calculate the anatomical spatial QAP measures for an anatomical scan.
 
     - The exclude_zeroes flag is useful for when a large amount of zero
@@ -365,6 +351,17 @@ def qap_anatomical_spatial(anatomical_reorient, qap_head_mask_path,
     :type out_vox: bool
     :param out_vox: (default: True) For FWHM measure: output the FWHM as
                     number of voxels (otherwise as mm).
+    :type image_cache_dir: str
+    :param image_cache_dir: (default: None) The run's image cache directory,
+                            to read the images through (see
+                            qap.image_cache.ImageCache).
+    :type image_cache_size_gb: float
+    :param image_cache_size_gb: (default: 2) The size cap of the image
+                                cache, in GB.
+    :type precision: str
+    :param precision: (default: "float64") The floating point precision to
+                      compute the measures in, "float64" or "float32" (see
+                      qap.qap_utils.compute_precision).
     :type starter: str
     :param starter: (default: None) If this function is being pulled into a
                     Nipype pipeline, this is the dummy input for the function
@@ -376,61 +373,86 @@ def qap_anatomical_spatial(anatomical_reorient, qap_head_mask_path,
 
     from time import strftime
     import qap
-    from qap.spatial_qc import summary_mask, snr, cnr, fber, efc, \
-        artifacts, fwhm, cortical_contrast
-    from qap.qap_utils import load_image, load_mask, \
-                              create_anatomical_background_mask
-
-    # Load the data
-    anat_data = load_image(anatomical_reorient)
-
-    fg_mask = load_mask(qap_head_mask_path, anatomical_reorient)
-
-    # bg_mask is the inversion of the "qap_head_mask"
-    bg_mask = create_anatomical_background_mask(anat_data, fg_mask,
-        exclude_zeroes)
-
-    whole_head_mask = load_mask(whole_head_mask_path, anatomical_reorient)
-    skull_mask = load_mask(skull_mask_path, anatomical_reorient)
-
-    gm_mask = load_mask(anatomical_gm_mask, anatomical_reorient)
-    wm_mask = load_mask(anatomical_wm_mask, anatomical_reorient)
-    csf_mask = load_mask(anatomical_csf_mask, anatomical_reorient)
-
-    # FBER
-    fber_out = fber(anat_data, skull_mask, bg_mask)
-
-    # EFC
-    efc_out = efc(anat_data)
-
-    # Artifact
-    qi1, _ = artifacts(anat_data, fg_mask, bg_mask, calculate_qi2=False)
-
-    # Smoothness in voxels
-    tmp = fwhm(anatomical_reorient, whole_head_mask_path, out_vox=out_vox)
-    fwhm_x, fwhm_y, fwhm_z, fwhm_out = tmp
-
-    # Summary Measures
-    fg_mean, fg_std, fg_size = summary_mask(anat_data, whole_head_mask)
-    bg_mean, bg_std, bg_size = summary_mask(anat_data, bg_mask)
-
-    gm_mean, gm_std, gm_size = (None, None, None)
-    wm_mean, wm_std, wm_size = (None, None, None)
-    csf_mean, csf_std, csf_size = (None, None, None)
-
-    # More Summary Measures
-    gm_mean, gm_std, gm_size = summary_mask(anat_data, gm_mask)
-    wm_mean, wm_std, wm_size = summary_mask(anat_data, wm_mask)
-    csf_mean, csf_std, csf_size = summary_mask(anat_data, csf_mask)
-
-    # SNR
-    snr_out = snr(fg_mean, bg_std)
-
-    # CNR
-    cnr_out = cnr(gm_mean, wm_mean, bg_std)
-
-    # Cortical contrast
-    cort_out = cortical_contrast(gm_mean, wm_mean)
+    from qap.spatial_qc import mask_sufficient_stats, summary_from_stats, \
+        fber_from_stats, snr, cnr, efc, artifacts, fwhm_from_data, \
+        cortical_contrast
+    from qap.qap_utils import load_image, load_mask, read_nifti_image, \
+                              create_anatomical_background_mask, json_value, \
+                              compute_precision
+
+    if image_cache_dir:
+        from qap.image_cache import ImageCache
+        image_cache = ImageCache(image_cache_dir, image_cache_size_gb)
+    else:
+        image_cache = None
+
+    with compute_precision(precision):
+        # Load the data
+        anat_data = load_image(anatomical_reorient, image_cache)
+
+        fg_mask = load_mask(qap_head_mask_path, anatomical_reorient,
+                            image_cache)
+
+        # bg_mask is the inversion of the "qap_head_mask"
+        bg_mask = create_anatomical_background_mask(anat_data, fg_mask,
+            exclude_zeroes)
+
+        whole_head_mask = load_mask(whole_head_mask_path, anatomical_reorient,
+                                    image_cache)
+        skull_mask = load_mask(skull_mask_path, anatomical_reorient,
+                               image_cache)
+
+        gm_mask = load_mask(anatomical_gm_mask, anatomical_reorient,
+                            image_cache)
+        wm_mask = load_mask(anatomical_wm_mask, anatomical_reorient,
+                            image_cache)
+        csf_mask = load_mask(anatomical_csf_mask, anatomical_reorient,
+                             image_cache)
+
+        # Counts, sums, sums-of-squares and squared deviations within every
+        # mask
+        counts, sums, sums_sq, sq_devs = mask_sufficient_stats(anat_data,
+            [whole_head_mask, bg_mask, gm_mask, wm_mask, csf_mask, skull_mask])
+
+        # FBER
+        fber_out = fber_from_stats(sums_sq[5], counts[5], sums_sq[1],
+                                   counts[1], anat_data.size)
+
+        # EFC
+        efc_out = efc(anat_data)
+
+        # Artifact
+        qi1, _ = artifacts(anat_data, fg_mask, bg_mask, calculate_qi2=False)
+
+        # Smoothness in voxels
+        voxel_sizes = read_nifti_image(anatomical_reorient, image_cache)\
+            .get_header().get_zooms()[:3]
+        tmp = fwhm_from_data(anat_data, whole_head_mask, voxel_sizes,
+                             out_vox=out_vox)
+        fwhm_x, fwhm_y, fwhm_z, fwhm_out = tmp
+
+        # Summary Measures
+        fg_mean, fg_std, fg_size = summary_from_stats(counts[0], sums[0],
+                                                      sq_devs[0])
+        bg_mean, bg_std, bg_size = summary_from_stats(counts[1], sums[1],
+                                                      sq_devs[1])
+
+        # More Summary Measures
+        gm_mean, gm_std, gm_size = summary_from_stats(counts[2], sums[2],
+                                                      sq_devs[2])
+        wm_mean, wm_std, wm_size = summary_from_stats(counts[3], sums[3],
+                                                      sq_devs[3])
+        csf_mean, csf_std, csf_size = summary_from_stats(counts[4], sums[4],
+                                                         sq_devs[4])
+
+        # SNR
+        snr_out = snr(fg_mean, bg_std)
+
+        # CNR
+        cnr_out = cnr(gm_mean, wm_mean, bg_std)
+
+        # Cortical contrast
+        cort_out = cortical_contrast(gm_mean, wm_mean)
 
     id_string = "%s %s %s" % (subject_id, session_id, scan_id)
     qc = {
@@ -465,14 +487,18 @@ def qap_anatomical_spatial(anatomical_reorient, qap_head_mask_path,
 
     for key in qc[id_string]["anatomical_spatial"].keys():
         qc[id_string]["anatomical_spatial"][key] = \
-            str(qc[id_string]["anatomical_spatial"][key])
+            json_value(qc[id_string]["anatomical_spatial"][key])
+
+    if image_cache:
+        image_cache.release_all()
 
     return qc
 
 
 def qap_functional_spatial(mean_epi, func_brain_mask, direction, subject_id,
                            session_id, scan_id, site_name=None, out_vox=True,
-                           starter=None):
+                           image_cache_dir=None, image_cache_size_gb=2,
+                           precision="float64", starter=None):
     """ Calculate the functional spatial QAP measures for a functional scan.
 
     - The inclusion of the starter node allows several QAP measure pipelines
@@ -501,6 +527,17 @@ def qap_functional_spatial(mean_epi, func_brain_mask, direction, subject_id,
     :type out_vox: bool
     :param out_vox: (default: True) For FWHM measure: output the FWHM as
                     number of voxels (otherwise as mm).
+    :type image_cache_dir: str
+    :param image_cache_dir: (default: None) The run's image cache directory,
+                            to read the images through (see
+                            qap.image_cache.ImageCache).
+    :type image_cache_size_gb: float
+    :param image_cache_size_gb: (default: 2) The size cap of the image
+                                cache, in GB.
+    :type precision: str
+    :param precision: (default: "float64") The floating point precision to
+                      compute the measures in, "float64" or "float32" (see
+                      qap.qap_utils.compute_precision).
     :type starter: str
     :param starter: (default: None) If this function is being pulled into a
                     Nipype pipeline, this is the dummy input for the function
@@ -513,79 +550,102 @@ def qap_functional_spatial(mean_epi, func_brain_mask, direction, subject_id,
     from time import strftime
 
     import qap
-    from qap.spatial_qc import summary_mask, snr, fber, efc, fwhm, \
-        ghost_direction
-    from qap.qap_utils import load_image, load_mask
-
-    # Load the data
-    anat_data = load_image(mean_epi)
-    fg_mask = load_mask(func_brain_mask, mean_epi)
-    bg_mask = 1 - fg_mask
-
-    # FBER
-    fber_out = fber(anat_data, fg_mask, bg_mask)
-
-    # EFC
-    efc_out = efc(anat_data)
-    
-    # Smoothness in voxels
-    tmp = fwhm(mean_epi, func_brain_mask, out_vox=out_vox)
-    fwhm_x, fwhm_y, fwhm_z, fwhm_out = tmp
-
-    # Summary Measures
-    fg_mean, fg_std, fg_size = summary_mask(anat_data, fg_mask)
-    bg_mean, bg_std, bg_size = summary_mask(anat_data, bg_mask)
-
-    # SNR
-    snr_out = snr(fg_mean, bg_std)
-
-    id_string = "%s %s %s" % (subject_id, session_id, scan_id)
-    qc = {
-            id_string:
-            {
-               "QAP_pipeline_id": "QAP version %s" % qap.__version__,
-               "Time": strftime("%Y-%m-%d %H:%M:%S"),
-               "Participant": str(subject_id),
-               "Session": str(session_id),
-               "Series": str(scan_id),
-               "functional_spatial":
-               {
-                  "FBER": fber_out,
-                  "EFC": efc_out,
-                  "FWHM": fwhm_out,
-                  "FWHM_x": fwhm_x,
-                  "FWHM_y": fwhm_y,
-                  "FWHM_z": fwhm_z,
-                  "SNR": snr_out
-               }
-            }
-        }
-
-    # Ghosting
-    if (direction == "all"):
-        qc[id_string]["functional_spatial"]['Ghost_x'] = \
-            ghost_direction(anat_data, fg_mask, "x")
-        qc[id_string]["functional_spatial"]['Ghost_y'] = \
-            ghost_direction(anat_data, fg_mask, "y")
-        qc[id_string]["functional_spatial"]['Ghost_z'] = \
-            ghost_direction(anat_data, fg_mask, "z")
+    from qap.spatial_qc import mask_sufficient_stats, summary_from_stats, \
+        fber_from_stats, snr, efc, fwhm_from_data, ghost_direction
+    from qap.qap_utils import load_image, load_mask, read_nifti_image, \
+                              json_value, compute_precision
+
+    if image_cache_dir:
+        from qap.image_cache import ImageCache
+        image_cache = ImageCache(image_cache_dir, image_cache_size_gb)
     else:
-        qc[id_string]["functional_spatial"]['Ghost_%s' % direction] = \
-            ghost_direction(anat_data, fg_mask, direction)
+        image_cache = None
+
+    with compute_precision(precision):
+        # Load the data
+        anat_data = load_image(mean_epi, image_cache)
+        fg_mask = load_mask(func_brain_mask, mean_epi, image_cache)
+        bg_mask = 1 - fg_mask
+
+        # Counts, sums, sums-of-squares and squared deviations within both
+        # masks
+        counts, sums, sums_sq, sq_devs = mask_sufficient_stats(
+            anat_data, [fg_mask, bg_mask])
+
+        # FBER
+        fber_out = fber_from_stats(sums_sq[0], counts[0], sums_sq[1],
+                                   counts[1], anat_data.size)
+
+        # EFC
+        efc_out = efc(anat_data)
+
+        # Smoothness in voxels
+        voxel_sizes = read_nifti_image(mean_epi, image_cache).get_header()\
+            .get_zooms()[:3]
+        tmp = fwhm_from_data(anat_data, fg_mask, voxel_sizes, out_vox=out_vox)
+        fwhm_x, fwhm_y, fwhm_z, fwhm_out = tmp
+
+        # Summary Measures
+        fg_mean, fg_std, fg_size = summary_from_stats(counts[0], sums[0],
+                                                      sq_devs[0])
+        bg_mean, bg_std, bg_size = summary_from_stats(counts[1], sums[1],
+                                                      sq_devs[1])
+
+        # SNR
+        snr_out = snr(fg_mean, bg_std)
+
+        id_string = "%s %s %s" % (subject_id, session_id, scan_id)
+        qc = {
+                id_string:
+                {
+                   "QAP_pipeline_id": "QAP version %s" % qap.__version__,
+                   "Time": strftime("%Y-%m-%d %H:%M:%S"),
+                   "Participant": str(subject_id),
+                   "Session": str(session_id),
+                   "Series": str(scan_id),
+                   "functional_spatial":
+                   {
+                      "FBER": fber_out,
+                      "EFC": efc_out,
+                      "FWHM": fwhm_out,
+                      "FWHM_x": fwhm_x,
+                      "FWHM_y": fwhm_y,
+                      "FWHM_z": fwhm_z,
+                      "SNR": snr_out
+                   }
+                }
+            }
+
+        # Ghosting
+        if (direction == "all"):
+            qc[id_string]["functional_spatial"]['Ghost_x'] = \
+                ghost_direction(anat_data, fg_mask, "x")
+            qc[id_string]["functional_spatial"]['Ghost_y'] = \
+                ghost_direction(anat_data, fg_mask, "y")
+            qc[id_string]["functional_spatial"]['Ghost_z'] = \
+                ghost_direction(anat_data, fg_mask, "z")
+        else:
+            qc[id_string]["functional_spatial"]['Ghost_%s' % direction] = \
+                ghost_direction(anat_data, fg_mask, direction)
 
     if site_name:
         qc[id_string]['Site'] = str(site_name)
 
     for key in qc[id_string]["functional_spatial"].keys():
         qc[id_string]["functional_spatial"][key] = \
-            str(qc[id_string]["functional_spatial"][key])
+            json_value(qc[id_string]["functional_spatial"][key])
+
+    if image_cache:
+        image_cache.release_all()
 
     return qc
 
 
 def qap_functional_temporal(
         func_timeseries, func_brain_mask, bg_func_brain_mask, fd_file,
-        subject_id, session_id, scan_id, site_name=None, starter=None):
+        subject_id, session_id, scan_id, site_name=None,
+        spill_timeseries=False, image_cache_dir=None, image_cache_size_gb=2,
+        precision="float64", starter=None):
     """ Calculate the functional temporal QAP measures for a functional scan.
 
     - The inclusion of the starter node allows several QAP measure pipelines
@@ -602,7 +662,8 @@ def qap_functional_temporal(
     :param bg_func_brain_mask: Filepath to the inversion of the functional
                                brain mask.
     :type fd_file: str
-    :param fd_file: File containing the RMSD values (calculated previously).
+    :param fd_file: File containing the RMSD values (calculated previously),
+                    or an array of the values.
     :type subject_id: str
     :param subject_id: The participant ID.
     :type session_id: str
@@ -612,6 +673,22 @@ def qap_functional_temporal(
     :type site_name: str
     :param site_name: (default: None) The name of the site where the scan was
                       acquired.
+    :type spill_timeseries: bool
+    :param spill_timeseries: (default: False) Keep the loaded timeseries in
+                             memory-mapped files in the current working
+                             directory instead of in memory, for runs too
+                             large to fit in RAM.
+    :type image_cache_dir: str
+    :param image_cache_dir: (default: None) The run's image cache directory,
+                            to read the images through (see
+                            qap.image_cache.ImageCache).
+    :type image_cache_size_gb: float
+    :param image_cache_size_gb: (default: 2) The size cap of the image
+                                cache, in GB.
+    :type precision: str
+    :param precision: (default: "float64") The floating point precision to
+                      compute the measures in, "float64" or "float32" (see
+                      qap.qap_utils.compute_precision).
     :type starter: str
     :param starter: (default: None) If this function is being pulled into a
                     Nipype pipeline, this is the dummy input for the function
@@ -621,42 +698,72 @@ def qap_functional_temporal(
              participant.
     """
 
+    import os
     import numpy as np
     from time import strftime
 
     import qap
-    from qap.temporal_qc import outlier_timepoints, quality_timepoints, \
-                                global_correlation, calculate_percent_outliers
-    from qap.dvars import calc_dvars
-
-    # DVARS
-    dvars = calc_dvars(func_timeseries, func_brain_mask)
-    dvars_outliers, dvars_IQR = calculate_percent_outliers(dvars)
-
-    mean_dvars = dvars.mean(0)
-    mean_dvars = mean_dvars[0]
-
-    # Mean FD (Jenkinson)
-    fd = np.loadtxt(fd_file)
-    meanfd_outliers, meanfd_IQR = calculate_percent_outliers(fd)
-
-    # 3dTout
-    outliers = outlier_timepoints(func_timeseries, mask_file=func_brain_mask)
-    # calculate the outliers of the outliers! AAHH!
-    outlier_perc_out, outlier_IQR = calculate_percent_outliers(outliers)
+    from qap.temporal_qc import outlier_timepoints_from_data, \
+                                quality_timepoints_from_data, \
+                                global_correlation_from_data, \
+                                summarize_vectors
+    from qap.dvars import MaskedTimeseries, calc_dvars_from_data
+    from qap.qap_utils import read_nifti_image, json_value, \
+                              compute_precision
+
+    # Load the timeseries once, for all of the measures which use it
+    if spill_timeseries:
+        spill_dir = os.getcwd()
+    else:
+        spill_dir = None
 
-    # 3dTout (outside of brain)
-    oob_outliers = outlier_timepoints(func_timeseries,
-        mask_file=bg_func_brain_mask)
-    oob_outlier_perc_out, oob_outlier_IQR = \
-        calculate_percent_outliers(oob_outliers)
+    if image_cache_dir:
+        from qap.image_cache import ImageCache
+        image_cache = ImageCache(image_cache_dir, image_cache_size_gb)
+    else:
+        image_cache = None
 
-    # 3dTqual
-    quality = quality_timepoints(func_timeseries)
-    quality_outliers, quality_IQR = calculate_percent_outliers(quality)
+    with compute_precision(precision):
+        func_ts = MaskedTimeseries(func_timeseries, func_brain_mask,
+                                   spill_dir=spill_dir,
+                                   image_cache=image_cache)
 
-    # GCOR
-    gcor = global_correlation(func_timeseries, func_brain_mask)
+        # the spill files are removed even if a measure fails
+        try:
+            # DVARS
+            dvars = calc_dvars_from_data(func_ts.data)
+
+            # Mean FD (Jenkinson)
+            if isinstance(fd_file, basestring):
+                fd = np.loadtxt(fd_file)
+            else:
+                fd = np.asarray(fd_file)
+
+            # Fraction of outliers (3dToutcount), inside and outside of the
+            # brain
+            brain_mask = read_nifti_image(func_brain_mask,
+                                          image_cache).get_data()
+            bg_mask = read_nifti_image(bg_func_brain_mask,
+                                       image_cache).get_data()
+            outliers, oob_outliers = outlier_timepoints_from_data(func_ts.func,
+                                                                  [brain_mask,
+                                                                   bg_mask])
+
+            # Quality index (3dTqual)
+            quality = quality_timepoints_from_data(func_ts.func)
+
+            # GCOR
+            gcor = global_correlation_from_data(func_ts.data)
+        finally:
+            func_ts.close()
+            if image_cache:
+                image_cache.release_all()
+
+    # summarize the DVARS, FD, outlier (and outliers of the outliers!) and
+    # quality vectors all at once
+    summary = summarize_vectors([np.ravel(dvars), np.ravel(fd), outliers,
+                                 oob_outliers, quality])
+    dvars_idx, fd_idx, outliers_idx, oob_idx, quality_idx = range(5)
 
     # Compile
     id_string = "%s %s %s" % (subject_id, session_id, scan_id)
@@ -670,31 +777,40 @@ def qap_functional_temporal(
               "Series": str(scan_id),
               "functional_temporal":
               {
-                 "Std. DVARS (Mean)": mean_dvars,
-                 "Std. DVARS (Std Dev)": np.std(dvars),
-                 "Std. DVARS (Median)": np.median(dvars),
-                 "Std. DVARs IQR": dvars_IQR,
-                 "Std. DVARS percent outliers": dvars_outliers,
-                 "RMSD (Mean)": np.mean(fd),
-                 "RMSD (Std Dev)": np.std(fd),
-                 "RMSD (Median)": np.median(fd),
-                 "RMSD IQR": meanfd_IQR,
-                 "RMSD percent outliers": meanfd_outliers,
-                 "Fraction of Outliers (Mean)": np.mean(outliers),
-                 "Fraction of Outliers (Std Dev)": np.std(outliers),
-                 "Fraction of Outliers (Median)": np.median(outliers),
-                 "Fraction of Outliers IQR": outlier_IQR,
-                 "Fraction of Outliers percent outliers": outlier_perc_out,
-                 "Fraction of OOB Outliers (Mean)": np.mean(oob_outliers),
-                 "Fraction of OOB Outliers (Std Dev)": np.std(oob_outliers),
-                 "Fraction of OOB Outliers (Median)": np.median(oob_outliers),
-                 "Fraction of OOB Outliers IQR": oob_outlier_IQR,
-                 "Fraction of OOB Outliers percent outliers": oob_outlier_perc_out,
-                 "Quality (Mean)": np.mean(quality),
-                 "Quality (Std Dev)": np.std(quality),
-                 "Quality (Median)": np.median(quality),
-                 "Quality IQR": quality_IQR,
-                 "Quality percent outliers": quality_outliers,
+                 "Std. DVARS (Mean)": summary["mean"][dvars_idx],
+                 "Std. DVARS (Std Dev)": summary["std"][dvars_idx],
+                 "Std. DVARS (Median)": summary["median"][dvars_idx],
+                 "Std. DVARs IQR": summary["IQR"][dvars_idx],
+                 "Std. DVARS percent outliers":
+                     summary["percent_outliers"][dvars_idx],
+                 "RMSD (Mean)": summary["mean"][fd_idx],
+                 "RMSD (Std Dev)": summary["std"][fd_idx],
+                 "RMSD (Median)": summary["median"][fd_idx],
+                 "RMSD IQR": summary["IQR"][fd_idx],
+                 "RMSD percent outliers":
+                     summary["percent_outliers"][fd_idx],
+                 "Fraction of Outliers (Mean)": summary["mean"][outliers_idx],
+                 "Fraction of Outliers (Std Dev)":
+                     summary["std"][outliers_idx],
+                 "Fraction of Outliers (Median)":
+                     summary["median"][outliers_idx],
+                 "Fraction of Outliers IQR": summary["IQR"][outliers_idx],
+                 "Fraction of Outliers percent outliers":
+                     summary["percent_outliers"][outliers_idx],
+                 "Fraction of OOB Outliers (Mean)": summary["mean"][oob_idx],
+                 "Fraction of OOB Outliers (Std Dev)":
+                     summary["std"][oob_idx],
+                 "Fraction of OOB Outliers (Median)":
+                     summary["median"][oob_idx],
+                 "Fraction of OOB Outliers IQR": summary["IQR"][oob_idx],
+                 "Fraction of OOB Outliers percent outliers":
+                     summary["percent_outliers"][oob_idx],
+                 "Quality (Mean)": summary["mean"][quality_idx],
+                 "Quality (Std Dev)": summary["std"][quality_idx],
+                 "Quality (Median)": summary["median"][quality_idx],
+                 "Quality IQR": summary["IQR"][quality_idx],
+                 "Quality percent outliers":
+                     summary["percent_outliers"][quality_idx],
                  "GCOR": gcor
               }
             }
@@ -705,6 +821,6 @@ def qap_functional_temporal(
 
     for key in qc[id_string]["functional_temporal"].keys():
         qc[id_string]["functional_temporal"][key] = \
-            str(qc[id_string]["functional_temporal"][key])
+            json_value(qc[id_string]["functional_temporal"][key])
 
     return qc
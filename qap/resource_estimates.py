@@ -0,0 +1,412 @@
+import os.path as op
+
+
+# typical scan sizes, used when a scan's header cannot be read (for example,
+# when it is still in an S3 bucket)
+DEFAULT_SCAN_DIMS = {"anatomical_scan": (256, 256, 160, 1),
+                     "functional_scan": (64, 64, 36, 150)}
+
+# the cost model for one scan's whole QAP run - a fixed cost for the tools
+# which do not scale much with the data (skull-stripping, registration...),
+# plus a cost per voxel (per voxel per timepoint for functional scans)
+SCAN_COST_MODEL = {"anatomical_scan": {"base_hours": 0.25,
+                                       "hours_per_voxel": 1e-8,
+                                       "base_memory_gb": 1.0,
+                                       "bytes_per_voxel": 48},
+                   "functional_scan": {"base_hours": 0.1,
+                                       "hours_per_voxel": 2e-9,
+                                       "base_memory_gb": 0.5,
+                                       "bytes_per_voxel": 32}}
+
+# the shortest per-task time limit (in hours) derived from the cost model -
+# its predictions are rough, and a task killed at its limit loses its bundle
+MIN_TASK_HOURS = 4
+
+
+def read_scan_dims(scan_file, scan_type="functional_scan"):
+    """Read the dimensions of a scan from its NIFTI header, without loading
+    its data.
+
+    :type scan_file: str
+    :param scan_file: The filepath to the NIFTI scan.
+    :type scan_type: str
+    :param scan_type: (default: "functional_scan") Either "anatomical_scan"
+                      or "functional_scan" - used to pick the typical
+                      dimensions if the header cannot be read.
+    :rtype: tuple
+    :return: A 4-element tuple of the x, y, z and time dimensions.
+    """
+
+    import nibabel as nb
+
+    dims = None
+    if isinstance(scan_file, basestring) and op.isfile(scan_file):
+        try:
+            dims = nb.load(scan_file).header.get_data_shape()
+        except Exception:
+            dims = None
+
+    if not dims:
+        return DEFAULT_SCAN_DIMS.get(scan_type,
+                                     DEFAULT_SCAN_DIMS["functional_scan"])
+
+    dims = tuple(int(dim) for dim in dims[:4])
+    return dims + (1,) * (4 - len(dims))
+
+
+def estimate_scan_cost(scan_type, scan_file):
+    """Predict the wall time and peak memory of one scan's QAP run from its
+    header dimensions, time point count and scan type.
+
+    :type scan_type: str
+    :param scan_type: Either "anatomical_scan" or "functional_scan".
+    :type scan_file: str
+    :param scan_file: The filepath to the NIFTI scan.
+    :rtype: tuple
+    :return: A tuple of the predicted wall time (in hours) and the
+             predicted peak memory (in GB).
+    """
+
+    model = SCAN_COST_MODEL.get(scan_type, SCAN_COST_MODEL["functional_scan"])
+
+    dims = read_scan_dims(scan_file, scan_type)
+    num_voxels = float(dims[0] * dims[1] * dims[2] * dims[3])
+
+    hours = model["base_hours"] + model["hours_per_voxel"] * num_voxels
+    memory_gb = model["base_memory_gb"] + \
+        model["bytes_per_voxel"] * num_voxels / 1024 ** 3
+
+    return hours, memory_gb
+
+
+def estimate_session_cost(session_dict):
+    """Predict the total wall time and peak memory of one session's scans.
+
+    :type session_dict: dict
+    :param session_dict: A session's entry of the flattened participant
+                         dictionary - a dictionary of scan IDs mapped to
+                         resource pools of input filepaths.
+    :rtype: tuple
+    :return: A tuple of the summed predicted wall time (in hours) of the
+             session's scans, and the largest predicted peak memory (in GB)
+             of any one scan.
+    """
+
+    hours = 0.0
+    memory_gb = 0.0
+
+    for scan in session_dict.keys():
+        resource_pool = session_dict[scan]
+        if type(resource_pool) is not dict:
+            # site_name, creds_path, etc.
+            continue
+        for scan_type in SCAN_COST_MODEL.keys():
+            if scan_type in resource_pool.keys():
+                scan_hours, scan_memory = \
+                    estimate_scan_cost(scan_type, resource_pool[scan_type])
+                hours += scan_hours
+                memory_gb = max(memory_gb, scan_memory)
+
+    return hours, memory_gb
+
+
+def pack_bundles(costs, num_bundles):
+    """Bin-pack items into bundles so that each bundle has about the same
+    total predicted wall time and memory.
+
+    - Uses the longest-processing-time-first heuristic: the items are placed
+      from the most to the least expensive, each into the bundle with the
+      least predicted wall time so far (then the least memory).
+    - The result is deterministic for the same costs, so that every cluster
+      task builds the same bundles.
+
+    :type costs: list
+    :param costs: A list of (hours, memory_gb) tuples, one per item.
+    :type num_bundles: int
+    :param num_bundles: The number of bundles to pack the items into.
+    :rtype: list
+    :return: A list of lists of item indices, one per (non-empty) bundle.
+    """
+
+    order = sorted(range(len(costs)), key=lambda idx: (-costs[idx][0],
+                                                       -costs[idx][1], idx))
+
+    loads = [(0.0, 0.0, bundle) for bundle in range(num_bundles)]
+    bundles = [[] for bundle in range(num_bundles)]
+
+    for idx in order:
+        hours, memory_gb, bundle = min(loads)
+        bundles[bundle].append(idx)
+        loads[bundle] = (hours + costs[idx][0], memory_gb + costs[idx][1],
+                         bundle)
+
+    return [sorted(bundle) for bundle in bundles if bundle]
+
+
+def estimate_bundle_hours(session_costs, num_processors=1):
+    """Predict the wall time of a bundle, whose scans run in parallel on the
+    given number of processors.
+
+    :type session_costs: list
+    :param session_costs: A list of (hours, memory_gb) tuples, one per
+                          session in the bundle.
+    :type num_processors: int
+    :param num_processors: (default: 1) The number of processors the
+                           bundle runs with.
+    :rtype: float
+    :return: The predicted wall time of the bundle, in hours.
+    """
+
+    if not session_costs:
+        return 0.0
+
+    total_hours = sum([cost[0] for cost in session_costs])
+    longest_hours = max([cost[0] for cost in session_costs])
+
+    return max(total_hours / max(1, num_processors), longest_hours)
+
+
+# the resource model for each kind of Nipype node, by the name the workflow
+# builders give it (before the participant suffix) - the scan it scales with,
+# whether it handles the whole timeseries or a single volume, a fixed memory
+# cost (GB), the number of copies of the scan (as float32) it holds in memory
+# at its peak, and its number of threads (AFNI tools take this through
+# OMP_NUM_THREADS)
+NODE_RESOURCE_MODEL = {
+    # anatomical_preproc.py
+    "anat_deoblique": ("anatomical_scan", False, 0.1, 2, 1),
+    "anat_reorient": ("anatomical_scan", False, 0.1, 2, 1),
+    "anat_skullstrip": ("anatomical_scan", False, 0.5, 8, 1),
+    "anat_skullstrip_orig_vol": ("anatomical_scan", False, 0.1, 3, 1),
+    "calc_3dAllineate_warp": ("anatomical_scan", False, 0.5, 6, 4),
+    "segmentation": ("anatomical_scan", False, 0.5, 10, 1),
+    "segment_AFNItoNIFTI": ("anatomical_scan", False, 0.1, 4, 1),
+    "extract_CSF_mask": ("anatomical_scan", False, 0.1, 2, 1),
+    "extract_GM_mask": ("anatomical_scan", False, 0.1, 2, 1),
+    "extract_WM_mask": ("anatomical_scan", False, 0.1, 2, 1),
+    # qap_workflows.py
+    "qap_headmask_clip_level": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_create_expr_string": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_mask_skull": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_mask_tool": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_slice_head_mask": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_combine_masks": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_headmask_subtract_masks": ("anatomical_scan", False, 0.1, 4, 1),
+    "qap_anatomical_spatial": ("anatomical_scan", False, 0.25, 16, 1),
+    "qap_functional_spatial": ("functional_scan", False, 0.25, 8, 1),
+    "generate_FD_file": ("functional_scan", False, 0.1, 0, 1),
+    "qap_functional_temporal": ("functional_scan", True, 0.25, 6, 1),
+    # functional_preproc.py
+    "func_drop_trs": ("functional_scan", True, 0.1, 2, 1),
+    "func_deoblique": ("functional_scan", True, 0.1, 2, 1),
+    "func_reorient": ("functional_scan", True, 0.1, 2, 1),
+    "get_func_volume": ("functional_scan", True, 0.1, 1, 1),
+    "func_motion_correct": ("functional_scan", True, 0.25, 3, 2),
+    "func_get_brain_mask": ("functional_scan", True, 0.1, 2, 1),
+    "invert_mask": ("functional_scan", False, 0.1, 2, 1),
+    "func_mean_tstat": ("functional_scan", True, 0.1, 2, 1)}
+
+
+def match_node_model(node_name):
+    """Find the resource model entry for a node from a name whose
+    participant suffix is not known (such as in a callback log of past
+    runs).
+
+    :type node_name: str
+    :param node_name: The node's name, with or without the participant
+                      suffix.
+    :rtype: str
+    :return: The key of the matching NODE_RESOURCE_MODEL entry (the longest
+             one the node name starts with), or None.
+    """
+
+    matches = [key for key in NODE_RESOURCE_MODEL.keys()
+               if node_name.startswith(key) and
+               (node_name[len(key):] == "" or node_name[len(key)] == "_")]
+
+    if not matches:
+        return None
+
+    model_key = max(matches, key=len)
+
+    # the light-weight nodes writing a QAP node's results to JSON
+    if node_name[len(model_key):].startswith("_to_json"):
+        return None
+
+    return model_key
+
+
+def estimate_node_resources(node_base_name, scan_file):
+    """Predict the peak memory and the number of threads of one node, scaled
+    from the size of the scan it processes.
+
+    :type node_base_name: str
+    :param node_base_name: The node's name, without the participant suffix.
+    :type scan_file: str
+    :param scan_file: The filepath to the participant's scan of the type the
+                      node processes, or None.
+    :rtype: tuple
+    :return: A tuple of the predicted peak memory (in GB) and number of
+             threads, or None if there is no model for the node.
+    """
+
+    model_key = match_node_model(node_base_name)
+    if not model_key:
+        return None
+
+    scan_type, timeseries, base_gb, copies, num_threads = \
+        NODE_RESOURCE_MODEL[model_key]
+
+    dims = read_scan_dims(scan_file, scan_type)
+    num_voxels = dims[0] * dims[1] * dims[2]
+    if timeseries:
+        num_voxels *= dims[3]
+
+    memory_gb = base_gb + copies * num_voxels * 4.0 / 1024 ** 3
+
+    return memory_gb, num_threads
+
+
+def estimate_peak_node_memory(session_dicts):
+    """Predict the peak memory of the most memory-hungry node of any of the
+    given sessions' workflows - the least memory a bundle can be given to
+    run every one of its nodes.
+
+    :type session_dicts: list
+    :param session_dicts: A list of sessions' entries of the flattened
+                          participant dictionary - dictionaries of scan IDs
+                          mapped to resource pools of input filepaths.
+    :rtype: float
+    :return: The largest predicted peak memory (in GB) of any one node.
+    """
+
+    peak_memory_gb = 0.0
+
+    for session_dict in session_dicts:
+        for resource_pool in session_dict.values():
+            if type(resource_pool) is not dict:
+                # site_name, creds_path, etc.
+                continue
+            for model_key, model in NODE_RESOURCE_MODEL.items():
+                if model[0] not in resource_pool.keys():
+                    continue
+                memory_gb, num_threads = estimate_node_resources(
+                    model_key, resource_pool[model[0]])
+                peak_memory_gb = max(peak_memory_gb, memory_gb)
+
+    return peak_memory_gb
+
+
+def read_callback_log(callback_log):
+    """Read the peak memory and thread usage of each kind of node from a
+    Nipype callback log of past runs.
+
+    - The runtime usage is only recorded by Nipype when its runtime
+      profiling is enabled ("profile_runtime" in the Nipype configuration),
+      other entries are skipped.
+
+    :type callback_log: str
+    :param callback_log: The filepath to the callback.log file.
+    :rtype: dict
+    :return: A dictionary mapping NODE_RESOURCE_MODEL keys to the largest
+             (memory in GB, number of threads) seen for those nodes.
+    """
+
+    import json
+
+    history = {}
+
+    if not callback_log or not op.isfile(callback_log):
+        return history
+
+    with open(callback_log, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                memory_gb = float(entry["runtime_memory_gb"])
+                num_threads = int(entry["runtime_threads"])
+            except (ValueError, TypeError, KeyError):
+                continue
+
+            model_key = match_node_model(entry.get("name", ""))
+            if not model_key:
+                continue
+
+            prev_memory_gb, prev_threads = history.get(model_key, (0.0, 0))
+            history[model_key] = (max(prev_memory_gb, memory_gb),
+                                  max(prev_threads, num_threads))
+
+    return history
+
+
+def set_node_resources(workflow, participant_scans, plugin_args,
+                       callback_log=None):
+    """Set the estimated_memory_gb and num_threads of each node in a bundle's
+    workflow, so that the MultiProc scheduler can pack heavy nodes next to
+    light ones.
+
+    - The estimates are scaled from the header dimensions of the scan each
+      node processes, and raised to at least what nodes of the same kind
+      were seen to use in past runs (from the callback log).
+    - The estimates are capped at the plugin's memory_gb and n_procs, so
+      that every node can still be scheduled.
+    - A node is matched on its exact name - a NODE_RESOURCE_MODEL key with
+      a participant's suffix appended, as the workflow builders name them -
+      so a participant ID which ends with another one's cannot pick up the
+      other participant's scans.
+
+    :type workflow: Nipype workflow object
+    :param workflow: The bundle's workflow, with all of its nodes connected.
+    :type participant_scans: dict
+    :param participant_scans: A dictionary mapping each participant's node
+                              name suffix to its resource pool of input
+                              filepaths ("anatomical_scan" and/or
+                              "functional_scan").
+    :type plugin_args: dict
+    :param plugin_args: The MultiProc plugin arguments (memory_gb and
+                        n_procs).
+    :type callback_log: str
+    :param callback_log: (default: None) The filepath to the callback.log
+                         file of past runs.
+    :rtype: dict
+    :return: A dictionary mapping node names to the (memory in GB, number of
+             threads) set on them.
+    """
+
+    history = read_callback_log(callback_log)
+
+    max_memory_gb = float(plugin_args.get("memory_gb", 0)) or None
+    max_threads = int(plugin_args.get("n_procs", 0)) or None
+
+    # the full name of every node the builders can create for each
+    # participant
+    node_models = {}
+    for suffix, scans in participant_scans.items():
+        for model_key in NODE_RESOURCE_MODEL.keys():
+            node_models[model_key + suffix] = (model_key, scans)
+
+    node_resources = {}
+
+    for node in workflow._get_all_nodes():
+        if node.name not in node_models.keys():
+            continue
+        model_key, scans = node_models[node.name]
+
+        scan_type = NODE_RESOURCE_MODEL[model_key][0]
+        memory_gb, num_threads = \
+            estimate_node_resources(model_key, scans.get(scan_type))
+
+        if model_key in history.keys():
+            memory_gb = max(memory_gb, 1.1 * history[model_key][0])
+            num_threads = max(num_threads, history[model_key][1])
+
+        if max_memory_gb:
+            memory_gb = min(memory_gb, max_memory_gb)
+        if max_threads:
+            num_threads = min(num_threads, max_threads)
+
+        node.interface.estimated_memory_gb = memory_gb
+        node.interface.num_threads = num_threads
+        node_resources[node.name] = (memory_gb, num_threads)
+
+    return node_resources
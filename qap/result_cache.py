@@ -0,0 +1,369 @@
+import os
+import os.path as op
+
+
+# the sections of a participant's QAP JSON entry, the output JSON file they
+# are written to, and the resource pool key they are held under
+CACHED_SECTIONS = {"anatomical_spatial": ("qap_anatomical.json",
+                                          "qap_anatomical_spatial"),
+                   "anatomical_header_info": ("qap_anatomical.json",
+                                              "anatomical_header_info"),
+                   "functional_spatial": ("qap_functional.json",
+                                          "qap_functional_spatial"),
+                   "functional_temporal": ("qap_functional.json",
+                                           "qap_functional_temporal"),
+                   "functional_header_info": ("qap_functional.json",
+                                              "functional_header_info")}
+
+# the pipeline configuration options which change the QAP measure values
+CACHE_CONFIG_KEYS = ["template_head_for_anat", "exclude_zeros", "start_idx",
+                     "stop_idx", "ghost_direction", "compute_precision"]
+
+
+def hash_file(filepath, block_size=1048576):
+    """Calculate the SHA-1 hash of a file's contents, reading it in blocks.
+
+    :type filepath: str
+    :param filepath: The filepath of the file to hash.
+    :type block_size: int
+    :param block_size: (default: 1048576) The number of bytes to read at a
+                       time.
+    :rtype: str
+    :return: The hexadecimal SHA-1 digest of the file.
+    """
+
+    import hashlib
+
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+class ResultCache(object):
+    """A persistent cache of QAP results, keyed on the contents of each
+    participant's input files, the measure-relevant pipeline configuration
+    options, and the QAP version.
+
+    - Each entry holds the QAP JSON sections (measures and header info)
+      computed for one participant-session-scan, and optionally the
+      intermediate outputs written to its output directory.
+    - Because the key is content-based, replacing an input file causes its
+      results to be recomputed, and moving the output directory does not.
+    - Entries are evicted, least recently used first, once the cache grows
+      past its size limit. Each entry records its own size when it is
+      stored, and the cache keeps a running total of them, so storing an
+      entry only walks that entry; the whole cache is only listed when the
+      total goes over the limit.
+    - Template files in the configuration are keyed on their contents too.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=5):
+        """
+        :type cache_dir: str
+        :param cache_dir: The directory to keep the cache in.
+        :type max_size_gb: float
+        :param max_size_gb: (default: 5) The size limit of the cache, in GB.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_size = int(float(max_size_gb) * 1024 ** 3)
+        self.lock_timeout = 60
+
+        if not op.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not op.isdir(self.cache_dir):
+                    raise
+
+    def key(self, resource_pool, config):
+        """Calculate the cache key for one participant-session-scan.
+
+        :type resource_pool: dict
+        :param resource_pool: The participant's starting resource pool, with
+                              filepaths to its input files.
+        :type config: dict
+        :param config: The pipeline configuration dictionary.
+        :rtype: str
+        :return: The hexadecimal SHA-1 cache key.
+        """
+
+        import hashlib
+        import json
+        import qap
+
+        inputs = {}
+        for resource in sorted(resource_pool.keys()):
+            value = resource_pool[resource]
+            if resource != "site_name" and isinstance(value, basestring) \
+                    and op.isfile(value):
+                inputs[resource] = hash_file(value)
+
+        config_values = {}
+        for key in CACHE_CONFIG_KEYS:
+            value = config.get(key)
+            if isinstance(value, basestring) and op.isfile(value):
+                # a moved template with the same contents is the same input
+                config_values[key] = hash_file(value)
+            else:
+                config_values[key] = str(value)
+
+        key_dict = {"inputs": inputs, "config": config_values,
+                    "version": qap.__version__}
+
+        return hashlib.sha1(json.dumps(key_dict, sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        """Look up a cache entry, and mark it as recently used.
+
+        :type key: str
+        :param key: The cache key.
+        :rtype: dict
+        :return: A dictionary with the cached JSON sections under "results"
+                 and a dictionary of the cached intermediate output
+                 filepaths under "outputs", or None if there is no entry.
+        """
+
+        from qap.qap_utils import read_json
+
+        entry_dir = op.join(self.cache_dir, key)
+        results_file = op.join(entry_dir, "results.json")
+
+        if not op.isfile(results_file):
+            return None
+
+        try:
+            results = read_json(results_file)
+        except Exception:
+            return None
+
+        outputs = {}
+        outputs_dir = op.join(entry_dir, "outputs")
+        if op.isdir(outputs_dir):
+            for resource in os.listdir(outputs_dir):
+                files = os.listdir(op.join(outputs_dir, resource))
+                if files:
+                    outputs[resource] = op.join(outputs_dir, resource,
+                                                files[0])
+
+        # used for the least-recently-used eviction
+        os.utime(entry_dir, None)
+
+        return {"results": results, "outputs": outputs}
+
+    def put(self, key, results, output_dir=None):
+        """Store (or update) a cache entry, and evict old entries if the
+        cache has grown past its size limit.
+
+        :type key: str
+        :param key: The cache key.
+        :type results: dict
+        :param results: The JSON sections to store, updating any already in
+                        the entry.
+        :type output_dir: str
+        :param output_dir: (default: None) The participant's output
+                           directory, to also store the intermediate outputs
+                           (sub-directories) from.
+        """
+
+        import json
+        import shutil
+        import tempfile
+        from qap.qap_utils import read_json
+
+        entry_dir = op.join(self.cache_dir, key)
+        if not op.isdir(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                if not op.isdir(entry_dir):
+                    raise
+
+        results_file = op.join(entry_dir, "results.json")
+        if op.isfile(results_file):
+            current = read_json(results_file)
+            current.update(results)
+            results = current
+
+        # write to a temporary file first, so that readers never see a
+        # partially-written entry
+        fd, tmp_file = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        os.rename(tmp_file, results_file)
+
+        if output_dir and op.isdir(output_dir):
+            outputs_dir = op.join(entry_dir, "outputs")
+            for resource in os.listdir(output_dir):
+                resource_dir = op.join(output_dir, resource)
+                cached_dir = op.join(outputs_dir, resource)
+                if not op.isdir(resource_dir) or op.isdir(cached_dir):
+                    continue
+                tmp_dir = tempfile.mkdtemp(dir=entry_dir)
+                shutil.rmtree(tmp_dir)
+                shutil.copytree(resource_dir, tmp_dir)
+                if not op.isdir(outputs_dir):
+                    os.makedirs(outputs_dir)
+                os.rename(tmp_dir, cached_dir)
+
+        # record the entry's new size, and add the change to the total
+        old_size = self._read_size(op.join(entry_dir, "entry_size"))
+        new_size = self._walk_size(entry_dir)
+        self._write_size(op.join(entry_dir, "entry_size"), new_size)
+
+        lock = self._lock()
+        try:
+            total_size = self._read_size(op.join(self.cache_dir,
+                                                 "cache_size"))
+            if total_size is None:
+                total_size = sum([entry[1] for entry in self.size()])
+            else:
+                total_size += new_size - (old_size or 0)
+            if total_size > self.max_size:
+                self._evict()
+            else:
+                self._write_size(op.join(self.cache_dir, "cache_size"),
+                                 total_size)
+        finally:
+            lock.release()
+
+    def _lock(self):
+        """Acquire the lock on the cache's size total and evictions.
+
+        :rtype: lockfile.FileLock
+        :return: The acquired lock.
+        """
+
+        import time
+        from lockfile import FileLock, AlreadyLocked
+
+        lock = FileLock(op.join(self.cache_dir, "result_cache"))
+        start = time.time()
+
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except AlreadyLocked:
+                if time.time() - start > self.lock_timeout:
+                    lock.break_lock()
+                else:
+                    time.sleep(0.05)
+
+    def _read_size(self, size_file):
+        """Read a size recorded by _write_size.
+
+        :type size_file: str
+        :param size_file: The filepath of the size record.
+        :rtype: int
+        :return: The size in bytes, or None if it is not recorded.
+        """
+
+        try:
+            with open(size_file, "r") as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_size(self, size_file, size):
+        """Record a size in bytes, atomically.
+
+        :type size_file: str
+        :param size_file: The filepath of the size record.
+        :type size: int
+        :param size: The size in bytes.
+        """
+
+        tmp_file = "%s.%d.tmp" % (size_file, os.getpid())
+        with open(tmp_file, "wt") as f:
+            f.write("%d" % size)
+        os.rename(tmp_file, size_file)
+
+    def _walk_size(self, entry_dir):
+        """Add up the sizes of the files in a cache entry.
+
+        :type entry_dir: str
+        :param entry_dir: The directory of the cache entry.
+        :rtype: int
+        :return: The size of the entry in bytes.
+        """
+
+        entry_size = 0
+        for root, dirs, files in os.walk(entry_dir):
+            for filename in files:
+                entry_size += op.getsize(op.join(root, filename))
+
+        return entry_size
+
+    def size(self):
+        """Get the size of each cache entry.
+
+        - The size each entry recorded when it was stored is used, and only
+          entries without one (stored by an older QAP version) are walked.
+
+        :rtype: list
+        :return: A list of (last used time, size in bytes, key) tuples.
+        """
+
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = op.join(self.cache_dir, key)
+            if not op.isdir(entry_dir):
+                continue
+            try:
+                entry_size = self._read_size(op.join(entry_dir,
+                                                     "entry_size"))
+                if entry_size is None:
+                    entry_size = self._walk_size(entry_dir)
+                entries.append((op.getmtime(entry_dir), entry_size, key))
+            except OSError:
+                # being evicted by another process
+                continue
+
+        return entries
+
+    def _evict(self):
+        """Delete the least recently used cache entries until the cache is
+        within its size limit, and record the new total size. The cache's
+        lock must be held.
+
+        :rtype: list
+        :return: A list of the keys of the evicted entries.
+        """
+
+        import shutil
+
+        entries = sorted(self.size())
+        total_size = sum([entry[1] for entry in entries])
+
+        evicted = []
+        for last_used, entry_size, key in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(op.join(self.cache_dir, key), ignore_errors=True)
+            total_size -= entry_size
+            evicted.append(key)
+
+        self._write_size(op.join(self.cache_dir, "cache_size"), total_size)
+
+        return evicted
+
+    def evict(self):
+        """Delete the least recently used cache entries until the cache is
+        within its size limit.
+
+        :rtype: list
+        :return: A list of the keys of the evicted entries.
+        """
+
+        lock = self._lock()
+        try:
+            return self._evict()
+        finally:
+            lock.release()
@@ -0,0 +1,225 @@
+import os
+import os.path as op
+
+
+class ResultsStore(object):
+    """An append-only store of the QAP results written during a run, in
+    place of re-writing each participant's JSON file for every new entry.
+
+    - The store is a JSON Lines log: each record is one line holding the
+      JSON file the results belong to and the dictionary written to it, and
+      is added with one append, under an exclusive lock of the log which is
+      held only for that write. Any number of processes can add records at
+      once.
+    - Reading the log merges the records in order, the same way write_json
+      merges a dictionary into an existing JSON file.
+    - export() writes the merged results out in the usual layout (one JSON
+      file per participant and data type), and compact() rewrites the log
+      with one record per JSON file. rotate() starts a new, empty log, so
+      that a re-run does not export the records of an earlier run.
+    """
+
+    def __init__(self, store_file):
+        """
+        :type store_file: str
+        :param store_file: The filepath of the store's log.
+        """
+
+        self.store_file = store_file
+
+    def _open_locked(self, mode):
+        """Open the log, holding an exclusive lock on it.
+
+        - If the log was replaced by a compaction while waiting for the lock,
+          the new log is opened instead.
+
+        :type mode: str
+        :param mode: The mode to open the log with.
+        :rtype: file
+        :return: The open, locked log file.
+        """
+
+        import fcntl
+
+        while True:
+            log = open(self.store_file, mode)
+            fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(log.fileno()).st_ino == \
+                        os.stat(self.store_file).st_ino:
+                    return log
+            except OSError:
+                pass
+            log.close()
+
+    def append(self, json_file, output_dict):
+        """Add a record to the store.
+
+        :type json_file: str
+        :param json_file: The filepath of the JSON file the results belong
+                          to.
+        :type output_dict: dict
+        :param output_dict: The dictionary to merge into the JSON file.
+        """
+
+        import json
+
+        store_dir = op.dirname(op.abspath(self.store_file))
+        if not op.isdir(store_dir):
+            try:
+                os.makedirs(store_dir)
+            except OSError:
+                if not op.isdir(store_dir):
+                    raise
+
+        line = json.dumps({"json_file": op.abspath(json_file),
+                           "output_dict": output_dict}, sort_keys=True)
+
+        log = self._open_locked("a")
+        try:
+            log.write(line + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        finally:
+            log.close()
+
+    def _merge(self, lines):
+        """Merge log lines into one dictionary per JSON file.
+
+        :type lines: list
+        :param lines: The lines of the log.
+        :rtype: dict
+        :return: A dictionary mapping JSON filepaths to their merged
+                 dictionaries.
+        """
+
+        import json
+
+        merged = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short by a writer killed mid-append
+                continue
+            current = merged.setdefault(record["json_file"], {})
+            for key, value in record["output_dict"].items():
+                if isinstance(value, dict) and \
+                        isinstance(current.get(key), dict):
+                    current[key].update(value)
+                else:
+                    current[key] = value
+
+        return merged
+
+    def read(self):
+        """Read the merged results in the store.
+
+        :rtype: dict
+        :return: A dictionary mapping JSON filepaths to their merged
+                 dictionaries.
+        """
+
+        if not op.isfile(self.store_file):
+            return {}
+
+        with open(self.store_file, "r") as f:
+            return self._merge(f.readlines())
+
+    def compact(self):
+        """Rewrite the log with one record per JSON file, atomically.
+
+        :rtype: int
+        :return: The number of records in the compacted log.
+        """
+
+        import json
+
+        if not op.isfile(self.store_file):
+            return 0
+
+        log = self._open_locked("r")
+        try:
+            merged = self._merge(log.readlines())
+            tmp_file = "%s.%d.tmp" % (self.store_file, os.getpid())
+            with open(tmp_file, "wt") as f:
+                for json_file in sorted(merged.keys()):
+                    f.write(json.dumps({"json_file": json_file,
+                                        "output_dict": merged[json_file]},
+                                       sort_keys=True) + "\n")
+            # writers waiting on the lock re-open the new log
+            os.rename(tmp_file, self.store_file)
+        finally:
+            log.close()
+
+        return len(merged)
+
+    def rotate(self):
+        """Move the log aside as "<log>.previous" (replacing an older one),
+        so that the store starts out empty.
+
+        :rtype: str
+        :return: The filepath the previous log was moved to, or None if
+                 there was no log.
+        """
+
+        if not op.isfile(self.store_file):
+            return None
+
+        previous_file = "%s.previous" % self.store_file
+        log = self._open_locked("r")
+        try:
+            os.rename(self.store_file, previous_file)
+        finally:
+            log.close()
+
+        return previous_file
+
+    def export(self, output_dirs=None):
+        """Write the store's results out as JSON files, in the layout
+        written by write_json.
+
+        - The results are merged into any existing content of each JSON
+          file (e.g. results restored from the result cache), and each file
+          is replaced atomically.
+
+        :type output_dirs: list
+        :param output_dirs: (default: None) Only export the JSON files in
+                            these directories.
+        :rtype: list
+        :return: The filepaths of the exported JSON files.
+        """
+
+        import json
+        from qap.qap_utils import read_json
+
+        merged = self.read()
+        if output_dirs is not None:
+            output_dirs = [op.abspath(out_dir) for out_dir in output_dirs]
+
+        exported = []
+        for json_file in sorted(merged.keys()):
+            if output_dirs is not None and \
+                    op.dirname(json_file) not in output_dirs:
+                continue
+
+            current = {}
+            if op.isfile(json_file):
+                current = read_json(json_file)
+            for key, value in merged[json_file].items():
+                try:
+                    current[key].update(value)
+                except (KeyError, AttributeError):
+                    current[key] = value
+
+            if not op.isdir(op.dirname(json_file)):
+                os.makedirs(op.dirname(json_file))
+            tmp_file = "%s.%d.tmp" % (json_file, os.getpid())
+            with open(tmp_file, "wt") as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+            os.rename(tmp_file, json_file)
+            exported.append(json_file)
+
+        return exported
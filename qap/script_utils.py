@@ -1,4 +1,12 @@
 
+# the QAP measures compared by qap_csv_correlations
+CORRELATION_METRICS = ["EFC", "SNR", "FBER", "CNR", "FWHM", "Qi1",
+                       "Cortical Contrast", "Ghost_x", "Ghost_y", "Ghost_z",
+                       "GCOR", "RMSD (Mean)", "Quality (Mean)",
+                       "Fraction of Outliers (Mean)", "Std. DVARS (Mean)",
+                       "Fraction of OOB Outliers (Mean)"]
+
+
 def read_txt_file(txt_file):
     """Read in a text file into a list of strings.
 
@@ -53,20 +61,23 @@ def gather_filepath_list(site_folder):
     return filepath_list
 
 
-def csv_to_pandas_df(csv_file):
-    """Convert the data in a CSV file into a Pandas DataFrame.
+def csv_to_pandas_df(csv_file, columns=None):
+    """Convert the data in a QAP output table (a CSV file, or a Parquet file
+    written alongside it) into a Pandas DataFrame.
 
     :type csv_file: str
-    :param csv_file: The filepath to the CSV file to be loaded.
+    :param csv_file: The filepath to the CSV or Parquet file to be loaded.
+    :type columns: list
+    :param columns: (default: None) Load only these columns - any of them
+                    missing from the table are skipped.
     :rtype: Pandas DataFrame
     :return: A DataFrame object with the data from the CSV file.
     """
 
-    import pandas as pd
     from qap.qap_utils import raise_smart_exception
 
     try:
-        data = pd.read_csv(csv_file, dtype={"Participant": str})
+        data = read_qap_table(csv_file, columns)
     except Exception as e:
         err = "Could not load the CSV file into a DataFrame using Pandas." \
               "\n\nCSV file: %s\n\nError details: %s\n\n" % (csv_file, e)
@@ -392,48 +403,85 @@ def pull_s3_sublist(data_folder, creds_path=None):
     return s3_list
 
 
-def gather_json_info(output_dir):
+def find_json_files(output_dir):
+    """Find the JSON output files in a QAP run's output directory.
+
+    :type output_dir: str
+    :param output_dir: The path to the main output directory of the QAP run.
+    :rtype: list
+    :return: The JSON filepaths, in directory walk order.
+    """
+
+    import os
+
+    json_files = []
+    for root, dirs, files in os.walk(os.path.abspath(output_dir)):
+        for filename in files:
+            if filename.endswith(".json"):
+                json_files.append(os.path.join(root, filename))
+
+    return json_files
+
+
+def read_json_files(json_files, num_threads=8):
+    """Read several JSON files at once, with a pool of threads.
+
+    :type json_files: list
+    :param json_files: The JSON filepaths.
+    :type num_threads: int
+    :param num_threads: (default: 8) The number of files to read at once.
+    :rtype: list
+    :return: The dictionaries read from the files, in the same order.
+    """
+
+    from multiprocessing.pool import ThreadPool
+    from qap.qap_utils import read_json
+
+    if len(json_files) < 2 or num_threads < 2:
+        return [read_json(json_file) for json_file in json_files]
+
+    pool = ThreadPool(min(num_threads, len(json_files)))
+    try:
+        return pool.map(read_json, json_files)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def gather_json_info(output_dir, num_threads=8):
     """Extract the dictionaries from the JSON output files and merge them into
     one dictionary.
 
     :type output_dir: str
     :param output_dir: The path to the main output directory of the QAP run.
+    :type num_threads: int
+    :param num_threads: (default: 8) The number of JSON files to read at
+                        once.
     :rtype: dict
     :return: The output data of the QAP run keyed by participant-session-scan.
     """
 
-    import os
-    from qap.qap_utils import read_json
-
     json_dict = {}
 
-    for root, dirs, files in os.walk(os.path.abspath(output_dir)):
-        for filename in files:
-            if ".json" in filename:
-                filepath = os.path.join(root,filename)
-                temp_dict = read_json(filepath)
-                json_dict.update(temp_dict)
+    json_files = find_json_files(output_dir)
+    for temp_dict in read_json_files(json_files, num_threads):
+        json_dict.update(temp_dict)
 
     return json_dict
 
-    
-def json_to_csv(json_dict, csv_output_dir=None):
-    """Extract the data from the JSON output file and write it to a CSV file.
+
+def flatten_json_dict(json_dict):
+    """Flatten the QAP JSON output dictionaries into one row dictionary per
+    participant-session-scan and QAP measure type.
 
     :type json_dict: dict
-    :param json_dict: Dictionary containing all of the JSON output
-                      information from the QAP run.
-    :type csv_output_dir: str
-    :param csv_output_dir: (default: None) Path to the directory to write the
-                           CSV file into.
-    :rtype: str
-    :return: The CSV file path.
+    :param json_dict: Dictionary containing JSON output information from the
+                      QAP run.
+    :rtype: dict
+    :return: A dictionary mapping each QAP measure type to a list of row
+             dictionaries.
     """
 
-    import os
-    import pandas as pd
-    from qap.qap_utils import raise_smart_exception
-
     qap_types = ["anatomical_spatial",
                  "functional_spatial",
                  "functional_temporal"]
@@ -473,26 +521,300 @@ def json_to_csv(json_dict, csv_output_dir=None):
             except KeyError:
                 output_dict[qap_type] = [qap_dict]
 
+    return output_dict
+
+
+def import_pyarrow_parquet():
+    """Import the PyArrow Parquet module, which is needed to write and read
+    the QAP output tables in the Parquet format.
+
+    :rtype: module
+    :return: The pyarrow.parquet module.
+    """
+
+    from qap.qap_utils import raise_smart_exception
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        err = "\n\n[!] Writing or reading the QAP output tables in the " \
+              "Parquet format requires the PyArrow package.\n\nInstall " \
+              "it with:\npip install pyarrow\n\n"
+        raise_smart_exception(locals(), err)
+
+    return pq
+
+
+def set_qap_table_types(qap_df):
+    """Store the columns of a QAP output table with their proper types: the
+    participant, session and series IDs as strings, and the measures (and
+    other values) as numbers wherever they are numbers.
+
+    - Values stored as strings in older JSON output files are converted back
+      into numbers. Columns which are not entirely numeric are stored as
+      strings.
+
+    :type qap_df: Pandas DataFrame
+    :param qap_df: The QAP output table.
+    :rtype: Pandas DataFrame
+    :return: The QAP output table, with its columns converted.
+    """
+
+    import pandas as pd
+
+    for column in qap_df.columns:
+        if column not in ["Participant", "Session", "Series", "Site"]:
+            qap_df[column] = pd.to_numeric(qap_df[column], errors="ignore")
+        if qap_df[column].dtype == object:
+            qap_df[column] = qap_df[column].map(
+                lambda value: value if pd.isnull(value) else str(value))
+
+    return qap_df
+
+
+def read_qap_table(table_file, columns=None):
+    """Read a QAP output table, from a CSV or a Parquet file.
+
+    - Only the requested columns are read: Parquet files are read column by
+      column, and the other columns of a CSV file are skipped while it is
+      parsed.
+
+    :type table_file: str
+    :param table_file: The filepath of the CSV or Parquet file.
+    :type columns: list
+    :param columns: (default: None) Read only these columns - any of them
+                    missing from the table are skipped.
+    :rtype: Pandas DataFrame
+    :return: The QAP output table.
+    """
+
+    import pandas as pd
+
+    id_types = {"Participant": str, "Session": str, "Series": str}
+
+    if table_file.endswith(".parquet"):
+        pq = import_pyarrow_parquet()
+        if columns is not None:
+            columns = [column for column in
+                       pq.read_schema(table_file).names
+                       if column in columns]
+        return pd.read_parquet(table_file, engine="pyarrow",
+                               columns=columns)
+
+    usecols = None
+    if columns is not None:
+        usecols = lambda column: column in columns
+
+    return pd.read_csv(table_file, dtype=id_types, usecols=usecols)
+
+
+def write_qap_table(qap_df, csv_file, write_parquet=False):
+    """Write a QAP output table to a CSV file, and optionally to a Parquet
+    file alongside it.
+
+    :type qap_df: Pandas DataFrame
+    :param qap_df: The QAP output table.
+    :type csv_file: str
+    :param csv_file: The filepath of the CSV file to write.
+    :type write_parquet: bool
+    :param write_parquet: (default: False) Also write the table to a
+                          Parquet file, with the CSV file's name.
+    :rtype: list
+    :return: The filepaths of the files written.
+    """
+
+    import os
+    from qap.qap_utils import raise_smart_exception
+
+    try:
+        qap_df.to_csv(csv_file)
+    except:
+        err = "Could not write CSV file!\nCSV file: %s" % csv_file
+        raise_smart_exception(locals(), err)
+
+    out_files = [csv_file]
+
+    if write_parquet:
+        import_pyarrow_parquet()
+        parquet_file = "%s.parquet" % os.path.splitext(csv_file)[0]
+        try:
+            qap_df.to_parquet(parquet_file, engine="pyarrow", index=False)
+        except Exception as e:
+            err = "Could not write Parquet file!\nParquet file: %s\n\n" \
+                  "Error details: %s\n\n" % (parquet_file, e)
+            raise_smart_exception(locals(), err)
+        out_files.append(parquet_file)
+
+    return out_files
+
+
+def json_to_csv(json_dict, csv_output_dir=None, write_parquet=False):
+    """Extract the data from the JSON output file and write it to a CSV file.
+
+    :type json_dict: dict
+    :param json_dict: Dictionary containing all of the JSON output
+                      information from the QAP run.
+    :type csv_output_dir: str
+    :param csv_output_dir: (default: None) Path to the directory to write the
+                           CSV file into.
+    :type write_parquet: bool
+    :param write_parquet: (default: False) Also write each table to a
+                          Parquet file alongside the CSV file.
+    :rtype: str
+    :return: The CSV file path.
+    """
+
+    import os
+    import pandas as pd
+
+    output_dict = flatten_json_dict(json_dict)
+
     for qap_type in output_dict.keys():
 
-        json_df = pd.DataFrame(output_dict[qap_type])
+        json_df = set_qap_table_types(pd.DataFrame(output_dict[qap_type]))
         json_df.sort_values(by=["Participant","Session","Series"],
                             inplace=True)
         if not csv_output_dir:
             csv_output_dir = os.getcwd()
         csv_file = os.path.join(csv_output_dir, "qap_%s.csv" % qap_type)
 
-        try:
-            json_df.to_csv(csv_file)
-        except:
-            err = "Could not write CSV file!\nCSV file: %s" % csv_file
-            raise_smart_exception(locals(), err)
+        write_qap_table(json_df, csv_file, write_parquet)
 
         print "CSV file created successfully: %s" % csv_file
 
     return csv_file
 
 
+def update_json_csvs(output_dir, csv_output_dir=None, num_threads=8,
+                     rebuild=False, write_parquet=False):
+    """Update the QAP CSV files from the JSON output files, re-reading only
+    the JSON files which changed since the last update.
+
+    - A manifest of the JSON files read (their path, modification time and
+      size, and the rows they produced) is kept next to the CSV files. The
+      rows of changed or removed JSON files are dropped from the existing
+      CSV tables, and the rows of changed or new JSON files are appended.
+    - Without a manifest (or with one of its CSV files missing), every JSON
+      file is read, and the CSV files are written from scratch.
+
+    :type output_dir: str
+    :param output_dir: The path to the main output directory of the QAP run.
+    :type csv_output_dir: str
+    :param csv_output_dir: (default: None) Path to the directory to write the
+                           CSV files into.
+    :type num_threads: int
+    :param num_threads: (default: 8) The number of JSON files to read at
+                        once.
+    :type rebuild: bool
+    :param rebuild: (default: False) Ignore the manifest, and write the CSV
+                    files from scratch.
+    :type write_parquet: bool
+    :param write_parquet: (default: False) Also write each table to a
+                          Parquet file alongside the CSV file.
+    :rtype: list
+    :return: The filepaths of the CSV files written.
+    """
+
+    import os
+    import json
+    import pandas as pd
+    from qap.qap_utils import read_json
+
+    if not csv_output_dir:
+        csv_output_dir = os.getcwd()
+    manifest_file = os.path.join(csv_output_dir, "qap_csv_manifest.json")
+
+    manifest = {"output_dir": os.path.abspath(output_dir), "files": {},
+                "csv_files": []}
+    if os.path.isfile(manifest_file) and not rebuild:
+        old_manifest = read_json(manifest_file)
+        if old_manifest.get("output_dir") == manifest["output_dir"] and \
+                all([os.path.isfile(csv_file) for csv_file in
+                     old_manifest["csv_files"]]):
+            manifest = old_manifest
+
+    current = {}
+    for json_file in find_json_files(output_dir):
+        stat = os.stat(json_file)
+        current[json_file] = [stat.st_mtime, stat.st_size]
+
+    changed = [json_file for json_file in sorted(current.keys())
+               if json_file not in manifest["files"].keys() or
+               manifest["files"][json_file][:2] != current[json_file]]
+    removed = [json_file for json_file in manifest["files"].keys()
+               if json_file not in current.keys()]
+
+    # the rows to drop from the existing tables
+    stale_rows = set()
+    for json_file in changed + removed:
+        if json_file in manifest["files"].keys():
+            for qap_type, id_string in manifest["files"][json_file][2]:
+                stale_rows.add((qap_type, id_string))
+        manifest["files"].pop(json_file, None)
+
+    new_rows = {}
+    for json_file, json_dict in zip(changed,
+                                    read_json_files(changed, num_threads)):
+        rows = flatten_json_dict(json_dict)
+        file_rows = []
+        for qap_type in rows.keys():
+            new_rows.setdefault(qap_type, []).extend(rows[qap_type])
+            for row in rows[qap_type]:
+                id_string = "%s %s %s" % (row["Participant"], row["Session"],
+                                          row["Series"])
+                file_rows.append([qap_type, id_string])
+                stale_rows.add((qap_type, id_string))
+        manifest["files"][json_file] = current[json_file] + [file_rows]
+
+    qap_types = set(new_rows.keys())
+    qap_types.update([qap_type for qap_type, id_string in stale_rows])
+    if write_parquet:
+        # tables written before without their Parquet file
+        for csv_file in manifest["csv_files"]:
+            parquet_file = "%s.parquet" % os.path.splitext(csv_file)[0]
+            if not os.path.isfile(parquet_file):
+                qap_types.add(os.path.basename(csv_file)[len("qap_"):-4])
+
+    csv_files = set(manifest["csv_files"])
+    for qap_type in sorted(qap_types):
+        csv_file = os.path.join(csv_output_dir, "qap_%s.csv" % qap_type)
+
+        tables = []
+        if csv_file in manifest["csv_files"]:
+            old_df = read_qap_table(csv_file).drop(columns=["Unnamed: 0"])
+            old_ids = old_df["Participant"] + " " + old_df["Session"] + \
+                " " + old_df["Series"]
+            keep = [(qap_type, id_string) not in stale_rows
+                    for id_string in old_ids]
+            tables.append(old_df[keep])
+        if qap_type in new_rows.keys():
+            tables.append(pd.DataFrame(new_rows[qap_type]))
+
+        # keep the sorted column order json_to_csv writes, also when the
+        # new rows bring new columns
+        columns = set()
+        for table in tables:
+            columns.update(table.columns)
+        tables = [table.reindex(columns=sorted(columns))
+                  for table in tables]
+
+        json_df = set_qap_table_types(pd.concat(tables, ignore_index=True))
+        json_df.sort_values(by=["Participant","Session","Series"],
+                            inplace=True)
+        json_df.reset_index(drop=True, inplace=True)
+
+        write_qap_table(json_df, csv_file, write_parquet)
+
+        csv_files.add(csv_file)
+        print "CSV file updated successfully: %s" % csv_file
+
+    manifest["csv_files"] = sorted(csv_files)
+    with open(manifest_file, "wt") as f:
+        json.dump(manifest, f)
+
+    return manifest["csv_files"]
+
+
 def create_CPAC_outputs_dict(cpac_outdir, qap_type, session_format):
 
     # for script 'qap_cpac_output_sublist_generator.py'
@@ -679,6 +1001,25 @@ def create_CPAC_outputs_dict(cpac_outdir, qap_type, session_format):
     return outputs_dict
 
 
+def qap_csv_correlation_columns(replacements=None):
+    """List the columns of the QAP output tables needed to correlate them
+    with qap_csv_correlations, so that only those are loaded.
+
+    :type replacements: list
+    :param replacements: A list of strings describing column name
+                         replacements, in the format "old_name,new_name".
+    :rtype: list
+    :return: The names of the columns to load.
+    """
+
+    columns = ["Participant", "Session", "Series"] + CORRELATION_METRICS
+    if replacements:
+        columns += [word_couple.split(",")[0] for word_couple in
+                    replacements]
+
+    return columns
+
+
 def qap_csv_correlations(data_old, data_new, replacements=None):
     """Create a dictionary of correlations between old and new versions of 
     each QAP measure for the purpose of regression testing, for the 
@@ -687,8 +1028,8 @@ def qap_csv_correlations(data_old, data_new, replacements=None):
     - This is for the 'qap_test_correlations.py' script.
     - This is intended for regression testing between versions of the QAP
       software.
-    - The 'metric_list' below must be kept current with changes to metrics
-      and their titles.
+    - The CORRELATION_METRICS list must be kept current with changes to
+      metrics and their titles.
 
     :type data_old: Pandas DataFrame
     :param data_old: A DataFrame of QAP output measures from the older-
@@ -708,10 +1049,7 @@ def qap_csv_correlations(data_old, data_new, replacements=None):
     import scipy.stats
     from qap.qap_utils import raise_smart_exception
 
-    metric_list = ["EFC","SNR","FBER","CNR","FWHM","Qi1","Cortical Contrast",
-        "Ghost_x", "Ghost_y", "Ghost_z", "GCOR", "RMSD (Mean)", 
-        "Quality (Mean)", "Fraction of Outliers (Mean)", "Std. DVARS (Mean)", 
-        "Fraction of OOB Outliers (Mean)"]
+    metric_list = CORRELATION_METRICS
 
     # update datasets if necessary
     if replacements:
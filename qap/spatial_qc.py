@@ -3,6 +3,10 @@ def summary_mask(anat_data, mask_data):
     """Will calculate the three values (mean, stdev, and size) and return them
     as a tuple.
 
+    - The masked values are held in the compute precision (see
+      'qap_utils.set_compute_precision'), and the mean and standard
+      deviation are accumulated in float64.
+
     :type anat_data: NumPy array
     :param anat_data: The anatomical scan data.
     :type mask_data: NumPy array
@@ -12,15 +16,155 @@ def summary_mask(anat_data, mask_data):
     """
     
     import numpy as np
+    from qap.qap_utils import get_compute_dtype
     
-    anat_masked = anat_data[mask_data == 1].astype(np.float)
-    mean = anat_masked.mean()
-    std = anat_masked.std(ddof=1)
+    anat_masked = anat_data[mask_data == 1].astype(get_compute_dtype())
+    mean = anat_masked.mean(dtype=np.float64)
+    std = anat_masked.std(ddof=1, dtype=np.float64)
     size = len(anat_masked)
     
     return (mean, std, size)
 
 
+def mask_sufficient_stats(anat_data, mask_list):
+    """Calculate the voxel count, sum, sum-of-squares and sum of squared
+    deviations from the mean of the image within each of several (possibly
+    overlapping) binary masks.
+
+    - The masks are packed into one integer label volume, where bit N of a
+      voxel's label is set if the voxel is in mask N. The per-label counts,
+      sums and sums-of-squares are gathered with np.bincount, and then folded
+      back into per-mask totals.
+    - The squared deviations are taken from each label's own mean, and the
+      labels are merged into each mask with the pairwise update of Chan et
+      al., so the variances do not lose precision to cancellation on data
+      with a high baseline, as "sum-of-squares minus count times the mean
+      squared" would.
+    - Accumulation is done in float64 regardless of the image datatype.
+
+    :type anat_data: NumPy array
+    :param anat_data: The anatomical scan data.
+    :type mask_list: list
+    :param mask_list: A list of binary mask arrays (at most 16), each the same
+                      shape as the anatomical data.
+    :rtype: tuple
+    :return: Four NumPy arrays (counts, sums, sums-of-squares, sums of
+             squared deviations), each with one entry per mask in the order
+             provided.
+    """
+
+    import numpy as np
+
+    num_masks = len(mask_list)
+    if num_masks > 16:
+        raise ValueError("At most 16 masks can be combined at once, got %d"
+                         % num_masks)
+
+    label_dtype = np.uint8 if num_masks <= 8 else np.uint16
+    labels = np.zeros(anat_data.shape, dtype=label_dtype)
+    for bit, mask_data in enumerate(mask_list):
+        labels |= (mask_data == 1).astype(label_dtype) << bit
+
+    num_labels = 1 << num_masks
+    labels = labels.ravel()
+    values = np.asarray(anat_data, dtype=np.float64).ravel()
+
+    label_counts = np.bincount(labels, minlength=num_labels)
+    label_sums = np.bincount(labels, weights=values, minlength=num_labels)
+    label_sums_sq = np.bincount(labels, weights=values * values,
+                                minlength=num_labels)
+
+    # membership[label, mask] is 1 if that label includes that mask
+    membership = \
+        (np.arange(num_labels)[:, np.newaxis] >> np.arange(num_masks)) & 1
+
+    counts = label_counts.dot(membership)
+    sums = label_sums.dot(membership)
+    sums_sq = label_sums_sq.dot(membership)
+
+    # the squared deviations of each voxel from its label's mean
+    label_means = label_sums / np.maximum(label_counts, 1)
+    deviations = values - label_means[labels]
+    deviations *= deviations
+    label_sq_devs = np.bincount(labels, weights=deviations,
+                                minlength=num_labels)
+    del deviations
+
+    # merge the labels of each mask around the mask's mean
+    means = sums / np.maximum(counts, 1)
+    mean_diffs = label_means[:, np.newaxis] - means[np.newaxis, :]
+    sq_devs = ((label_sq_devs[:, np.newaxis] +
+                label_counts[:, np.newaxis] * mean_diffs * mean_diffs) *
+               membership).sum(axis=0)
+
+    return counts, sums, sums_sq, sq_devs
+
+
+def summary_from_stats(count, total, sq_dev):
+    """Calculate the same (mean, stdev, size) summary as 'summary_mask' from
+    the sufficient statistics of a masked region.
+
+    - As with 'summary_mask', the mean of an empty mask, and the standard
+      deviation of a mask with fewer than two voxels, are NaN.
+
+    :type count: int
+    :param count: The number of voxels in the mask.
+    :type total: float
+    :param total: The sum of the voxel values in the mask.
+    :type sq_dev: float
+    :param sq_dev: The sum of the squared deviations of the voxel values in
+                   the mask from their mean (as calculated by
+                   'mask_sufficient_stats').
+    :rtype: tuple
+    :return: The summary values (mean, standard deviation, size) of the scan.
+    """
+
+    import numpy as np
+
+    count = int(count)
+    if count == 0:
+        return (np.nan, np.nan, count)
+
+    mean = float(total) / count
+    if count < 2:
+        return (mean, np.nan, count)
+
+    std = np.sqrt(sq_dev / (count - 1))
+
+    return (mean, std, count)
+
+
+def fber_from_stats(fg_total_sq, fg_count, bg_total_sq, bg_count,
+                    num_voxels):
+    """Calculate the Foreground-to-Background Energy Ratio (FBER) from the
+    sufficient statistics of the foreground and background masks.
+
+    - Equivalent to 'fber', including its normalization of the background
+      energy by the number of voxels outside of the background mask.
+
+    :type fg_total_sq: float
+    :param fg_total_sq: The sum of the squared voxel values in the
+                        foreground (head) mask.
+    :type fg_count: int
+    :param fg_count: The number of voxels in the foreground mask.
+    :type bg_total_sq: float
+    :param bg_total_sq: The sum of the squared voxel values in the background
+                        mask.
+    :type bg_count: int
+    :param bg_count: The number of voxels in the background mask.
+    :type num_voxels: int
+    :param num_voxels: The total number of voxels in the image.
+    :rtype: float
+    :return: The foreground-to-background energy ratio (FBER).
+    """
+
+    mean_fg = fg_total_sq / fg_count
+    mean_bg = bg_total_sq / (num_voxels - bg_count)
+    fber = mean_fg / mean_bg
+
+    return fber
+
+
 def check_datatype(background):
     """Process the image data to only include non-negative integer values.
 
@@ -150,6 +294,7 @@ def fber(anat_data, skull_mask_data, bg_mask_data):
     """Calculate the Foreground-to-Background Energy Ratio (FBER) of an image.
 
     - FBER = (mean foreground energy) / (mean background energy)
+    - The energies are accumulated in float64.
 
     :type anat_data: NumPy array
     :param anat_data: The anatomical/spatial data of the image.
@@ -163,9 +308,14 @@ def fber(anat_data, skull_mask_data, bg_mask_data):
     """
 
     import numpy as np
+    from qap.qap_utils import get_compute_dtype
 
-    mean_fg = (np.abs(anat_data[skull_mask_data == 1]) ** 2).sum() / (skull_mask_data.sum())
-    mean_bg = (np.abs(anat_data[bg_mask_data == 1]) ** 2).sum() / (bg_mask_data.size - bg_mask_data.sum())
+    dtype = get_compute_dtype()
+    fg_data = np.asarray(anat_data[skull_mask_data == 1], dtype=dtype)
+    bg_data = np.asarray(anat_data[bg_mask_data == 1], dtype=dtype)
+
+    mean_fg = (np.abs(fg_data) ** 2).sum(dtype=np.float64) / (skull_mask_data.sum())
+    mean_bg = (np.abs(bg_data) ** 2).sum(dtype=np.float64) / (bg_mask_data.size - bg_mask_data.sum())
     fber = mean_fg / mean_bg
 
     return fber
@@ -177,6 +327,9 @@ def efc(anat_data):
     - EFC based on Atkinson 1997, IEEE TMI
     - We normalize the original equation by the maximum entropy so our EFC
       can be easily compared across images with different dimensions.
+    - The image is held in the compute precision (see
+      'qap_utils.set_compute_precision'), and the sums are accumulated in
+      float64.
 
     :type anat_data: Nibabel data
     :param anat_data: The anatomical image data.
@@ -185,9 +338,11 @@ def efc(anat_data):
     """
 
     import numpy as np
+    from qap.qap_utils import get_compute_dtype
         
     # let's get rid of those negative values
-    anat_data = convert_negatives(anat_data)
+    anat_data = np.asarray(convert_negatives(anat_data),
+                           dtype=get_compute_dtype())
         
     # Calculate the maximum value of the EFC (which occurs any time all 
     # voxels have the same value)
@@ -195,10 +350,11 @@ def efc(anat_data):
                 np.log(1.0 / np.sqrt(np.prod(anat_data.shape)))
     
     # Calculate the total image energy
-    b_max   = np.sqrt((anat_data**2).sum())
+    b_max   = np.sqrt((anat_data**2).sum(dtype=np.float64))
     
     # Calculate EFC (add 1e-16 to the image data to keep log happy)
-    efc     = (1.0 / efc_max) * np.sum((anat_data / b_max) * np.log((anat_data + 1e-16) / b_max))
+    efc     = (1.0 / efc_max) * np.sum((anat_data / b_max) * np.log((anat_data + 1e-16) / b_max),
+                                   dtype=np.float64)
     
     if np.isnan(efc): 
         print "NaN found for efc (%3.2f,%3.2f)" % (efc_max,b_max)
@@ -315,6 +471,8 @@ def fwhm(anat_file, mask_file, out_vox=False):
     :return: A tuple of the FWHM values (x, y, z, and combined).
     """
 
+    # see 'fwhm_from_data' for an in-process equivalent
+
     import nibabel as nib
     import numpy as np
     from scipy.special import cbrt
@@ -347,6 +505,192 @@ def fwhm(anat_file, mask_file, out_vox=False):
     return tuple(vals)
 
 
+def fwhm_first_difference(image_data, mask_data, voxel_sizes):
+    """Estimate the FWHM of the image along each axis from the variance of
+    its first differences, as AFNI's 3dFWHMx does by default.
+
+    - For each axis, the ratio of the variance of the differences between
+      neighboring voxels (both inside the mask) to the variance of the
+      voxels inside the mask gives the lag-1 autocorrelation, from which the
+      width of a Gaussian smoothness model follows (Forman et al., 1995).
+    - An axis whose autocorrelation cannot be modeled this way gets a FWHM
+      of -1, as with 3dFWHMx.
+    - The differences are taken in the compute precision (see
+      'qap_utils.set_compute_precision'), and the variances are accumulated
+      in float64.
+
+    :type image_data: NumPy array
+    :param image_data: The 3D image data.
+    :type mask_data: NumPy array
+    :param mask_data: The binary mask to estimate the smoothness within.
+    :type voxel_sizes: list
+    :param voxel_sizes: The voxel dimensions (x, y, z) in mm.
+    :rtype: list
+    :return: The FWHM values (x, y, z) in mm.
+    """
+
+    import numpy as np
+    from qap.qap_utils import get_compute_dtype
+
+    mask = np.asarray(mask_data) != 0
+    image = np.asarray(image_data, dtype=get_compute_dtype())
+    image_var = image[mask].var(ddof=1, dtype=np.float64)
+
+    fwhm_vals = []
+    for axis in range(0, 3):
+        upper = [slice(None)] * 3
+        lower = [slice(None)] * 3
+        upper[axis] = slice(1, None)
+        lower[axis] = slice(None, -1)
+        upper = tuple(upper)
+        lower = tuple(lower)
+
+        both_in_mask = mask[upper] & mask[lower]
+        diffs = image[upper][both_in_mask] - image[lower][both_in_mask]
+
+        arg = 1.0 - 0.5 * (diffs.var(ddof=1, dtype=np.float64) / image_var)
+        if (arg <= 0) or (arg >= 1):
+            fwhm_vals.append(-1.0)
+        else:
+            fwhm_vals.append(np.sqrt(8 * np.log(2)) *
+                             np.sqrt(-1.0 / (4.0 * np.log(arg))) *
+                             voxel_sizes[axis])
+
+    return fwhm_vals
+
+
+def fwhm_acf(image_data, mask_data, voxel_sizes, max_lag=8, min_acf=0.1):
+    """Estimate the FWHM of the image along each axis by fitting a Gaussian
+    model to its spatial autocorrelation function (ACF).
+
+    - The ACF of the demeaned, masked image is calculated with FFTs, and
+      normalized by the number of in-mask voxel pairs at each lag (the ACF
+      of the mask itself).
+    - Along each axis, -ln(ACF) is fit as proportional to the squared lag,
+      over the lags from 1 up to where the ACF first drops below 'min_acf'.
+    - This uses more of the ACF than the first-difference estimate, which
+      only looks at lag 1.
+
+    :type image_data: NumPy array
+    :param image_data: The 3D image data.
+    :type mask_data: NumPy array
+    :param mask_data: The binary mask to estimate the smoothness within.
+    :type voxel_sizes: list
+    :param voxel_sizes: The voxel dimensions (x, y, z) in mm.
+    :type max_lag: int
+    :param max_lag: (default: 8) The largest lag, in voxels, to calculate the
+                    ACF for.
+    :type min_acf: float
+    :param min_acf: (default: 0.1) The smallest ACF value to include in the
+                    fit.
+    :rtype: list
+    :return: The FWHM values (x, y, z) in mm.
+    """
+
+    import numpy as np
+
+    mask = np.asarray(mask_data) != 0
+    image = np.asarray(image_data, dtype=np.float64)
+    image = np.where(mask, image - image[mask].mean(), 0.0)
+
+    # zero-pad by the largest lag so the circular correlation does not wrap
+    fft_shape = [dim + max_lag for dim in image.shape]
+
+    image_fft = np.fft.rfftn(image, fft_shape)
+    acf = np.fft.irfftn(image_fft * image_fft.conj(), fft_shape)
+    del image_fft
+
+    mask_fft = np.fft.rfftn(mask.astype(np.float64), fft_shape)
+    num_pairs = np.fft.irfftn(mask_fft * mask_fft.conj(), fft_shape)
+    del mask_fft
+
+    acf_zero = acf[0, 0, 0] / num_pairs[0, 0, 0]
+
+    fwhm_vals = []
+    for axis in range(0, 3):
+        lags = []
+        neg_log_acf = []
+        for lag in range(1, min(max_lag, image.shape[axis] - 1) + 1):
+            idx = [0, 0, 0]
+            idx[axis] = lag
+            idx = tuple(idx)
+            if num_pairs[idx] < 1:
+                break
+            acf_val = (acf[idx] / num_pairs[idx]) / acf_zero
+            if (acf_val < min_acf) or (acf_val >= 1):
+                break
+            lags.append(lag * voxel_sizes[axis])
+            neg_log_acf.append(-np.log(acf_val))
+
+        if len(lags) == 0:
+            fwhm_vals.append(-1.0)
+            continue
+
+        lags = np.asarray(lags)
+        # least-squares fit of -ln(ACF) = lag^2 / (4 * sigma^2)
+        slope = (lags ** 2).dot(neg_log_acf) / (lags ** 4).sum()
+        sigma = np.sqrt(1.0 / (4.0 * slope))
+        fwhm_vals.append(np.sqrt(8 * np.log(2)) * sigma)
+
+    return fwhm_vals
+
+
+def fwhm_from_data(image_data, mask_data, voxel_sizes, out_vox=False,
+                   method="1dif"):
+    """Calculate the FWHM of an already-loaded image, without running AFNI's
+    3dFWHMx.
+
+    - With the default "1dif" method, this gives the same values as
+      'fwhm' (3dFWHMx -combined).
+    - The combined FWHM is the geometric mean of the valid per-axis values.
+
+    :type image_data: NumPy array
+    :param image_data: The 3D image data.
+    :type mask_data: NumPy array
+    :param mask_data: The binary head mask data.
+    :type voxel_sizes: list
+    :param voxel_sizes: The voxel dimensions (x, y, z) in mm.
+    :type out_vox: bool
+    :param out_vox: (default: False) Output the FWHM as number of voxels
+                    instead of mm (the default).
+    :type method: str
+    :param method: (default: "1dif") Either "1dif" to use the variance of the
+                   first differences, or "acf" to fit the FFT-based ACF.
+    :rtype: tuple
+    :return: A tuple of the FWHM values (x, y, z, and combined).
+    """
+
+    import numpy as np
+    from qap.qap_utils import raise_smart_exception
+
+    voxel_sizes = np.asarray(voxel_sizes[:3], dtype=np.float64)
+
+    if method == "1dif":
+        vals = fwhm_first_difference(image_data, mask_data, voxel_sizes)
+    elif method == "acf":
+        vals = fwhm_acf(image_data, mask_data, voxel_sizes)
+    else:
+        err = "\n\n[!] Unknown FWHM method '%s', should be '1dif' or " \
+              "'acf'.\n\n" % method
+        raise_smart_exception(locals(), err)
+
+    valid = [val for val in vals if val > 0]
+    if len(valid) > 0:
+        combined = np.prod(valid) ** (1.0 / len(valid))
+    else:
+        combined = -1.0
+
+    vals = np.append(vals, combined)
+
+    if out_vox:
+        # convert to voxels, with the geometric mean voxel size for the
+        # combined value
+        pixdim = np.append(voxel_sizes, np.prod(voxel_sizes) ** (1.0 / 3))
+        vals = vals / pixdim
+
+    return tuple(vals)
+
+
 def ghost_direction(epi_data, mask_data, direction="y", ref_file=None,
                     out_file=None):
     """Calculate the Ghost to Signal Ratio of EPI images.
@@ -413,7 +757,7 @@ def ghost_direction(epi_data, mask_data, direction="y", ref_file=None,
    
     # now we calculate the Ghost to signal ratio, but here we define signal
     # as the entire foreground image
-    gsr = (epi_data[n2_mask_data==1].mean() - epi_data[n2_mask_data==2].mean())/epi_data[n2_mask_data==0].mean()
+    gsr = (epi_data[n2_mask_data==1].mean(dtype=np.float64) - epi_data[n2_mask_data==2].mean(dtype=np.float64))/epi_data[n2_mask_data==0].mean(dtype=np.float64)
 
     
     return gsr
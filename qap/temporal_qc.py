@@ -25,6 +25,85 @@ def pass_floats(output_string):
     return values_list
 
 
+def summarize_vectors(vectors):
+    """Calculate the summary statistics of one vector of values, or of each
+    vector in a stack of them, all at once.
+
+    - The statistics are the mean, standard deviation, median, inter-
+      quartile range (IQR), and the fraction of values which are outliers,
+      i.e. more than 1.5 * IQR below the first quartile or above the third
+      (see calculate_percent_outliers).
+    - A stack can hold the measure vectors of one scan, or the vectors of
+      many scans (e.g. to recompute group-level summaries from stored
+      per-timepoint values). Vectors of different lengths are padded to
+      the longest one, and only their own values are summarized.
+    - A NaN in a vector makes its statistics NaN (and its outliers none),
+      as when the vector is summarized on its own.
+
+    :type vectors: list
+    :param vectors: A vector of values, or a list (or 2D NumPy array) of
+                    vectors.
+    :rtype: dict
+    :return: A dictionary of the "mean", "std", "median", "IQR" and
+             "percent_outliers" of the values - floats for one vector, or
+             arrays with one value per vector for a stack.
+    """
+
+    import numpy as np
+
+    padding = None
+    try:
+        values = np.asarray(vectors, dtype=np.float64)
+    except ValueError:
+        # vectors of different lengths - the padding is tracked, so that it
+        # can be told apart from NaN values of the vectors themselves
+        vectors = [np.ravel(vector) for vector in vectors]
+        lengths = np.array([len(vector) for vector in vectors])
+        values = np.empty((len(vectors), lengths.max()))
+        values.fill(np.nan)
+        for idx, vector in enumerate(vectors):
+            values[idx, :len(vector)] = vector
+        padding = np.arange(values.shape[1]) >= lengths[:, np.newaxis]
+
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+
+    if padding is not None:
+        mean = np.nanmean(values, axis=1)
+        std = np.nanstd(values, axis=1)
+        first_qr, median, third_qr = np.nanpercentile(values, [25, 50, 75],
+                                                      axis=1)
+        num_values = lengths
+
+        # vectors with NaN values of their own
+        missing = (np.isnan(values) & ~padding).any(axis=1)
+        for stat in [mean, std, first_qr, median, third_qr]:
+            stat[missing] = np.nan
+    else:
+        with np.errstate(invalid="ignore"):
+            mean = values.mean(axis=1)
+            std = values.std(axis=1)
+            first_qr, median, third_qr = np.percentile(values,
+                                                       [25, 50, 75], axis=1)
+        num_values = values.shape[1]
+
+    IQR = third_qr - first_qr
+    with np.errstate(invalid="ignore"):
+        num_outliers = \
+            (values > (third_qr + 1.5 * IQR)[:, np.newaxis]).sum(axis=1) + \
+            (values < (first_qr - 1.5 * IQR)[:, np.newaxis]).sum(axis=1)
+    percent_outliers = num_outliers / np.asarray(num_values, dtype=float)
+
+    summary = {"mean": mean, "std": std, "median": median, "IQR": IQR,
+               "percent_outliers": percent_outliers}
+
+    if single:
+        for stat in summary.keys():
+            summary[stat] = float(summary[stat][0])
+
+    return summary
+
+
 def calculate_percent_outliers(values_list):
     """Calculate the percentage of outliers from a vector of values.
 
@@ -41,30 +120,58 @@ def calculate_percent_outliers(values_list):
     from qap.qap_utils import raise_smart_exception
 
     try:
-        # calculate the IQR
-        sorted_values = sorted(values_list)
+        summary = summarize_vectors(np.ravel(values_list))
+        percent_outliers = summary["percent_outliers"]
+        IQR = summary["IQR"]
+    except:
+        raise_smart_exception(locals())
 
-        third_qr, first_qr = np.percentile(sorted_values, [75, 25])
-        IQR = third_qr - first_qr
+    return percent_outliers, IQR
 
-        # calculate percent outliers
-        third_qr_threshold = third_qr + (1.5 * IQR)
-        first_qr_threshold = first_qr - (1.5 * IQR)
 
-        high_outliers = \
-            [val for val in sorted_values if val > third_qr_threshold]
-        low_outliers = \
-            [val for val in sorted_values if val < first_qr_threshold]
+def fd_jenkinson_from_matrices(affine_matrices, rmax=80.):
+    """Calculate Jenkinson's Framewise Displacement (aka RMSD) from a
+    timeseries of rigid-body affine matrices, for all timepoints at once.
 
-        total_outliers = high_outliers + low_outliers
+    - The relative transform of each timepoint, T_i * inv(T_i-1) - I, is
+      found for every timepoint with one batched linear solve instead of a
+      matrix inverse per timepoint, and the trace and translation terms are
+      summed with einsum.
 
-        percent_outliers = \
-            float(len(total_outliers)) / float(len(sorted_values))
+    :type affine_matrices: NumPy array
+    :param affine_matrices: The affine matrix of each timepoint, with shape
+                            (ntpts, 12) as in the rows of 3dvolreg's
+                            -1Dmatrix_save output (row-by-row), or with shape
+                            (ntpts, 3, 4) or (ntpts, 4, 4).
+    :type rmax: float
+    :param rmax: (default: 80.0) The default radius of a sphere that
+                 represents the brain.
+    :rtype: NumPy array
+    :return: The FD value of each timepoint (zero for the first).
+    """
 
-    except:
-        raise_smart_exception(locals())
+    import numpy as np
 
-    return percent_outliers, IQR
+    affine_matrices = np.asarray(affine_matrices, dtype=np.float64)
+    ntpts = affine_matrices.shape[0]
+
+    # (ntpts, 4, 4) stack of the transformation matrices
+    T_rb = np.zeros((ntpts, 4, 4))
+    T_rb[:, 3, 3] = 1.0
+    rows = affine_matrices.reshape(ntpts, -1, 4)[:, :3, :]
+    T_rb[:, :3, :] = rows
+
+    # X_i = T_i * inv(T_i-1), from inv(T_i-1)' * X_i' = T_i'
+    X = np.linalg.solve(T_rb[:-1].transpose(0, 2, 1),
+                        T_rb[1:].transpose(0, 2, 1)).transpose(0, 2, 1)
+    M = X - np.eye(4)
+    A = M[:, 0:3, 0:3]
+    b = M[:, 0:3, 3]
+
+    FD_J = np.sqrt((rmax * rmax / 5) * np.einsum("nij,nij->n", A, A) +
+                   np.einsum("ni,ni->n", b, b))
+
+    return np.concatenate([[0.0], FD_J])
 
 
 def fd_jenkinson(in_file, rmax=80., out_file=None, out_array=False):
@@ -79,11 +186,16 @@ def fd_jenkinson(in_file, rmax=80., out_file=None, out_array=False):
       correction file (an output of 3dvolreg) output: FD_J.1D file
     - in_file should have one 3dvolreg affine matrix in one row - NOT the
       motion parameters.
+    - The affine matrices can also be provided already in memory, and with
+      out_array the FD values are returned without writing a file (unless
+      an out_file is given), so that nothing round-trips through text
+      files.
 
     :type in_file: str
     :param in_file: Filepath to the coordinate transformation output vector
                     of AFNI's 3dvolreg (generated by running 3dvolreg with
-                    the -1Dmatrix_save option).
+                    the -1Dmatrix_save option), or an array of the affine
+                    matrices (see fd_jenkinson_from_matrices).
     :type rmax: float
     :param rmax: (default: 80.0) The default radius of a sphere that
                  represents the brain.
@@ -103,58 +215,43 @@ def fd_jenkinson(in_file, rmax=80., out_file=None, out_array=False):
     import numpy as np
     import os.path as op
     from shutil import copyfile
-    import math
     from qap.qap_utils import raise_smart_exception
 
-    if out_file is None:
-        fname, ext = op.splitext(op.basename(in_file))
-        out_file = op.abspath('%s_fdfile%s' % (fname, ext))
+    in_memory = not isinstance(in_file, basestring)
+
+    if out_file is None and not out_array:
+        if in_memory:
+            out_file = op.abspath('fdfile.1D')
+        else:
+            fname, ext = op.splitext(op.basename(in_file))
+            out_file = op.abspath('%s_fdfile%s' % (fname, ext))
 
     # if in_file (coordinate_transformation) is actually the rel_mean output
     # of the MCFLIRT command, forward that file
-    if 'rel.rms' in in_file:
+    if not in_memory and 'rel.rms' in in_file:
+        if out_array:
+            return np.loadtxt(in_file, ndmin=1)
         copyfile(in_file, out_file)
         return out_file
 
-    try:
-        pm_ = np.genfromtxt(in_file)
-    except:
-        raise_smart_exception(locals())
-
-    original_shape = pm_.shape
-    pm = np.zeros((pm_.shape[0], pm_.shape[1] + 4))
-    pm[:, :original_shape[1]] = pm_
-    pm[:, original_shape[1]:] = [0.0, 0.0, 0.0, 1.0]
-
-    # rigid body transformation matrix
-    T_rb_prev = np.matrix(np.eye(4))
-
-    flag = 0
-    X = [0]  # First timepoint
-    for i in range(0, pm.shape[0]):
-        # making use of the fact that the order of aff12 matrix is "row-by-row"
-        T_rb = np.matrix(pm[i].reshape(4, 4))
-
-        if flag == 0:
-            flag = 1
-        else:
-            M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
-            A = M[0:3, 0:3]
-            b = M[0:3, 3]
-
-            FD_J = math.sqrt(
-                (rmax * rmax / 5) * np.trace(np.dot(A.T, A)) + np.dot(b.T, b))
-            X.append(FD_J)
+    if in_memory:
+        pm = in_file
+    else:
+        try:
+            pm = np.loadtxt(in_file, ndmin=2)
+        except:
+            raise_smart_exception(locals())
 
-        T_rb_prev = T_rb
+    X = fd_jenkinson_from_matrices(pm, rmax)
 
-    try:
-        np.savetxt(out_file, np.array(X))
-    except:
-        raise_smart_exception(locals())
+    if out_file is not None:
+        try:
+            np.savetxt(out_file, X)
+        except:
+            raise_smart_exception(locals())
 
     if out_array:
-        return np.array(X)
+        return X
     else:
         return out_file
 
@@ -166,6 +263,8 @@ def outlier_timepoints(func_file, mask_file=None, out_fraction=True):
     - Uses AFNI 3dToutcount. More info here:
         https://afni.nimh.nih.gov/pub/dist/doc/program_help/3dToutcount.html
     - Used for the 'Fraction of Outliers' QAP functional temporal metrics.
+    - See 'outlier_timepoints_from_data' for an in-process equivalent which
+      works on already-loaded data.
 
     :type func_file: str
     :param func_file: Path to 4D functional timeseries NIFTI file.
@@ -209,6 +308,170 @@ def outlier_timepoints(func_file, mask_file=None, out_fraction=True):
     return outliers
 
 
+def detrend_l1(chunk, basis, iterations=200, tolerance=1e-9):
+    """Remove the least absolute deviations (L1) fit of a set of basis
+    functions from each row of a block of timeseries.
+
+    - 3dToutcount detrends with L1 rather than least-squares regression, so
+      that the spikes it is looking for do not pull the trend towards them.
+    - The fit is found by iteratively reweighted least squares, for all of
+      the rows at once, starting from the least-squares fit. Every iteration
+      solves one small (basis by basis) system per row. As an L1 fit passes
+      exactly through as many timepoints as there are basis functions, the
+      result is then snapped to the fit through the timepoints closest to
+      it, wherever that lowers the sum of absolute deviations.
+    - The fit is calculated in float64; the detrended block is returned in
+      the block's own dtype.
+
+    :type chunk: NumPy array
+    :param chunk: The timeseries, with shape (nvoxs, ntpts).
+    :type basis: NumPy array
+    :param basis: The basis functions, with shape (ntpts, nbasis) and
+                  orthonormal columns.
+    :type iterations: int
+    :param iterations: (default: 200) The most reweighting iterations to
+                       run.
+    :type tolerance: float
+    :param tolerance: (default: 1e-9) Stop once no fit coefficient changes by
+                      more than this, relative to the spread of its row.
+    :rtype: NumPy array
+    :return: The residuals of the L1 fit, with the same shape as the chunk.
+    """
+
+    import numpy as np
+
+    data = np.asarray(chunk, dtype=np.float64)
+    basis = np.asarray(basis, dtype=np.float64)
+
+    coefs = data.dot(basis)
+    residuals = data - coefs.dot(basis.T)
+    # below this, a residual counts as zero when weighting it
+    floor = 1e-12 * (np.abs(data).max(axis=1) + 1)[:, np.newaxis]
+    scale = np.abs(residuals).max(axis=1) + floor[:, 0]
+
+    # only the rows whose fit is still changing are reweighted
+    active = np.arange(data.shape[0])
+    for iteration in range(0, iterations):
+        if len(active) == 0:
+            break
+        weights = 1.0 / np.maximum(np.abs(residuals[active]), floor[active])
+        normal = np.einsum("vt,tp,tq->vpq", weights, basis, basis)
+        rhs = (weights * data[active]).dot(basis)
+        new_coefs = np.linalg.solve(normal, rhs[:, :, np.newaxis])[:, :, 0]
+        change = np.abs(new_coefs - coefs[active]).max(axis=1) / \
+            scale[active]
+        coefs[active] = new_coefs
+        residuals[active] = data[active] - new_coefs.dot(basis.T)
+        active = active[change >= tolerance]
+
+    # snap to the fit through the nbasis timepoints closest to the curve
+    nbasis = basis.shape[1]
+    closest = np.argsort(np.abs(residuals), axis=1)[:, :nbasis]
+    systems = basis[closest]
+    rows = np.flatnonzero(np.abs(np.linalg.det(systems)) > 1e-12)
+    if len(rows) > 0:
+        snapped = np.linalg.solve(systems[rows],
+                                  data[rows[:, np.newaxis], closest[rows]])
+        snapped_residuals = data[rows] - snapped.dot(basis.T)
+        better = np.abs(snapped_residuals).sum(axis=1) < \
+            np.abs(residuals[rows]).sum(axis=1)
+        residuals[rows[better]] = snapped_residuals[better]
+
+    return residuals.astype(np.asarray(chunk).dtype)
+
+
+def outlier_timepoints_from_data(func_data, mask_list=None,
+                                 out_fraction=True, polort=0, qthr=0.001,
+                                 voxels_per_chunk=10000):
+    """Calculate the number of 'outliers' at each time-point of an already-
+    loaded 4D functional timeseries, within one or more masks at once.
+
+    - A NumPy implementation of AFNI's 3dToutcount, used for the 'Fraction of
+      Outliers' QAP functional temporal metrics. More info here:
+        https://afni.nimh.nih.gov/pub/dist/doc/program_help/3dToutcount.html
+    - Each voxel's timeseries is (optionally) detrended with Legendre
+      polynomials, fitted by L1 regression as 3dToutcount does (see
+      'detrend_l1'), and its median and MAD (median absolute deviation from
+      the median) are calculated. Timepoints further than
+      alpha * sqrt(PI/2) * MAD from the median are outliers, where alpha is
+      the upper-tail Gaussian quantile of qthr / (number of timepoints).
+      Voxels with a MAD of zero have no outliers.
+    - The outliers are found once for every voxel in any of the masks, and
+      then counted for each mask, so the in-brain and out-of-brain counts are
+      calculated together in one pass over the data.
+    - The voxels are held in the compute precision (see
+      'qap_utils.set_compute_precision'); the detrending fit itself is
+      calculated in float64.
+
+    :type func_data: NumPy array
+    :param func_data: The 4D functional timeseries data.
+    :type mask_list: list
+    :param mask_list: (default: None) A list of 3D binary masks to count the
+                      outliers within. If None, every voxel in the image is
+                      used, as with 3dToutcount run without a mask.
+    :type out_fraction: bool
+    :param out_fraction: (default: True) Whether the output should be a count
+                         (False) or fraction (True) of the number of masked
+                         voxels which are outliers at each time point.
+    :type polort: int
+    :param polort: (default: 0) The order of the Legendre polynomials to
+                   detrend each voxel's timeseries with; 0 only removes the
+                   median, as 3dToutcount does by default.
+    :type qthr: float
+    :param qthr: (default: 0.001) The outlier threshold, as with
+                 3dToutcount's -qthr option.
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 10000) How many voxels to process at
+                             once, to bound the size of temporary arrays.
+    :rtype: list
+    :return: A list with one list of outlier values per mask provided (or
+             only one, if no masks were provided).
+    """
+
+    import numpy as np
+    from scipy.stats import norm
+    from qap.qap_utils import get_compute_dtype
+
+    dtype = get_compute_dtype()
+    ntpts = func_data.shape[-1]
+    func_2d = func_data.reshape(-1, ntpts)
+
+    if mask_list is None:
+        membership = np.ones((func_2d.shape[0], 1), dtype=bool)
+    else:
+        membership = np.column_stack([np.asarray(mask_data).ravel() != 0
+                                      for mask_data in mask_list])
+
+    in_any_mask = np.flatnonzero(membership.any(axis=1))
+
+    alpha = norm.isf(qthr / ntpts) * np.sqrt(np.pi / 2)
+
+    if polort > 0:
+        timepoints = np.linspace(-1, 1, ntpts)
+        basis, _ = np.linalg.qr(
+            np.polynomial.legendre.legvander(timepoints, polort))
+
+    counts = np.zeros((ntpts, membership.shape[1]))
+
+    for start in range(0, len(in_any_mask), voxels_per_chunk):
+        vox_idx = in_any_mask[start:start + voxels_per_chunk]
+        chunk = np.asarray(func_2d[vox_idx], dtype=dtype)
+
+        if polort > 0:
+            chunk = detrend_l1(chunk, basis)
+
+        deviation = np.abs(chunk - np.median(chunk, axis=1)[:, np.newaxis])
+        mad = np.median(deviation, axis=1)[:, np.newaxis]
+        outliers = (deviation > alpha * mad) & (mad > 0)
+
+        counts += outliers.T.astype(np.float64).dot(membership[vox_idx])
+
+    if out_fraction:
+        counts = counts / membership.sum(axis=0)
+
+    return [list(counts[:, idx]) for idx in range(0, counts.shape[1])]
+
+
 def quality_timepoints(func_file):
     """Calculates a 'quality index' for each timepoint in the 4D functional
     dataset using AFNI's 3dTqual.
@@ -218,6 +481,8 @@ def quality_timepoints(func_file):
     - Used for the 'Quality' QAP functional temporal metrics.
     - Low values are good and indicate that the timepoint is not very
       different from the norm.
+    - See 'quality_timepoints_from_data' for an in-process equivalent which
+      works on already-loaded data.
 
     :type func_file: str
     :param func_file: Filepath to the 4D functional timerseries NIFTI file.
@@ -249,6 +514,77 @@ def quality_timepoints(func_file):
     return quality
 
 
+def quality_timepoints_from_data(func_data, mask_data=None, clip_level=None,
+                                 voxels_per_chunk=10000):
+    """Calculate a 'quality index' for each timepoint of an already-loaded 4D
+    functional timeseries.
+
+    - A NumPy implementation of AFNI's 3dTqual (with its default -spearman
+      method), used for the 'Quality' QAP functional temporal metrics. More
+      info here:
+        https://afni.nimh.nih.gov/pub/dist/doc/program_help/3dTqual.html
+    - The quality index of a timepoint is one minus the Spearman rank
+      correlation between its volume and the median volume (the voxelwise
+      median over time).
+    - Low values are good and indicate that the timepoint is not very
+      different from the norm.
+
+    :type func_data: NumPy array
+    :param func_data: The 4D functional timeseries data.
+    :type mask_data: NumPy array
+    :param mask_data: (default: None) A 3D binary mask of the voxels to
+                      include. If None, every voxel in the image is used, as
+                      with 3dTqual run without a mask.
+    :type clip_level: float
+    :param clip_level: (default: None) Exclude voxels whose median value is
+                       below this, as with 3dTqual's -clip option.
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 10000) How many voxels to calculate
+                             the median over time for at once, to bound the
+                             size of temporary arrays.
+    :rtype: list
+    :return: A list of the quality index values, one per timepoint.
+    """
+
+    import numpy as np
+    from scipy.stats import rankdata
+
+    ntpts = func_data.shape[-1]
+    func_2d = func_data.reshape(-1, ntpts)
+
+    if mask_data is None:
+        vox_idx = np.arange(func_2d.shape[0])
+    else:
+        vox_idx = np.flatnonzero(np.asarray(mask_data).ravel())
+
+    # the median volume
+    median_vol = np.empty(len(vox_idx))
+    for start in range(0, len(vox_idx), voxels_per_chunk):
+        chunk_idx = vox_idx[start:start + voxels_per_chunk]
+        median_vol[start:start + len(chunk_idx)] = \
+            np.median(func_2d[chunk_idx], axis=1)
+
+    if clip_level is not None:
+        keep = median_vol >= clip_level
+        vox_idx = vox_idx[keep]
+        median_vol = median_vol[keep]
+
+    # Spearman correlation is the Pearson correlation of the ranks; both
+    # rank vectors have the same mean, (n + 1) / 2
+    mean_rank = (len(vox_idx) + 1) / 2.0
+    median_ranks = rankdata(median_vol) - mean_rank
+    median_norm = np.sqrt(median_ranks.dot(median_ranks))
+
+    quality = []
+    for timepoint in range(0, ntpts):
+        ranks = rankdata(func_2d[vox_idx, timepoint]) - mean_rank
+        corr = ranks.dot(median_ranks) / \
+            (np.sqrt(ranks.dot(ranks)) * median_norm)
+        quality.append(1.0 - corr)
+
+    return quality
+
+
 def global_correlation(func_reorient, func_mask):
     """Calculate the global correlation (GCOR) of the functional timeseries.
 
@@ -265,35 +601,72 @@ def global_correlation(func_reorient, func_mask):
     :return: The global correlation (GCOR) value.
     """
 
-    import scipy
-    import numpy as np
     from dvars import load
 
     zero_variance_func = load(func_reorient, func_mask)
 
-    list_of_ts = zero_variance_func.transpose()
-
-    # get array of z-scored values of each voxel in each volume of the
-    # timeseries
-    demeaned_normed = []
-
-    for ts in list_of_ts:
-        demeaned_normed.append(scipy.stats.mstats.zscore(ts))
-
-    demeaned_normed = np.asarray(demeaned_normed)
-
-    # make an average of the normalized timeseries, into one averaged
-    # timeseries, a vector of N volumes
-    volume_list = demeaned_normed.transpose()
-
-    avg_ts = []
-
-    for voxel in volume_list:
-        avg_ts.append(voxel.mean())
+    return global_correlation_from_data(zero_variance_func)
+
+
+def global_correlation_from_data(zero_variance_func,
+                                 voxels_per_chunk=4096):
+    """Calculate the global correlation (GCOR) from an already-loaded masked
+    functional timeseries.
+
+    - GCOR is the squared length of the average of the voxels' z-scored
+      timeseries, divided by the number of timepoints. The average is
+      accumulated over chunks of voxels, so only one chunk is ever z-scored
+      at a time, and the data is never copied whole.
+    - The chunks are held in the compute precision (see
+      'qap_utils.set_compute_precision'), but the means, variances and the
+      average timeseries are always accumulated in float64.
+    - Voxels with zero variance, which the input should already exclude,
+      are left out of the average (z-scoring them with mstats, as before,
+      made the whole GCOR NaN). If no voxel has any variance, GCOR is
+      undefined, and NaN is returned.
+
+    :type zero_variance_func: NumPy array
+    :param zero_variance_func: The masked functional timeseries data with
+                               zero-variance voxels excluded, with shape
+                               (ntpts, nvoxs), such as the 'data' of a
+                               MaskedTimeseries.
+    :type voxels_per_chunk: int
+    :param voxels_per_chunk: (default: 4096) How many voxels to z-score at
+                             once, to bound the size of temporary arrays.
+    :rtype: float
+    :return: The global correlation (GCOR) value.
+    """
 
-    avg_ts = np.asarray(avg_ts)
+    import numpy as np
+    from qap.qap_utils import get_compute_dtype
+
+    dtype = get_compute_dtype()
+    ntpts, nvoxs = zero_variance_func.shape
+
+    sum_ts = np.zeros(ntpts)
+    num_voxels = 0
+
+    for start in range(0, nvoxs, voxels_per_chunk):
+        chunk = np.array(zero_variance_func[:, start:start +
+                                            voxels_per_chunk],
+                         dtype=dtype)
+        chunk -= chunk.mean(axis=0, dtype=np.float64).astype(dtype)
+        chunk_std = np.sqrt(np.einsum("ij,ij->j", chunk, chunk,
+                                      dtype=np.float64) / ntpts)
+        valid = chunk_std > 0
+        # sum the z-scored timeseries over the voxels
+        weights = np.zeros(chunk.shape[1])
+        weights[valid] = 1.0 / chunk_std[valid]
+        sum_ts += np.einsum("ij,j->i", chunk, weights, dtype=np.float64)
+        num_voxels += valid.sum()
+
+    if num_voxels == 0:
+        return np.nan
+
+    # the average of the normalized timeseries, a vector of N volumes
+    avg_ts = sum_ts / num_voxels
 
     # calculate the global correlation
-    gcor = (avg_ts.transpose().dot(avg_ts)) / len(avg_ts)
+    gcor = avg_ts.dot(avg_ts) / ntpts
 
     return gcor
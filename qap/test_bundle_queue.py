@@ -0,0 +1,106 @@
+import pytest
+
+
+@pytest.mark.quick
+def test_bundle_queue_claim_release(tmpdir):
+
+    import os
+    from qap.bundle_queue import BundleQueue
+
+    queue = BundleQueue(os.path.join(str(tmpdir), "bundle_queue.json"))
+    queue.initialize(3)
+    # initializing again keeps the current state
+    assert queue.claim("worker_1") == 1
+    queue.initialize(3)
+
+    assert queue.claim("worker_2") == 2
+    assert queue.heartbeat(1, "worker_1")
+    assert not queue.heartbeat(1, "worker_2")
+
+    queue.release(1, "worker_1")
+    queue.release(2, "worker_2", "failed")
+
+    assert queue.claim("worker_1") == 3
+    assert queue.claim("worker_2") is None
+
+    assert queue.status() == {1: "finished", 2: "failed", 3: "claimed"}
+
+
+@pytest.mark.quick
+def test_bundle_queue_stale_claims(tmpdir):
+
+    import os
+    import time
+    from qap.bundle_queue import BundleQueue
+
+    queue = BundleQueue(os.path.join(str(tmpdir), "bundle_queue.json"),
+                        stale_after=0.5, max_attempts=2)
+    queue.initialize(1)
+
+    assert queue.claim("worker_1") == 1
+    assert queue.claim("worker_2") is None
+
+    # worker_1 stops sending heartbeats
+    time.sleep(1)
+    assert queue.claim("worker_2") == 1
+    assert not queue.heartbeat(1, "worker_1")
+
+    # too many attempts
+    time.sleep(1)
+    assert queue.claim("worker_3") is None
+    assert queue.status() == {1: "failed"}
+
+
+@pytest.mark.quick
+def test_run_queue_workers_locally(tmpdir):
+
+    import os
+    import time
+    from qap import cli
+    from qap.bundle_queue import BundleQueue
+
+    def fake_run_one_bundle(bundle_idx):
+        time.sleep(0.1 * (bundle_idx % 3))
+        return {'status': 'finished', 'pid': os.getpid()}
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    cli_obj.run_one_bundle = fake_run_one_bundle
+    cli_obj._run_log_dir = str(tmpdir)
+    # idle workers wait for the others' bundles to finish
+    cli_obj.bundle_queue = lambda: BundleQueue(
+        os.path.join(str(tmpdir), "bundle_queue.json"), poll_interval=0.1)
+    cli_obj._bundles_list = [{}] * 7
+    cli_obj._num_bundles_at_once = 3
+
+    results = cli_obj.run_queue_workers_locally(7)
+
+    # every bundle ran exactly once, spread across the workers
+    assert [rt['bundle_idx'] for rt in results] == range(1, 8)
+    assert len(set([rt['pid'] for rt in results])) > 1
+    assert set(cli_obj.bundle_queue().status().values()) == set(["finished"])
+
+
+@pytest.mark.quick
+def test_queue_worker_reclaims_preempted_bundle(tmpdir):
+
+    import os
+    from qap import cli
+    from qap.bundle_queue import BundleQueue
+
+    queue = BundleQueue(os.path.join(str(tmpdir), "bundle_queue.json"),
+                        stale_after=0.5, poll_interval=0.1)
+    queue.initialize(2)
+    # a worker which was preempted while running bundle 1
+    assert queue.claim("preempted_worker") == 1
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    cli_obj.run_one_bundle = lambda bundle_idx: {'status': 'finished'}
+    cli_obj.bundle_queue = lambda: queue
+    cli_obj._bundles_list = [{}] * 2
+
+    # the last worker left waits for the stale claim instead of exiting
+    results = cli_obj.run_queue_worker()
+
+    assert sorted([rt['bundle_idx'] for rt in results]) == [1, 2]
+    assert queue.status() == {1: "finished", 2: "finished"}
+    assert queue.is_done()
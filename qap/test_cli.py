@@ -14,7 +14,7 @@ class TestValidateConfigDict(unittest.TestCase):
                                  "output_directory": "/path/to/output"}
         self.bad_config_dict = {"num_processors": 4,
                                 "output_directory": "/path/to/output",
-                                "num_bundles_at_once": 2}
+                                "num_participants_at_once": 2}
 
     def test_no_obsolete_keys(self):
         ret = self.validate_config_dict(self.good_config_dict)
@@ -585,3 +585,168 @@ def test_run_workflow_build_only():
 
     for node in terminal_nodes:
         assert node in node_names
+
+
+@pytest.mark.quick
+def test_run_bundles_locally():
+
+    import os
+    from qap import cli
+
+    def fake_run_one_bundle(bundle_idx):
+        if bundle_idx == 3:
+            # a bundle process that dies without reporting back
+            os._exit(1)
+        return {'status': 'finished', 'bundle_idx': bundle_idx,
+                'pid': os.getpid()}
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    cli_obj.run_one_bundle = fake_run_one_bundle
+    cli_obj._num_bundles_at_once = 2
+
+    results = cli_obj.run_bundles_locally(4)
+
+    assert [rt.get('bundle_idx') for rt in results] == [1, 2, None, 4]
+    assert results[2]['status'] == 'failed'
+    # each bundle ran in its own process
+    assert os.getpid() not in [rt.get('pid') for rt in results]
+
+
+@pytest.mark.quick
+def test_split_local_resources():
+
+    from qap import cli
+    from qap.resource_estimates import estimate_peak_node_memory
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    # typical scan sizes are used for scans which cannot be read
+    cli_obj._sub_dict = {("sub_1", "ses_1"): {"anat_1": {
+        "anatomical_scan": "/not/a/scan.nii.gz"}}}
+    node_memory = estimate_peak_node_memory(cli_obj._sub_dict.values())
+    assert node_memory > 0
+
+    def split(available_memory, num_bundles_at_once, num_bundles=10):
+        cli_obj._config = {"available_memory": available_memory,
+                           "num_processors": 8}
+        cli_obj.runargs = {"plugin_args": {}}
+        cli_obj._num_bundles_at_once = num_bundles_at_once
+        cli_obj.split_local_resources(num_bundles)
+        return cli_obj._num_bundles_at_once, \
+            cli_obj.runargs["plugin_args"]["n_procs"], \
+            cli_obj.runargs["plugin_args"]["memory_gb"]
+
+    # enough memory: split evenly, without truncating it
+    num_at_once, n_procs, memory_gb = split(10 * node_memory + 1, 4)
+    assert (num_at_once, n_procs) == (4, 2)
+    assert memory_gb == (10 * node_memory + 1) / 4.0
+
+    # too little for 4 bundles: fewer bundles, each with enough memory
+    num_at_once, n_procs, memory_gb = split(2.5 * node_memory, 4)
+    assert (num_at_once, n_procs) == (2, 4)
+    assert memory_gb >= node_memory
+
+    # too little for even one bundle: one bundle with the whole budget
+    num_at_once, n_procs, memory_gb = split(0.5 * node_memory, 4)
+    assert (num_at_once, n_procs, memory_gb) == (1, 8, 0.5 * node_memory)
+
+    # never more bundles at once than bundles
+    assert split(100 * node_memory, 4, num_bundles=3)[0] == 3
+
+
+@pytest.mark.quick
+def test_create_bundles_cost_packing(tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from qap import cli
+
+    # two long and two short functional runs, in two bundles - each bundle
+    # should get one of each
+    sub_dict = {}
+    for sub, num_tpts in [("sub_001", 1200), ("sub_002", 1200),
+                          ("sub_003", 150), ("sub_004", 150)]:
+        func_file = os.path.join(str(tmpdir), "%s_rest.nii.gz" % sub)
+        nb.save(nb.Nifti1Image(np.zeros((2, 2, 2, num_tpts),
+                                        dtype=np.int16), np.eye(4)),
+                func_file)
+        sub_dict[(sub, "session_01")] = {"rest_1": {"functional_scan":
+                                                    func_file},
+                                         "site_name": "site_01"}
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    cli_obj._config = {"num_sessions_at_once": 2, "num_processors": 1}
+    cli_obj._sub_dict = sub_dict
+
+    bundles = cli_obj.create_bundles()
+
+    assert len(bundles) == 2
+    for bundle in bundles:
+        assert len(bundle) == 2
+        assert sorted([sub_info[0] in ["sub_001", "sub_002"]
+                       for sub_info in bundle.keys()]) == [False, True]
+
+    # both bundles have the same predicted cost
+    assert len(cli_obj._bundle_costs) == 2
+    assert cli_obj._bundle_costs[0] == cli_obj._bundle_costs[1]
+
+
+@pytest.mark.quick
+def test_create_bundles_from_written_packing(tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from qap import cli
+
+    sub_dict = {}
+    for sub, num_tpts in [("sub_001", 1200), ("sub_002", 1200),
+                          ("sub_003", 150), ("sub_004", 150)]:
+        func_file = os.path.join(str(tmpdir), "%s_rest.nii.gz" % sub)
+        nb.save(nb.Nifti1Image(np.zeros((2, 2, 2, num_tpts),
+                                        dtype=np.int16), np.eye(4)),
+                func_file)
+        sub_dict[(sub, "session_01")] = {"rest_1": {"functional_scan":
+                                                    func_file}}
+
+    submitter = cli.QAProtocolCLI(parse_args=False)
+    submitter._config = {"num_sessions_at_once": 2, "num_processors": 1}
+    submitter._sub_dict = sub_dict
+    submitter._run_log_dir = str(tmpdir)
+    bundles = submitter.create_bundles()
+    submitter.write_bundle_packing()
+
+    # the headers can no longer be read, so re-packing would fall back to
+    # the default costs
+    for sub_info in sub_dict.keys():
+        os.remove(sub_dict[sub_info]["rest_1"]["functional_scan"])
+
+    task = cli.QAProtocolCLI(parse_args=False)
+    task._config = {"num_sessions_at_once": 2, "num_processors": 1}
+    task._sub_dict = sub_dict
+    task._run_log_dir = str(tmpdir)
+
+    assert task.create_bundles(task.read_bundle_packing()) == bundles
+    assert task._bundle_costs == submitter._bundle_costs
+
+
+@pytest.mark.quick
+def test_slurm_time_limit(tmpdir):
+
+    from qap import cli
+
+    cli_obj = cli.QAProtocolCLI(parse_args=False)
+    cli_obj._config = {"num_processors": 1}
+    cli_obj._bundle_costs = [(0.1, 1.0), (0.2, 1.0)]
+
+    # a floor under the rough prediction
+    assert cli_obj.task_time_limit_hours() == 4
+
+    cli_obj._bundle_costs = [(3.0, 1.0), (2.0, 1.0)]
+    assert cli_obj.task_time_limit_hours() == 7
+    # queue workers run the bundles one after another
+    cli_obj._config["bundle_queue"] = True
+    assert cli_obj.task_time_limit_hours() == 11
+
+    cli_obj._config["cluster_time_limit_hours"] = 2.5
+    assert cli_obj.task_time_limit_hours() == 3
@@ -0,0 +1,116 @@
+import pytest
+
+
+def add_one(in_value):
+    return in_value + 1
+
+
+def write_value(in_value):
+    import os
+    out_file = os.path.join(os.getcwd(), "value.txt")
+    with open(out_file, "w") as f:
+        f.write(str(in_value))
+    return out_file
+
+
+def fail(in_value):
+    raise ValueError("failing on purpose")
+
+
+def build_test_workflow(base_dir, out_dir, failing=False):
+
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.io as nio
+    import nipype.interfaces.utility as niu
+
+    workflow = pe.Workflow(name="test_direct_executor")
+    workflow.base_dir = base_dir
+
+    for name in ["_sub_001", "_sub_002"]:
+        first = pe.Node(niu.Function(input_names=["in_value"],
+                                     output_names=["out_value"],
+                                     function=add_one),
+                        name="first%s" % name)
+        first.inputs.in_value = 1
+
+        second = pe.Node(niu.Function(input_names=["in_value"],
+                                      output_names=["out_value"],
+                                      function=fail if failing else add_one),
+                         name="second%s" % name)
+        workflow.connect(first, "out_value", second, "in_value")
+
+        write = pe.Node(niu.Function(input_names=["in_value"],
+                                     output_names=["out_file"],
+                                     function=write_value),
+                        name="write%s" % name)
+        workflow.connect(second, "out_value", write, "in_value")
+
+        ds = pe.Node(nio.DataSink(), name="datasink%s" % name)
+        ds.inputs.base_directory = out_dir
+        workflow.connect(write, "out_file", ds, "value%s" % name)
+
+    return workflow
+
+
+@pytest.mark.quick
+@pytest.mark.parametrize("n_procs", [1, 2])
+def test_run_workflow_directly(tmpdir, n_procs):
+
+    import os
+    from qap.direct_executor import run_workflow_directly
+
+    out_dir = str(tmpdir.join("output"))
+    workflow = build_test_workflow(str(tmpdir.join("work")), out_dir)
+
+    outputs = run_workflow_directly(workflow, n_procs=n_procs)
+
+    assert outputs["second_sub_001"]["out_value"] == 3
+    # the same output layout as a Nipype run
+    for name in ["_sub_001", "_sub_002"]:
+        out_file = os.path.join(out_dir, "value%s" % name, "value.txt")
+        with open(out_file, "r") as f:
+            assert f.read() == "3"
+    # in Nipype's node working directories, without its results files
+    node_dir = os.path.join(str(tmpdir.join("work")), "test_direct_executor",
+                            "write_sub_001")
+    assert os.listdir(node_dir) == ["value.txt"]
+
+
+@pytest.mark.quick
+def test_run_workflow_directly_failure(tmpdir):
+
+    import os
+    from qap.direct_executor import run_workflow_directly
+
+    out_dir = str(tmpdir.join("output"))
+    workflow = build_test_workflow(str(tmpdir.join("work")), out_dir,
+                                   failing=True)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        run_workflow_directly(workflow, n_procs=2)
+
+    assert "failing on purpose" in str(excinfo.value)
+    assert "write_sub_001: an upstream node failed" in str(excinfo.value)
+    assert not os.path.exists(out_dir)
+
+
+@pytest.mark.quick
+def test_run_node_in_worker(tmpdir):
+
+    import nipype.interfaces.utility as niu
+    from qap.direct_executor import run_node_in_worker
+
+    interface = niu.Function(input_names=["in_value"],
+                             output_names=["out_value"], function=add_one)
+    interface.inputs.in_value = 1
+    outputs, error = run_node_in_worker(interface, str(tmpdir.join("ok")))
+    assert (outputs["out_value"], error) == (2, None)
+
+    # a failed node is reported back as its error message, instead of
+    # raising in the worker
+    interface = niu.Function(input_names=["in_value"],
+                             output_names=["out_value"], function=fail)
+    interface.inputs.in_value = 1
+    outputs, error = run_node_in_worker(interface, str(tmpdir.join("fail")))
+    assert outputs is None
+    assert "failing on purpose" in error
@@ -38,6 +38,35 @@ def test_remove_zero_variance_voxels():
     np.testing.assert_array_equal(ref_mask_data, out_mask_data)
 
 
+@pytest.mark.quick
+def test_remove_zero_variance_voxels_blocks():
+
+    import numpy as np
+
+    from qap.dvars import remove_zero_variance_voxels
+
+    np.random.seed(0)
+    func_data = np.random.randint(0, 100, (5, 4, 3, 20)).astype(np.float64)
+    # constant voxels, and one with a variance below 1
+    func_data[0, 0, 0, :] = 7
+    func_data[4, 3, 2, :] = 0
+    func_data[2, 1, 1, :] = 50 + np.tile([0, 1], 10) * 0.5
+    mask_data = np.ones((5, 4, 3))
+    mask_data[1, 1, 1] = 0
+
+    ref_mask_data = mask_data.copy()
+    for i in range(0, func_data.shape[0]):
+        for j in range(0, func_data.shape[1]):
+            for k in range(0, func_data.shape[2]):
+                if int(func_data[i][j][k].var()) == 0:
+                    ref_mask_data[i][j][k] = 0
+
+    for slices_per_block in [1, 2, 5, 10]:
+        out_mask_data = remove_zero_variance_voxels(func_data,
+            mask_data.copy(), slices_per_block=slices_per_block)
+        np.testing.assert_array_equal(ref_mask_data, out_mask_data)
+
+
 @pytest.mark.quick
 def test_load():
 
@@ -127,3 +156,204 @@ def test_ar1():
         
     np.testing.assert_array_almost_equal(ref_out_data, func_out_data)                           
                                     
+
+
+def write_synthetic_func(out_dir, shape=(6, 5, 4, 30), seed=0):
+    """Write a small random 4D timeseries and brain mask to NIFTI files."""
+
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(seed)
+    func_data = 100 + 10 * np.random.randn(*shape)
+    # a few zero-variance voxels inside the mask
+    func_data[2, 2, 2, :] = 0
+    func_data[3, 1, 2, :] = 50
+    mask_data = np.zeros(shape[:3], dtype=np.int16)
+    mask_data[1:-1, 1:-1, 1:-1] = 1
+
+    func_file = os.path.join(out_dir, "func.nii.gz")
+    mask_file = os.path.join(out_dir, "mask.nii.gz")
+    nb.Nifti1Image(func_data, np.eye(4)).to_filename(func_file)
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask_file)
+
+    return func_file, mask_file
+
+
+@pytest.mark.quick
+def test_masked_timeseries(tmpdir):
+
+    import numpy as np
+    import nibabel as nb
+
+    from qap.dvars import MaskedTimeseries, remove_zero_variance_voxels
+
+    func_file, mask_file = write_synthetic_func(str(tmpdir))
+
+    func_data = nb.load(func_file).get_data().astype(np.float)
+    mask_data = remove_zero_variance_voxels(func_data,
+                                            nb.load(mask_file).get_data())
+    ref_data = func_data[mask_data.nonzero()].T
+
+    func_ts = MaskedTimeseries(func_file, mask_file)
+
+    assert func_ts.data.shape == (30, 4 * 3 * 2 - 2)
+    np.testing.assert_array_equal(ref_data, func_ts.data)
+    np.testing.assert_array_equal(func_data, func_ts.func)
+
+
+@pytest.mark.quick
+def test_masked_timeseries_spill(tmpdir):
+
+    import os
+    import numpy as np
+
+    from qap.dvars import MaskedTimeseries, calc_dvars, calc_dvars_from_data
+
+    func_file, mask_file = write_synthetic_func(str(tmpdir))
+    spill_dir = tmpdir.mkdir("spill")
+
+    func_ts = MaskedTimeseries(func_file, mask_file, spill_dir=str(spill_dir))
+
+    assert isinstance(func_ts.data, np.memmap)
+    assert isinstance(func_ts.func, np.memmap)
+    assert len(os.listdir(str(spill_dir))) == 1
+
+    # streamed into the spill files chunk by chunk, with the same contents
+    in_memory = MaskedTimeseries(func_file, mask_file)
+    np.testing.assert_array_equal(func_ts.func, in_memory.func)
+    np.testing.assert_array_equal(func_ts.mask, in_memory.mask)
+    np.testing.assert_array_equal(func_ts.data, in_memory.data)
+
+    np.testing.assert_array_almost_equal(
+        calc_dvars(func_file, mask_file, output_all=True),
+        calc_dvars_from_data(func_ts.data, output_all=True))
+
+    func_ts.close()
+    assert len(os.listdir(str(spill_dir))) == 0
+
+
+@pytest.mark.quick
+def test_ar1_reference_backend():
+
+    import os
+    import pickle
+    import pkg_resources as p
+
+    import numpy as np
+
+    from qap.dvars import ar1, ar_nitime
+
+    func_data_file = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                         "loaded_func.p"))
+
+    with open(func_data_file, "r") as f:
+        func_data = pickle.load(f)
+
+    np.testing.assert_array_almost_equal(ar1(func_data, method=ar_nitime),
+                                         ar1(func_data), decimal=10)
+
+
+@pytest.mark.quick
+def test_ar_yule_walker():
+
+    import numpy as np
+
+    from qap.dvars import ar_nitime, ar_yule_walker
+
+    np.random.seed(0)
+    func_data = np.cumsum(np.random.randn(50, 23), axis=0)
+
+    for order in [1, 2, 3]:
+        for center in [False, True]:
+            ref_vals = np.apply_along_axis(ar_nitime, 0, func_data,
+                                           order=order, center=center)
+            ar_vals = ar_yule_walker(func_data, order=order, center=center,
+                                     voxels_per_chunk=7)
+            np.testing.assert_array_almost_equal(ref_vals, ar_vals,
+                                                 decimal=10)
+
+
+def calc_dvars_reference(func):
+    # the whole-array implementation the streaming DVARS replaced
+    import numpy as np
+    from qap.dvars import robust_stdev, ar1
+    func_sd = robust_stdev(func)
+    func_sd_pd = np.sqrt(2 * (1 - ar1(func))) * func_sd
+    func_deriv = np.diff(func, axis=0)
+    dvars_plain = func_deriv.std(1, ddof=1)
+    dvars_stdz = dvars_plain / func_sd_pd.mean()
+    dvars_vx_stdz = (func_deriv / func_sd_pd).std(1, ddof=1)
+    return np.vstack((dvars_stdz, dvars_plain, dvars_vx_stdz))
+
+
+@pytest.mark.quick
+def test_calc_dvars_streaming(tmpdir):
+
+    import numpy as np
+
+    from qap.dvars import MaskedTimeseries, calc_dvars, calc_dvars_from_data
+
+    func_file, mask_file = write_synthetic_func(str(tmpdir),
+                                                shape=(6, 5, 7, 40))
+    func_ts = MaskedTimeseries(func_file, mask_file)
+    ref_dvars = calc_dvars_reference(func_ts.data)
+
+    for voxels_per_chunk in [1, 7, 10000]:
+        np.testing.assert_allclose(
+            calc_dvars_from_data(func_ts.data, output_all=True,
+                                 voxels_per_chunk=voxels_per_chunk),
+            ref_dvars, rtol=1e-10)
+
+    for slices_per_block in [1, 2, 8]:
+        np.testing.assert_allclose(
+            calc_dvars(func_file, mask_file, output_all=True,
+                       slices_per_block=slices_per_block),
+            ref_dvars, rtol=1e-10)
+
+    dvars = calc_dvars(func_file, mask_file)
+    assert dvars.shape == (39, 1)
+    np.testing.assert_allclose(dvars[:, 0], ref_dvars[0], rtol=1e-10)
+
+
+@pytest.mark.quick
+def test_iter_image_blocks_gzipped(tmpdir, monkeypatch):
+
+    import os
+    import glob
+    import numpy as np
+
+    from qap import image_cache
+    from qap.dvars import iter_image_blocks
+
+    func_file, mask_file = write_synthetic_func(str(tmpdir),
+                                                shape=(6, 5, 7, 20))
+    work_dir = os.path.join(str(tmpdir), "work")
+    os.makedirs(work_dir)
+    monkeypatch.chdir(work_dir)
+
+    decompressed = []
+    decompress = image_cache.ImageCache._decompress
+
+    def counting_decompress(self, image_file, cached_file):
+        decompressed.append(image_file)
+        return decompress(self, image_file, cached_file)
+
+    monkeypatch.setattr(image_cache.ImageCache, "_decompress",
+                        counting_decompress)
+
+    # the gzipped timeseries is decompressed once, not for every slab
+    blocks = list(iter_image_blocks(func_file, mask_file,
+                                    slices_per_block=1))
+    assert len(blocks) == 5
+    assert sorted(decompressed) == sorted([func_file, mask_file])
+    assert os.listdir(work_dir) == []
+
+    # the temporary copies are removed if the blocks are not all read, too
+    blocks = iter_image_blocks(func_file, mask_file, slices_per_block=1)
+    first = next(blocks)
+    assert len(glob.glob(os.path.join(work_dir, "qap_blocks_*"))) == 1
+    blocks.close()
+    assert os.listdir(work_dir) == []
+    np.testing.assert_array_equal(first.shape, (20, 12))
@@ -0,0 +1,134 @@
+import pytest
+
+
+def write_test_image(filepath, shape, seed=0):
+    import numpy as np
+    import nibabel as nb
+    data = np.random.RandomState(seed).randint(0, 100, shape).astype(
+        np.int16)
+    nb.save(nb.Nifti1Image(data, np.eye(4)), filepath)
+    return data
+
+
+@pytest.mark.quick
+def test_image_cache_load(tmpdir):
+
+    import os
+    import numpy as np
+    from qap.image_cache import ImageCache
+
+    image_file = os.path.join(str(tmpdir), "image.nii.gz")
+    data = write_test_image(image_file, (6, 7, 8))
+
+    cache = ImageCache(os.path.join(str(tmpdir), "image_cache"))
+    cached_data = cache.load(image_file).get_data()
+
+    # decompressed once, and served as a read-only memory map
+    cached_file = cache.cached_path(image_file)
+    assert os.path.isfile(cached_file)
+    assert isinstance(cached_data, np.memmap)
+    assert not cached_data.flags.writeable
+    np.testing.assert_array_equal(cached_data, data)
+
+    os.utime(cached_file, (0, 0))
+    cache.load(image_file)
+    assert os.path.getmtime(cached_file) > 0
+    assert len([filename for filename in os.listdir(cache.cache_dir)
+                if filename.endswith(".nii")]) == 1
+
+    # a changed input gets a new copy
+    data = write_test_image(image_file, (6, 7, 8), seed=1)
+    os.utime(image_file, (1000, 1000))
+    np.testing.assert_array_equal(cache.load(image_file).get_data(), data)
+    assert cache.cached_path(image_file) != cached_file
+
+    # uncompressed images are mapped in place
+    nii_file = os.path.join(str(tmpdir), "image.nii")
+    write_test_image(nii_file, (6, 7, 8))
+    assert cache.cached_path(nii_file) == os.path.realpath(nii_file)
+
+
+@pytest.mark.quick
+def test_image_cache_evict(tmpdir):
+
+    import os
+    from qap.image_cache import ImageCache
+
+    image_files = []
+    for idx in range(3):
+        image_file = os.path.join(str(tmpdir), "image_%d.nii.gz" % idx)
+        write_test_image(image_file, (20, 20, 20), seed=idx)
+        image_files.append(image_file)
+
+    # room for two of the 16 KB copies
+    cache = ImageCache(os.path.join(str(tmpdir), "image_cache"),
+                       max_size_gb=40000 / 1024.0**3)
+
+    cache.load(image_files[0])
+    cache.load(image_files[1])
+    os.utime(cache.cached_path(image_files[0]), (0, 0))
+    cache.release(image_files[1])
+
+    # image_0 is the least recently used, but still referenced
+    cache.load(image_files[2])
+    assert os.path.isfile(cache.cached_path(image_files[0]))
+    assert not os.path.isfile(cache.cached_path(image_files[1]))
+    assert os.path.isfile(cache.cached_path(image_files[2]))
+
+    cache.release_all()
+    cache.load(image_files[1])
+    assert not os.path.isfile(cache.cached_path(image_files[0]))
+    assert cache.size() <= cache.max_size_gb
+
+
+def load_and_hold(cache_dir, image_file, loaded, done):
+    from qap.image_cache import ImageCache
+    cache = ImageCache(cache_dir, max_size_gb=0)
+    cache.load(image_file)
+    loaded.set()
+    done.wait()
+
+
+@pytest.mark.quick
+def test_image_cache_cross_process_leases(tmpdir):
+
+    import os
+    import multiprocessing
+    import numpy as np
+    from qap.image_cache import ImageCache
+
+    image_files = []
+    for idx in range(2):
+        image_file = os.path.join(str(tmpdir), "image_%d.nii.gz" % idx)
+        write_test_image(image_file, (20, 20, 20), seed=idx)
+        image_files.append(image_file)
+    cache_dir = os.path.join(str(tmpdir), "image_cache")
+
+    # another process holds image_0
+    loaded = multiprocessing.Event()
+    done = multiprocessing.Event()
+    proc = multiprocessing.Process(target=load_and_hold,
+                                   args=(cache_dir, image_files[0], loaded,
+                                         done))
+    proc.start()
+    loaded.wait()
+
+    # a zero-size cache evicts everything it can on every load
+    cache = ImageCache(cache_dir, max_size_gb=0)
+    cache.load(image_files[1])
+    cache.release(image_files[1])
+    cache.evict()
+    assert os.path.isfile(cache.cached_path(image_files[0]))
+    assert not os.path.isfile(cache.cached_path(image_files[1]))
+
+    # once the other process is gone, its lease no longer pins the copy
+    done.set()
+    proc.join()
+    cache.evict()
+    assert not os.path.isfile(cache.cached_path(image_files[0]))
+
+    # an evicted copy is decompressed again, and is not evicted from under
+    # the load, even over the size cap
+    data = write_test_image(image_files[0], (20, 20, 20))
+    np.testing.assert_array_equal(cache.load(image_files[0]).get_data(),
+                                  data)
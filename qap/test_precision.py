@@ -0,0 +1,164 @@
+
+import pytest
+
+
+@pytest.fixture
+def reset_precision():
+    from qap.qap_utils import set_compute_precision
+    yield
+    set_compute_precision("float64")
+
+
+def in_both_precisions(function, *args, **kwargs):
+    """Run a QAP measure function in float64 and in float32 mode, and return
+    both results."""
+
+    from qap.qap_utils import compute_precision
+
+    results = []
+    for precision in ["float64", "float32"]:
+        with compute_precision(precision):
+            results.append(function(*args, **kwargs))
+
+    return results
+
+
+def synthetic_func_data(shape=(8, 9, 7, 60), seed=0):
+    """A float32 timeseries with a large baseline, a shared signal and a
+    drift, as the precision-sensitive case."""
+
+    import numpy as np
+
+    np.random.seed(seed)
+    timepoints = np.linspace(0, 1, shape[-1])
+    func_data = 2000 + 20 * np.random.randn(*shape)
+    func_data += 5 * np.sin(40 * timepoints) + 30 * timepoints
+    func_data[0] = 0
+    mask_data = np.zeros(shape[:3], dtype=np.int16)
+    mask_data[1:-1, 1:-1, 1:-1] = 1
+
+    return func_data.astype(np.float32), mask_data
+
+
+@pytest.mark.quick
+def test_set_compute_precision(reset_precision, tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    from qap.qap_utils import set_compute_precision, get_compute_dtype
+    from qap.dvars import MaskedTimeseries
+
+    assert get_compute_dtype() == np.float64
+
+    with pytest.raises(Exception):
+        set_compute_precision("float16")
+
+    func_data, mask_data = synthetic_func_data()
+    func_file = os.path.join(str(tmpdir), "func.nii.gz")
+    mask_file = os.path.join(str(tmpdir), "mask.nii.gz")
+    nb.Nifti1Image(func_data, np.eye(4)).to_filename(func_file)
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask_file)
+
+    set_compute_precision("float32")
+    assert get_compute_dtype() == np.float32
+    func_ts = MaskedTimeseries(func_file, mask_file)
+    assert func_ts.data.dtype == np.float32
+
+    set_compute_precision("float64")
+    assert MaskedTimeseries(func_file, mask_file).data.dtype == np.float64
+
+
+@pytest.mark.quick
+def test_compute_precision_is_restored(reset_precision):
+
+    import numpy as np
+
+    from qap.qap_utils import compute_precision, get_compute_dtype
+
+    with compute_precision("float32"):
+        assert get_compute_dtype() == np.float32
+        with compute_precision("float64"):
+            assert get_compute_dtype() == np.float64
+        assert get_compute_dtype() == np.float32
+    assert get_compute_dtype() == np.float64
+
+    # a failing measure must not leave its precision behind for the next
+    # node run in the same process
+    with pytest.raises(ValueError):
+        with compute_precision("float32"):
+            raise ValueError("measure failed")
+    assert get_compute_dtype() == np.float64
+
+    with pytest.raises(Exception):
+        with compute_precision("float16"):
+            pass
+    assert get_compute_dtype() == np.float64
+
+
+@pytest.mark.quick
+def test_temporal_measures_precision_drift(reset_precision, tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    from qap.dvars import calc_dvars, calc_dvars_from_data
+    from qap.temporal_qc import outlier_timepoints_from_data, \
+        quality_timepoints_from_data, global_correlation_from_data
+
+    func_data, mask_data = synthetic_func_data()
+    masked = func_data[mask_data.nonzero()].T
+
+    dvars_64, dvars_32 = in_both_precisions(calc_dvars_from_data, masked,
+                                            output_all=True,
+                                            voxels_per_chunk=50)
+    np.testing.assert_allclose(dvars_32, dvars_64, rtol=1e-6)
+
+    func_file = os.path.join(str(tmpdir), "func.nii.gz")
+    mask_file = os.path.join(str(tmpdir), "mask.nii.gz")
+    nb.Nifti1Image(func_data, np.eye(4)).to_filename(func_file)
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask_file)
+    file_64, file_32 = in_both_precisions(calc_dvars, func_file, mask_file,
+                                          output_all=True)
+    np.testing.assert_allclose(file_64, dvars_64, rtol=1e-10)
+    np.testing.assert_allclose(file_32, dvars_64, rtol=1e-6)
+
+    gcor_64, gcor_32 = in_both_precisions(global_correlation_from_data,
+                                          masked, voxels_per_chunk=50)
+    np.testing.assert_allclose(gcor_32, gcor_64, rtol=1e-6)
+
+    for polort in [0, 2]:
+        out_64, out_32 = in_both_precisions(outlier_timepoints_from_data,
+                                            func_data, [mask_data],
+                                            polort=polort)
+        # at most one voxel may flip across the outlier threshold
+        np.testing.assert_allclose(out_32, out_64,
+                                   atol=1.0 / mask_data.sum() + 1e-12)
+
+    qual_64, qual_32 = in_both_precisions(quality_timepoints_from_data,
+                                          func_data, mask_data)
+    np.testing.assert_allclose(qual_32, qual_64, rtol=1e-6)
+
+
+@pytest.mark.quick
+def test_spatial_measures_precision_drift(reset_precision):
+
+    import numpy as np
+
+    from qap.spatial_qc import summary_mask, fber, efc, fwhm_from_data, \
+        ghost_direction
+
+    func_data, mask_data = synthetic_func_data(shape=(20, 24, 18, 1))
+    anat_data = func_data[..., 0]
+    bg_mask = 1 - mask_data
+
+    for function, args in [(summary_mask, (anat_data, mask_data)),
+                           (fber, (anat_data, mask_data, bg_mask)),
+                           (efc, (anat_data,)),
+                           (fwhm_from_data, (anat_data, mask_data,
+                                             [2.0, 2.0, 3.0])),
+                           (ghost_direction, (anat_data, mask_data, "y"))]:
+        val_64, val_32 = in_both_precisions(function, *args)
+        np.testing.assert_allclose(val_32, val_64, rtol=1e-6)
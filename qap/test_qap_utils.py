@@ -85,3 +85,57 @@ def test_create_anatomical_background_mask_failure():
         	anat_data)
 
     assert "must be a NumPy" in str(excinfo.value)
+
+
+@pytest.mark.quick
+def test_load_mask(tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from qap.qap_utils import load_mask
+
+    ref_file = os.path.join(str(tmpdir), "ref.nii.gz")
+    nb.save(nb.Nifti1Image(np.ones((4, 5, 6), dtype=np.float32),
+                           np.eye(4)), ref_file)
+
+    mask_data = np.zeros((4, 5, 6), dtype=np.float32)
+    mask_data[1:3, 1:4, 2:5] = 1
+    mask_file = os.path.join(str(tmpdir), "mask.nii.gz")
+    nb.save(nb.Nifti1Image(mask_data, np.eye(4)), mask_file)
+
+    mask = load_mask(mask_file, ref_file)
+
+    assert mask.dtype == np.uint8
+    np.testing.assert_array_equal(mask, mask_data)
+
+    # not binary
+    bad_file = os.path.join(str(tmpdir), "bad.nii.gz")
+    nb.save(nb.Nifti1Image(mask_data * 2, np.eye(4)), bad_file)
+    with pytest.raises(Exception):
+        load_mask(bad_file, ref_file)
+
+    # a different shape or space than the reference
+    nb.save(nb.Nifti1Image(mask_data[:3], np.eye(4)), bad_file)
+    with pytest.raises(Exception):
+        load_mask(bad_file, ref_file)
+    nb.save(nb.Nifti1Image(mask_data, 2 * np.eye(4)), bad_file)
+    with pytest.raises(Exception):
+        load_mask(bad_file, ref_file)
+
+
+@pytest.mark.quick
+def test_json_value():
+
+    import numpy as np
+    from qap.qap_utils import json_value
+
+    assert json_value(np.float32(0.5)) == 0.5
+    assert isinstance(json_value(np.float64(0.5)), float)
+    assert isinstance(json_value(np.array(16, dtype=np.int16)), int)
+    assert json_value(3L) == 3
+    assert json_value("descrip") == "descrip"
+    assert json_value(np.array([1.0, 2.0])) == str(np.array([1.0, 2.0]))
+    assert json_value(np.float32(np.nan)) is None
+    assert json_value(float("inf")) is None
+    assert json_value(-np.inf) is None
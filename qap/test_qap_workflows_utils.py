@@ -0,0 +1,75 @@
+
+import pytest
+
+
+def calculate_plane_coords_loop(coords_list, infile_dims):
+    """The voxel-by-voxel plane calculation the vectorized
+    'calculate_plane_coords' replaced, as the reference."""
+
+    import numpy as np
+
+    u = [int(a_pt - c_pt) for a_pt, c_pt in zip(coords_list[0],
+                                                 coords_list[2])]
+    v = [int(b_pt - c_pt) for b_pt, c_pt in zip(coords_list[1],
+                                                 coords_list[2])]
+    n = np.cross(u, v)
+    n = n / np.linalg.norm(n, 2)
+    constant = np.dot(n, np.asarray(coords_list[0]))
+
+    plane_dict = {}
+    for yvox in range(0, infile_dims[1]):
+        for xvox in range(0, infile_dims[0]):
+            zvox = (constant - (n[0] * xvox + n[1] * yvox)) / n[2]
+            zvox = np.floor(zvox)
+            if zvox < 1:
+                zvox = 1
+            elif zvox > infile_dims[2]:
+                zvox = infile_dims[2]
+            plane_dict[(xvox, yvox)] = zvox
+
+    return plane_dict
+
+
+def create_slice_mask_loop(plane_dict, infile_dims):
+    """The voxel-by-voxel mask construction the vectorized
+    'create_slice_mask' replaced, as the reference."""
+
+    import numpy as np
+
+    mask_array = np.zeros(infile_dims)
+    for x in range(0, infile_dims[0]):
+        for y in range(0, infile_dims[1]):
+            for z in range(0, infile_dims[2]):
+                if plane_dict[(x, y)] > z:
+                    mask_array[x, y, z] = 1
+
+    return mask_array
+
+
+@pytest.mark.quick
+def test_slice_mask_matches_loop():
+
+    import numpy as np
+
+    from qap.qap_workflows_utils import calculate_plane_coords, \
+        create_slice_mask
+
+    infile_dims = [23, 27, 19]
+    # a tilted plane through the volume, one which is flat in x, and one
+    # which leaves the volume above and below (so both clips are hit)
+    for coords_list in [[[11, 26, 9], [0, 0, 3], [22, 0, 2]],
+                        [[0, 20, 12], [22, 20, 12], [0, 0, 4]],
+                        [[0, 26, 40], [22, 26, 35], [11, 0, -20]]]:
+
+        plane_heights = calculate_plane_coords(coords_list, infile_dims)
+        plane_dict = calculate_plane_coords_loop(coords_list, infile_dims)
+
+        assert plane_heights.shape == tuple(infile_dims[:2])
+        for (xvox, yvox), zvox in plane_dict.items():
+            assert plane_heights[xvox, yvox] == zvox
+
+        mask_array = create_slice_mask(plane_heights, infile_dims)
+        ref_mask = create_slice_mask_loop(plane_dict, infile_dims)
+
+        assert mask_array.dtype == ref_mask.dtype
+        np.testing.assert_array_equal(mask_array, ref_mask)
@@ -0,0 +1,144 @@
+import pytest
+
+
+@pytest.mark.quick
+def test_pack_bundles():
+
+    from qap.resource_estimates import pack_bundles
+
+    costs = [(1.0, 1.0), (5.0, 2.0), (1.0, 1.0), (5.0, 2.0), (3.0, 1.0)]
+
+    bundles = pack_bundles(costs, 2)
+
+    # 8 and 7 hours
+    assert sorted(bundles) == [[0, 2, 3], [1, 4]]
+    # deterministic
+    assert pack_bundles(costs, 2) == bundles
+    # empty bundles are dropped
+    assert len(pack_bundles(costs[:1], 3)) == 1
+
+
+@pytest.mark.quick
+def test_match_node_model():
+
+    from qap.resource_estimates import match_node_model
+
+    assert match_node_model("anat_skullstrip_sub_001_ses_1_anat_1") == \
+        "anat_skullstrip"
+    assert match_node_model("anat_skullstrip_orig_vol_sub_001_ses_1_anat_1") \
+        == "anat_skullstrip_orig_vol"
+    assert match_node_model("qap_headmask_clip_level_sub_001_ses_1_anat_1") \
+        == "qap_headmask_clip_level"
+    assert match_node_model("qap_functional_temporal") == \
+        "qap_functional_temporal"
+    assert match_node_model(
+        "qap_functional_temporal_to_json_sub_001_ses_1_rest_1") is None
+    assert match_node_model("starter_node") is None
+
+
+@pytest.mark.quick
+def test_set_node_resources(tmpdir):
+
+    import os
+    import json
+    import numpy as np
+    import nibabel as nb
+
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.utility as niu
+
+    from qap.resource_estimates import set_node_resources
+
+    small_func = os.path.join(str(tmpdir), "small.nii.gz")
+    big_func = os.path.join(str(tmpdir), "big.nii.gz")
+    nb.save(nb.Nifti1Image(np.zeros((8, 8, 8, 10), dtype=np.int16),
+                           np.eye(4)), small_func)
+    nb.save(nb.Nifti1Image(np.zeros((8, 8, 8, 100), dtype=np.int16),
+                           np.eye(4)), big_func)
+
+    workflow = pe.Workflow(name="test_set_node_resources")
+    for name in ["_sub_001", "_sub_002"]:
+        for base in ["func_motion_correct", "qap_functional_temporal",
+                     "qap_functional_temporal_to_json"]:
+            node = pe.Node(niu.IdentityInterface(fields=["in_file"]),
+                           name="%s%s" % (base, name))
+            workflow.add_nodes([node])
+
+    participant_scans = {"_sub_001": {"functional_scan": small_func},
+                         "_sub_002": {"functional_scan": big_func}}
+    plugin_args = {"memory_gb": 4, "n_procs": 8}
+
+    resources = set_node_resources(workflow, participant_scans, plugin_args)
+
+    # scaled from the header size
+    assert resources["qap_functional_temporal_sub_002"][0] > \
+        resources["qap_functional_temporal_sub_001"][0]
+    assert resources["func_motion_correct_sub_001"][1] == 2
+    assert "qap_functional_temporal_to_json_sub_001" not in resources.keys()
+
+    # refined from (and capped by) past runs
+    callback_log = os.path.join(str(tmpdir), "callback.log")
+    with open(callback_log, "w") as f:
+        f.write(json.dumps({"name": "qap_functional_temporal_sub_003",
+                            "runtime_memory_gb": 1.0,
+                            "runtime_threads": 1}) + "\n")
+        f.write(json.dumps({"name": "func_motion_correct_sub_003",
+                            "runtime_memory_gb": 10.0,
+                            "runtime_threads": 3}) + "\n")
+        f.write(json.dumps({"name": "func_motion_correct_sub_004",
+                            "runtime_memory_gb": "N/A",
+                            "runtime_threads": "N/A"}) + "\n")
+
+    resources = set_node_resources(workflow, participant_scans, plugin_args,
+                                   callback_log)
+
+    assert resources["qap_functional_temporal_sub_001"][0] == \
+        pytest.approx(1.1)
+    assert resources["func_motion_correct_sub_001"] == (4, 3)
+
+    node = workflow.get_node("func_motion_correct_sub_001")
+    assert node.interface.estimated_memory_gb == 4
+    assert node.interface.num_threads == 3
+
+
+@pytest.mark.quick
+def test_set_node_resources_overlapping_suffixes(tmpdir):
+
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.utility as niu
+
+    from qap.resource_estimates import set_node_resources, \
+        estimate_node_resources
+
+    small_func = os.path.join(str(tmpdir), "small.nii.gz")
+    big_func = os.path.join(str(tmpdir), "big.nii.gz")
+    nb.save(nb.Nifti1Image(np.zeros((8, 8, 8, 10), dtype=np.int16),
+                           np.eye(4)), small_func)
+    nb.save(nb.Nifti1Image(np.zeros((8, 8, 8, 100), dtype=np.int16),
+                           np.eye(4)), big_func)
+
+    # participant "1"'s suffix is also the end of participant "sub_1"'s
+    participant_scans = {"_1_ses_1_rest_1": {"functional_scan": small_func},
+                         "_sub_1_ses_1_rest_1":
+                             {"functional_scan": big_func}}
+
+    workflow = pe.Workflow(name="test_overlapping_suffixes")
+    for name in participant_scans.keys():
+        for base in ["qap_functional_temporal", "plot_fd"]:
+            node = pe.Node(niu.IdentityInterface(fields=["in_file"]),
+                           name="%s%s" % (base, name))
+            workflow.add_nodes([node])
+
+    resources = set_node_resources(workflow, participant_scans, {})
+
+    for name, scans in participant_scans.items():
+        assert resources["qap_functional_temporal%s" % name] == \
+            estimate_node_resources("qap_functional_temporal",
+                                    scans["functional_scan"])
+    assert sorted(resources.keys()) == \
+        ["qap_functional_temporal_1_ses_1_rest_1",
+         "qap_functional_temporal_sub_1_ses_1_rest_1"]
@@ -0,0 +1,150 @@
+import pytest
+
+
+@pytest.mark.quick
+def test_result_cache_key(tmpdir):
+
+    import os
+    import shutil
+
+    from qap.result_cache import ResultCache
+
+    cache = ResultCache(str(tmpdir.join("cache")))
+
+    scan = str(tmpdir.join("anat.nii.gz"))
+    with open(scan, "wb") as f:
+        f.write("original scan")
+
+    config = {"exclude_zeros": False, "template_head_for_anat": "/t.nii.gz"}
+    key = cache.key({"anatomical_scan": scan, "site_name": "site_1"}, config)
+
+    # the same contents in a different place give the same key
+    moved_dir = str(tmpdir.join("moved"))
+    os.makedirs(moved_dir)
+    moved_scan = os.path.join(moved_dir, "anat.nii.gz")
+    shutil.copy(scan, moved_scan)
+    assert cache.key({"anatomical_scan": moved_scan, "site_name": "site_1"},
+                     config) == key
+
+    # a relevant config change gives a new key
+    config["exclude_zeros"] = True
+    assert cache.key({"anatomical_scan": scan}, config) != key
+    config["exclude_zeros"] = False
+
+    # replacing the input file gives a new key
+    with open(scan, "wb") as f:
+        f.write("replaced scan")
+    assert cache.key({"anatomical_scan": scan}, config) != key
+
+    # template files are keyed on their contents, not their path
+    template = str(tmpdir.join("template.nii.gz"))
+    with open(template, "wb") as f:
+        f.write("template")
+    config["template_head_for_anat"] = template
+    key = cache.key({"anatomical_scan": scan}, config)
+    moved_template = os.path.join(moved_dir, "template.nii.gz")
+    shutil.copy(template, moved_template)
+    config["template_head_for_anat"] = moved_template
+    assert cache.key({"anatomical_scan": scan}, config) == key
+    with open(moved_template, "wb") as f:
+        f.write("another template")
+    assert cache.key({"anatomical_scan": scan}, config) != key
+
+
+@pytest.mark.quick
+def test_result_cache_put_get(tmpdir):
+
+    import os
+    from qap.result_cache import ResultCache
+
+    cache = ResultCache(str(tmpdir.join("cache")))
+
+    assert cache.get("abc") is None
+
+    output_dir = str(tmpdir.join("output"))
+    os.makedirs(os.path.join(output_dir, "anatomical_reorient"))
+    with open(os.path.join(output_dir, "anatomical_reorient",
+                           "anat_reorient.nii.gz"), "wb") as f:
+        f.write("reoriented")
+
+    cache.put("abc", {"Participant": "sub_001",
+                      "anatomical_spatial": {"EFC": "0.5"}}, output_dir)
+    cache.put("abc", {"Participant": "sub_001",
+                      "anatomical_header_info": {"tr": "2.0"}})
+
+    cached = cache.get("abc")
+    assert cached["results"] == {"Participant": "sub_001",
+                                 "anatomical_spatial": {"EFC": "0.5"},
+                                 "anatomical_header_info": {"tr": "2.0"}}
+    assert os.path.basename(cached["outputs"]["anatomical_reorient"]) == \
+        "anat_reorient.nii.gz"
+
+
+@pytest.mark.quick
+def test_result_cache_evict(tmpdir):
+
+    import os
+    from qap.result_cache import ResultCache
+
+    cache = ResultCache(str(tmpdir.join("cache")), max_size_gb=1)
+
+    for idx, key in enumerate(["first", "second", "third"]):
+        cache.put(key, {"anatomical_spatial": {"EFC": "x" * 1000}})
+        os.utime(os.path.join(cache.cache_dir, key), (idx, idx))
+
+    # touching the oldest entry makes it the most recently used
+    cache.get("first")
+
+    entry_size = max([entry[1] for entry in cache.size()])
+    cache.max_size = 2 * entry_size
+
+    assert cache.evict() == ["second"]
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+
+
+@pytest.mark.quick
+def test_result_cache_size_index(tmpdir, monkeypatch):
+
+    import os
+    from qap.result_cache import ResultCache
+
+    cache = ResultCache(str(tmpdir.join("cache")), max_size_gb=1)
+
+    walked = []
+    walk_size = ResultCache._walk_size
+
+    def recording_walk_size(self, entry_dir):
+        walked.append(os.path.basename(entry_dir))
+        return walk_size(self, entry_dir)
+
+    monkeypatch.setattr(ResultCache, "_walk_size", recording_walk_size)
+
+    # storing an entry only walks that entry, while under the size limit
+    for idx in range(10):
+        cache.put("entry_%d" % idx, {"anatomical_spatial": {"EFC": idx}})
+    assert walked == ["entry_%d" % idx for idx in range(10)]
+
+    total_size = sum([entry[1] for entry in cache.size()])
+    assert cache._read_size(os.path.join(cache.cache_dir,
+                                         "cache_size")) == total_size
+
+    # updating an entry replaces its size in the total
+    cache.put("entry_0", {"anatomical_header_info": {"tr": "2.0"}})
+    total_size = sum([entry[1] for entry in cache.size()])
+    assert cache._read_size(os.path.join(cache.cache_dir,
+                                         "cache_size")) == total_size
+
+    # going over the limit evicts down to it
+    for idx in range(10):
+        os.utime(os.path.join(cache.cache_dir, "entry_%d" % idx),
+                 (idx, idx))
+    cache.max_size = total_size
+    cache.put("entry_10", {"anatomical_spatial": {"EFC": 10}})
+    assert cache.get("entry_0") is None
+    assert cache.get("entry_10") is not None
+    total_size = sum([entry[1] for entry in cache.size()])
+    assert total_size <= cache.max_size
+    assert cache._read_size(os.path.join(cache.cache_dir,
+                                         "cache_size")) == total_size
@@ -0,0 +1,82 @@
+import pytest
+
+
+def append_records(store_file, json_file, worker_idx, num_records):
+    from qap.results_store import ResultsStore
+    store = ResultsStore(store_file)
+    for record_idx in range(num_records):
+        store.append(json_file,
+                     {"sub_%d" % worker_idx:
+                      {"record_%d" % record_idx: record_idx}})
+
+
+@pytest.mark.quick
+def test_results_store_export_matches_write_json(tmpdir):
+
+    import os
+    from qap.qap_utils import write_json, read_json
+    from qap.results_store import ResultsStore
+
+    records = [{"sub_1 ses_1 rest_1": {"Participant": "sub_1",
+                                       "functional_header_info": {"a": 1}}},
+               {"sub_1 ses_1 rest_1": {"Participant": "sub_1",
+                                       "functional_spatial": {"EFC": 0.5}}},
+               {"sub_1 ses_1 rest_1": {"functional_spatial": {"EFC": 0.6}}}]
+
+    old_json = os.path.join(str(tmpdir), "old", "qap_functional.json")
+    os.makedirs(os.path.dirname(old_json))
+    for record in records:
+        write_json(record, old_json)
+
+    new_json = os.path.join(str(tmpdir), "new", "qap_functional.json")
+    store = ResultsStore(os.path.join(str(tmpdir), "qap_results.jsonl"))
+    for record in records:
+        store.append(new_json, record)
+
+    assert store.export() == [new_json]
+    assert read_json(new_json) == read_json(old_json)
+
+    # compaction keeps the results, in one record per JSON file
+    assert store.compact() == 1
+    assert store.read() == {new_json: read_json(old_json)}
+
+    # only the requested output directories are exported
+    store.append(os.path.join(str(tmpdir), "other", "qap_functional.json"),
+                 records[0])
+    assert store.export([os.path.dirname(new_json)]) == [new_json]
+
+    # a re-run starts from an empty log, and its stale records are not
+    # exported
+    previous_file = store.rotate()
+    assert previous_file == store.store_file + ".previous"
+    assert os.path.isfile(previous_file)
+    assert store.read() == {}
+    assert store.export() == []
+    assert store.rotate() is None
+
+
+@pytest.mark.quick
+def test_results_store_concurrent_writers(tmpdir):
+
+    import os
+    import multiprocessing
+    from qap.results_store import ResultsStore
+
+    store_file = os.path.join(str(tmpdir), "qap_results.jsonl")
+    json_file = os.path.join(str(tmpdir), "qap_functional.json")
+    store = ResultsStore(store_file)
+
+    writers = [multiprocessing.Process(target=append_records,
+                                       args=(store_file, json_file, idx, 50))
+               for idx in range(4)]
+    for writer in writers:
+        writer.start()
+    # compact while the writers are appending
+    for idx in range(5):
+        store.compact()
+    for writer in writers:
+        writer.join()
+
+    results = store.read()[json_file]
+    for idx in range(4):
+        assert len(results["sub_%d" % idx]) == 50
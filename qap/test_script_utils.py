@@ -311,3 +311,164 @@ def test_gather_custom_raw_data_scans_folder():
         anatomical_keywords, functional_keywords)
 
     assert ref_sub_dict == sub_dict
+
+
+def write_test_qap_json(output_dir, sub, efc, typed=False):
+    import os
+    import json
+    scan_dir = os.path.join(output_dir, sub, "session_1", "anat_1")
+    if not os.path.isdir(scan_dir):
+        os.makedirs(scan_dir)
+    id_string = "%s session_1 anat_1" % sub
+    with open(os.path.join(scan_dir, "qap_anatomical.json"), "w") as f:
+        json.dump({id_string: {"Participant": sub, "Session": "session_1",
+                               "Series": "anat_1",
+                               "anatomical_header_info": {"qform_code": "1"},
+                               "anatomical_spatial":
+                                   {"EFC": efc if typed else str(efc)}}}, f)
+
+
+def read_test_csv(csv_file):
+    import pandas as pd
+    df = pd.read_csv(csv_file, index_col=0, dtype=str)
+    df.sort_values(by=["Participant", "Session", "Series"], inplace=True)
+    return df.reset_index(drop=True)
+
+
+@pytest.mark.quick
+def test_update_json_csvs(tmpdir, monkeypatch):
+
+    import os
+    import pandas as pd
+    from qap import script_utils
+    from qap.script_utils import gather_json_info, json_to_csv, \
+        update_json_csvs
+
+    output_dir = os.path.join(str(tmpdir), "output")
+    full_dir = os.path.join(str(tmpdir), "full")
+    incr_dir = os.path.join(str(tmpdir), "incremental")
+    os.makedirs(full_dir)
+    os.makedirs(incr_dir)
+
+    for idx in range(5):
+        write_test_qap_json(output_dir, "sub_%d" % idx, 0.1 * idx)
+
+    csv_files = update_json_csvs(output_dir, incr_dir, num_threads=4)
+    assert csv_files == [os.path.join(incr_dir,
+                                      "qap_anatomical_spatial.csv")]
+
+    # change, add and remove participants
+    write_test_qap_json(output_dir, "sub_1", 0.9)
+    write_test_qap_json(output_dir, "sub_9", 0.3)
+    os.remove(os.path.join(output_dir, "sub_3", "session_1", "anat_1",
+                           "qap_anatomical.json"))
+    # make sure the changed file's size or mtime differs
+    os.utime(os.path.join(output_dir, "sub_1", "session_1", "anat_1",
+                          "qap_anatomical.json"), (1, 1))
+
+    read_files = []
+    read_json_files = script_utils.read_json_files
+
+    def recording_read_json_files(json_files, num_threads=8):
+        read_files.extend(json_files)
+        return read_json_files(json_files, num_threads)
+
+    monkeypatch.setattr(script_utils, "read_json_files",
+                        recording_read_json_files)
+    update_json_csvs(output_dir, incr_dir, num_threads=4)
+    monkeypatch.undo()
+
+    # only the changed and new JSON files are read again
+    assert sorted([f.split(os.sep)[-4] for f in read_files]) == \
+        ["sub_1", "sub_9"]
+
+    json_to_csv(gather_json_info(output_dir), full_dir)
+
+    incr_df = read_test_csv(csv_files[0])
+    full_df = read_test_csv(os.path.join(full_dir,
+                                         "qap_anatomical_spatial.csv"))
+    # the same columns, in the same order
+    pd.testing.assert_frame_equal(incr_df, full_df)
+    assert list(incr_df["Participant"]) == \
+        ["sub_0", "sub_1", "sub_2", "sub_4", "sub_9"]
+    assert incr_df["EFC"][1] == "0.9"
+
+
+@pytest.mark.quick
+def test_qap_table_types_and_columns(tmpdir):
+
+    import os
+    import numpy as np
+    from qap.script_utils import gather_json_info, json_to_csv, \
+        read_qap_table
+
+    output_dir = os.path.join(str(tmpdir), "output")
+    # string values from older JSON files, and typed ones
+    write_test_qap_json(output_dir, "0051", 0.5)
+    write_test_qap_json(output_dir, "0052", 0.25, typed=True)
+
+    json_to_csv(gather_json_info(output_dir), str(tmpdir))
+    csv_file = os.path.join(str(tmpdir), "qap_anatomical_spatial.csv")
+
+    df = read_qap_table(csv_file, ["Participant", "EFC", "qform_code",
+                                   "missing"])
+    assert list(df.columns) == ["EFC", "Participant", "qform_code"]
+    assert list(df["Participant"]) == ["0051", "0052"]
+    assert df["EFC"].dtype == np.float64
+    assert list(df["EFC"]) == [0.5, 0.25]
+    assert df["qform_code"].dtype == np.int64
+
+
+@pytest.mark.quick
+def test_qap_table_parquet(tmpdir):
+
+    pytest.importorskip("pyarrow")
+
+    import os
+    import numpy as np
+    import pandas as pd
+    from qap.script_utils import read_qap_table, update_json_csvs
+
+    output_dir = os.path.join(str(tmpdir), "output")
+    for idx in range(3):
+        write_test_qap_json(output_dir, "sub_%d" % idx, 0.1 * idx,
+                            typed=True)
+
+    csv_file = update_json_csvs(output_dir, str(tmpdir),
+                                write_parquet=True)[0]
+    parquet_file = os.path.join(str(tmpdir), "qap_anatomical_spatial.parquet")
+
+    columns = ["Participant", "Session", "Series", "EFC"]
+    csv_df = read_qap_table(csv_file, columns)
+    parquet_df = read_qap_table(parquet_file, columns + ["missing"])
+    assert list(parquet_df.columns) == list(csv_df.columns)
+    pd.testing.assert_frame_equal(parquet_df, csv_df)
+    assert parquet_df["EFC"].dtype == np.float64
+    assert list(parquet_df["Participant"]) == ["sub_0", "sub_1", "sub_2"]
+
+    # an update rewrites the Parquet file along with the CSV file
+    write_test_qap_json(output_dir, "sub_3", 0.7, typed=True)
+    update_json_csvs(output_dir, str(tmpdir), write_parquet=True)
+    parquet_df = read_qap_table(parquet_file, columns)
+    assert list(parquet_df["Participant"]) == \
+        ["sub_0", "sub_1", "sub_2", "sub_3"]
+    assert list(parquet_df["EFC"])[-1] == 0.7
+
+
+@pytest.mark.quick
+def test_qap_table_parquet_without_pyarrow(tmpdir, monkeypatch):
+
+    import os
+    import sys
+    import pandas as pd
+    from qap.script_utils import write_qap_table
+
+    # make the PyArrow import fail, whether or not it is installed
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+
+    csv_file = os.path.join(str(tmpdir), "qap_anatomical_spatial.csv")
+    with pytest.raises(Exception) as excinfo:
+        write_qap_table(pd.DataFrame({"EFC": [0.5]}), csv_file,
+                        write_parquet=True)
+    assert "pip install pyarrow" in str(excinfo.value)
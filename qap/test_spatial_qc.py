@@ -29,6 +29,86 @@ def test_summary_mask():
     assert int(summary_tuple[2]) == 157221
     
 
+@pytest.mark.quick
+def test_mask_sufficient_stats():
+
+    import os
+    import pkg_resources as p
+
+    import numpy.testing as nt
+
+    from qap.spatial_qc import summary_mask, mask_sufficient_stats, \
+        summary_from_stats
+    from qap.qap_utils import load_image, load_mask
+
+    anat_reorient = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                        "anat_reorient.nii.gz"))
+
+    mask_files = ["qap_head_mask.nii.gz", "skull_only_mask.nii.gz",
+                  "anatomical_gm_mask.nii.gz", "anatomical_wm_mask.nii.gz",
+                  "anatomical_csf_mask.nii.gz"]
+
+    anat_data = load_image(anat_reorient)
+    mask_list = [load_mask(p.resource_filename("qap", \
+                     os.path.join(test_sub_dir, mask_file)), anat_reorient)
+                 for mask_file in mask_files]
+    # overlapping, inverted mask
+    mask_list.append(1 - mask_list[0])
+
+    counts, sums, sums_sq, sq_devs = mask_sufficient_stats(anat_data,
+                                                           mask_list)
+
+    for idx, mask_data in enumerate(mask_list):
+        ref_mean, ref_std, ref_size = summary_mask(anat_data, mask_data)
+        mean, std, size = summary_from_stats(counts[idx], sums[idx],
+                                             sq_devs[idx])
+        assert size == ref_size
+        nt.assert_allclose(mean, ref_mean, rtol=1e-9)
+        nt.assert_allclose(std, ref_std, rtol=1e-6)
+
+
+@pytest.mark.quick
+def test_mask_sufficient_stats_high_baseline():
+
+    import numpy as np
+    import numpy.testing as nt
+
+    from qap.spatial_qc import summary_mask, mask_sufficient_stats, \
+        summary_from_stats
+
+    # a small spread on a high baseline, where the variance computed from
+    # the plain sums-of-squares cancels down to rounding noise
+    np.random.seed(0)
+    anat_data = 1e7 + np.random.rand(20, 18, 16)
+    fg_mask = np.zeros(anat_data.shape, dtype=np.int16)
+    fg_mask[2:-2, 3:-3, 1:-4] = 1
+    half_mask = np.zeros(anat_data.shape, dtype=np.int16)
+    half_mask[:10] = 1
+    one_voxel = np.zeros(anat_data.shape, dtype=np.int16)
+    one_voxel[5, 5, 5] = 1
+    mask_list = [fg_mask, 1 - fg_mask, half_mask, one_voxel,
+                 np.zeros(anat_data.shape, dtype=np.int16)]
+
+    counts, sums, sums_sq, sq_devs = mask_sufficient_stats(anat_data,
+                                                           mask_list)
+
+    for idx, mask_data in enumerate(mask_list[:3]):
+        ref_mean, ref_std, ref_size = summary_mask(anat_data, mask_data)
+        mean, std, size = summary_from_stats(counts[idx], sums[idx],
+                                             sq_devs[idx])
+        assert size == ref_size
+        nt.assert_allclose(mean, ref_mean, rtol=1e-12)
+        nt.assert_allclose(std, ref_std, rtol=1e-9)
+
+    # one voxel has no standard deviation, and an empty mask no mean either
+    mean, std, size = summary_from_stats(counts[3], sums[3], sq_devs[3])
+    assert (mean, size) == (anat_data[5, 5, 5], 1)
+    assert np.isnan(std)
+    mean, std, size = summary_from_stats(counts[4], sums[4], sq_devs[4])
+    assert size == 0
+    assert np.isnan(mean) and np.isnan(std)
+
+
 @pytest.mark.quick
 def test_check_datatype():
 
@@ -137,6 +217,40 @@ def test_fber():
     nt.assert_almost_equal(fber_out, 341.72165992685609, decimal=4)
 
 
+@pytest.mark.quick
+def test_fber_from_stats():
+
+    import os
+    import pkg_resources as p
+
+    import numpy.testing as nt
+
+    from qap.spatial_qc import mask_sufficient_stats, fber_from_stats
+    from qap.qap_utils import load_image, load_mask
+
+    anat_reorient = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                        "anat_reorient.nii.gz"))
+                                   
+    head_mask = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                    "qap_head_mask.nii.gz"))
+
+    skull_only_mask = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                          "skull_only_mask.nii.gz"))
+
+    anat_data = load_image(anat_reorient)
+    mask_data = load_mask(head_mask, anat_reorient)
+    bg_data = 1 - mask_data
+
+    head_data = load_mask(skull_only_mask, anat_reorient)
+
+    counts, sums, sums_sq, sq_devs = mask_sufficient_stats(
+        anat_data, [head_data, bg_data])
+    fber_out = fber_from_stats(sums_sq[0], counts[0], sums_sq[1], counts[1],
+                               anat_data.size)
+
+    nt.assert_almost_equal(fber_out, 341.72165992685609, decimal=4)
+
+
 @pytest.mark.quick
 def test_efc():
 
@@ -271,6 +385,71 @@ def test_fwhm_no_out_vox():
     nt.assert_almost_equal(fwhm_out[3], 11.991099999999999, decimal=4)
 
 
+@pytest.mark.quick
+def test_fwhm_from_data():
+
+    import os
+    import pkg_resources as p
+
+    import nibabel as nb
+    import numpy.testing as nt
+
+    from qap.spatial_qc import fwhm_from_data
+
+    anat_file = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                    "anat_reorient.nii.gz"))
+
+    mask_file = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                    "qap_head_mask.nii.gz"))
+
+    anat_img = nb.load(anat_file)
+    anat_data = anat_img.get_data()
+    mask_data = nb.load(mask_file).get_data()
+    voxel_sizes = anat_img.get_header().get_zooms()[:3]
+
+    # same values as 3dFWHMx in 'test_fwhm_no_out_vox'/'test_fwhm_out_vox'
+    fwhm_out = fwhm_from_data(anat_data, mask_data, voxel_sizes)
+
+    nt.assert_almost_equal(fwhm_out[0], 11.1622, decimal=4)
+    nt.assert_almost_equal(fwhm_out[1], 11.6973, decimal=4)
+    nt.assert_almost_equal(fwhm_out[2], 13.2051, decimal=4)
+    nt.assert_almost_equal(fwhm_out[3], 11.991099999999999, decimal=4)
+
+    fwhm_out = fwhm_from_data(anat_data, mask_data, voxel_sizes,
+                              out_vox=True)
+
+    nt.assert_almost_equal(fwhm_out[0], 3.7207333333333334, decimal=4)
+    nt.assert_almost_equal(fwhm_out[1], 3.8991000000000002, decimal=4)
+    nt.assert_almost_equal(fwhm_out[2], 4.4016999999999999, decimal=4)
+    nt.assert_almost_equal(fwhm_out[3], 3.997033333333333, decimal=4)
+
+
+@pytest.mark.quick
+def test_fwhm_from_data_smoothed_noise():
+
+    import numpy as np
+    from scipy.ndimage import gaussian_filter
+
+    from qap.spatial_qc import fwhm_from_data
+
+    # white noise smoothed with a Gaussian kernel has the FWHM of the kernel
+    sigma = 1.5
+    voxel_sizes = [2.0, 2.0, 3.0]
+    expected = np.sqrt(8 * np.log(2)) * sigma * np.asarray(voxel_sizes)
+
+    np.random.seed(0)
+    image_data = gaussian_filter(np.random.randn(64, 64, 64), sigma)
+    mask_data = np.zeros(image_data.shape, dtype=np.uint8)
+    mask_data[8:-8, 8:-8, 8:-8] = 1
+
+    for method in ["1dif", "acf"]:
+        fwhm_out = fwhm_from_data(image_data, mask_data, voxel_sizes,
+                                  method=method)
+        np.testing.assert_allclose(fwhm_out[:3], expected, rtol=0.1)
+        np.testing.assert_allclose(fwhm_out[3],
+                                   np.prod(expected) ** (1.0 / 3), rtol=0.1)
+
+
 @pytest.mark.quick
 def test_ghost_direction():
 
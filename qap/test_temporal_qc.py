@@ -18,6 +18,59 @@ def test_calculate_percent_outliers():
     assert out_tuple == (0.18518518518518517, 747.5)
 
 
+@pytest.mark.quick
+def test_summarize_vectors():
+
+    import numpy as np
+
+    from qap.temporal_qc import summarize_vectors
+
+    np.random.seed(4)
+    vectors = [np.random.randn(40), np.random.rand(39, 1),
+               list(np.random.rand(25) * 10)]
+
+    # a stack of vectors of different lengths
+    summary = summarize_vectors(vectors)
+    for idx, vector in enumerate(vectors):
+        vector = np.ravel(vector)
+        single = summarize_vectors(vector)
+        np.testing.assert_allclose(single["mean"], np.mean(vector))
+        np.testing.assert_allclose(single["std"], np.std(vector))
+        np.testing.assert_allclose(single["median"], np.median(vector))
+        for stat in summary.keys():
+            np.testing.assert_allclose(summary[stat][idx], single[stat])
+
+    # the example of test_calculate_percent_outliers
+    dataset = [1,1,2,3,27,34,45,49,54,55,67,294,345,352,356,593,632,675,763,\
+        764,825,866,2954,4634,4856,5934,29954]
+    single = summarize_vectors(dataset)
+    assert (single["percent_outliers"], single["IQR"]) == \
+        (0.18518518518518517, 747.5)
+
+    # many scans of the same length at once
+    batch = np.random.randn(6, 30)
+    batch[2, 4] = 50
+    summary = summarize_vectors(batch)
+    assert summary["mean"].shape == (6,)
+    assert summary["percent_outliers"][2] >= 1 / 30.0
+    np.testing.assert_allclose(summary["median"], np.median(batch, axis=1))
+
+    # a NaN of a vector's own is not mistaken for padding, nor dropped from
+    # a stack of vectors of the same length
+    vectors[1] = np.ravel(vectors[1])
+    vectors[1][5] = np.nan
+    batch[3, 7] = np.nan
+    for stack in [vectors, batch]:
+        summary = summarize_vectors(stack)
+        for idx, vector in enumerate(stack):
+            single = summarize_vectors(vector)
+            for stat in summary.keys():
+                np.testing.assert_allclose(summary[stat][idx], single[stat])
+    assert np.isnan(summarize_vectors(vectors)["mean"][1])
+    assert np.isnan(summarize_vectors(batch)["IQR"][3])
+    assert not np.isnan(summarize_vectors(vectors)["mean"][2])
+
+
 @pytest.mark.quick
 def test_fd_jenkinson():
 
@@ -40,6 +93,58 @@ def test_fd_jenkinson():
     np.testing.assert_array_equal(ref_meanfd_arr, meanfd)
     
 
+def fd_jenkinson_reference(affine_rows, rmax=80.):
+    # the per-timepoint loop of the original implementation
+    import math
+    import numpy as np
+    fd = [0]
+    for i in range(1, affine_rows.shape[0]):
+        T_rb = np.matrix(np.vstack([affine_rows[i].reshape(3, 4),
+                                    [0, 0, 0, 1]]))
+        T_rb_prev = np.matrix(np.vstack([affine_rows[i - 1].reshape(3, 4),
+                                         [0, 0, 0, 1]]))
+        M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
+        A = M[0:3, 0:3]
+        b = M[0:3, 3]
+        fd.append(math.sqrt((rmax * rmax / 5) * np.trace(np.dot(A.T, A)) +
+                            np.dot(b.T, b)))
+    return np.array(fd)
+
+
+@pytest.mark.quick
+def test_fd_jenkinson_in_memory(tmpdir, monkeypatch):
+
+    import os
+    import numpy as np
+    from scipy.linalg import expm
+
+    from qap.temporal_qc import fd_jenkinson
+
+    np.random.seed(3)
+    affines = np.zeros((20, 4, 4))
+    for idx in range(20):
+        rotation = np.random.randn(3, 3) * 0.01
+        affines[idx, :3, :3] = expm(rotation - rotation.T)
+        affines[idx, :3, 3] = np.random.randn(3) * 0.5
+        affines[idx, 3, 3] = 1
+    affine_rows = affines[:, :3, :].reshape(20, 12)
+
+    ref_fd = fd_jenkinson_reference(affine_rows)
+
+    monkeypatch.chdir(str(tmpdir))
+    for in_data in [affines, affines[:, :3, :], affine_rows]:
+        fd = fd_jenkinson(in_data, out_array=True)
+        np.testing.assert_allclose(fd, ref_fd, rtol=1e-10, atol=1e-12)
+    # nothing is written out without an out_file
+    assert os.listdir(str(tmpdir)) == []
+
+    in_file = os.path.join(str(tmpdir), "affines.aff12.1D")
+    np.savetxt(in_file, affine_rows, header="3dvolreg matrices")
+    out_file = fd_jenkinson(in_file)
+    np.testing.assert_allclose(np.loadtxt(out_file), ref_fd, rtol=1e-10,
+                               atol=1e-12)
+
+
 @pytest.mark.quick  
 def test_outlier_timepoints_no_mask():
 
@@ -89,6 +194,133 @@ def test_outlier_timepoints_with_mask():
     assert out_list == ref_list    
 
 
+def l1_fit_reference(basis, ts):
+    """Fit a timeseries by least absolute deviations, by brute force: an L1
+    fit passes through as many timepoints as there are basis functions, so
+    try the fit through every such set of timepoints."""
+
+    import itertools
+    import numpy as np
+
+    ntpts, nbasis = basis.shape
+    subsets = np.asarray(list(itertools.combinations(range(ntpts), nbasis)))
+    coefs = np.linalg.solve(basis[subsets], ts[subsets])
+    fits = coefs.dot(basis.T)
+    best = np.argmin(np.abs(ts - fits).sum(axis=1))
+
+    return fits[best]
+
+
+def outlier_count_reference(func_data, mask_data, polort=0, qthr=0.001):
+    """Count 3dToutcount-style outliers one voxel at a time."""
+
+    import numpy as np
+    from scipy.stats import norm
+
+    ntpts = func_data.shape[-1]
+    alpha = norm.isf(qthr / ntpts) * np.sqrt(np.pi / 2)
+    timepoints = np.linspace(-1, 1, ntpts)
+    basis = np.polynomial.legendre.legvander(timepoints, polort)
+
+    counts = np.zeros(ntpts)
+    for vox in zip(*np.nonzero(mask_data)):
+        ts = func_data[vox]
+        if polort > 0:
+            ts = ts - l1_fit_reference(basis, ts)
+        med = np.median(ts)
+        mad = np.median(np.abs(ts - med))
+        if mad > 0:
+            counts += (ts < med - alpha * mad) | (ts > med + alpha * mad)
+
+    return counts / mask_data.sum()
+
+
+@pytest.mark.quick
+def test_outlier_timepoints_from_data():
+
+    import numpy as np
+
+    from qap.temporal_qc import outlier_timepoints_from_data
+
+    np.random.seed(0)
+    func_data = 100 + np.random.randn(6, 5, 4, 40)
+    # linear drift, and a spike in the brain at timepoint 10
+    func_data += np.linspace(0, 5, 40)
+    func_data[1:3, 1:3, 1:3, 10] += 50
+    func_data[0, 0, 0, :] = 0
+
+    mask_data = np.zeros((6, 5, 4))
+    mask_data[1:-1, 1:-1, 1:-1] = 1
+    bg_mask_data = 1 - mask_data
+
+    for polort in [0, 2]:
+        outliers, oob_outliers = outlier_timepoints_from_data(func_data,
+            [mask_data, bg_mask_data], polort=polort, voxels_per_chunk=9)
+
+        np.testing.assert_array_almost_equal(outliers,
+            outlier_count_reference(func_data, mask_data, polort))
+        np.testing.assert_array_almost_equal(oob_outliers,
+            outlier_count_reference(func_data, bg_mask_data, polort))
+
+        assert np.argmax(outliers) == 10
+        assert outliers[10] >= 8.0 / mask_data.sum()
+
+
+@pytest.mark.quick
+def test_detrend_l1():
+
+    import numpy as np
+
+    from qap.temporal_qc import detrend_l1
+
+    np.random.seed(3)
+    ntpts = 60
+    timepoints = np.linspace(-1, 1, ntpts)
+    basis, _ = np.linalg.qr(np.polynomial.legendre.legvander(timepoints, 2))
+
+    # a trend with noise, and large spikes at the end of the run, which
+    # pull a least-squares fit towards them
+    chunk = 100 + 5 * timepoints + np.random.randn(7, ntpts)
+    chunk[:, -4:] += 80
+    chunk[3] = 40
+
+    residuals = detrend_l1(chunk, basis)
+
+    for row, ts in enumerate(chunk):
+        ref_residuals = ts - l1_fit_reference(basis, ts)
+        # the same, optimal, sum of absolute deviations
+        np.testing.assert_allclose(np.abs(residuals[row]).sum(),
+                                   np.abs(ref_residuals).sum(), rtol=1e-9)
+        np.testing.assert_allclose(residuals[row], ref_residuals,
+                                   atol=1e-6)
+
+    # the spikes stay in the residuals, instead of bending the trend
+    least_squares = chunk - chunk.dot(basis).dot(basis.T)
+    assert np.abs(np.median(residuals[0, :-4])) < \
+        np.abs(np.median(least_squares[0, :-4]))
+    assert residuals.dtype == chunk.dtype
+    assert detrend_l1(chunk.astype(np.float32), basis).dtype == np.float32
+
+
+@pytest.mark.quick
+def test_outlier_timepoints_from_data_no_mask():
+
+    import numpy as np
+
+    from qap.temporal_qc import outlier_timepoints_from_data
+
+    np.random.seed(1)
+    func_data = np.random.randn(4, 4, 4, 30)
+    func_data[0, 0, 0, 3] = 100
+
+    counts = outlier_timepoints_from_data(func_data, out_fraction=False)[0]
+
+    assert len(counts) == 30
+    assert counts[3] >= 1
+    np.testing.assert_array_almost_equal(counts,
+        outlier_count_reference(func_data, np.ones((4, 4, 4))) * 64)
+
+
 @pytest.mark.quick
 def test_quality_timepoints():
 
@@ -112,6 +344,78 @@ def test_quality_timepoints():
     assert out_list == ref_list
 
 
+@pytest.mark.quick
+def test_quality_timepoints_from_data():
+
+    import numpy as np
+    from scipy.stats import spearmanr
+
+    from qap.temporal_qc import quality_timepoints_from_data
+
+    np.random.seed(0)
+    base = 100 + 20 * np.random.rand(6, 5, 4, 1)
+    func_data = base + np.random.randn(6, 5, 4, 25)
+    # ties in the background, and one corrupted volume
+    func_data[0, :, :, :] = 0
+    func_data[..., 7] = np.random.rand(6, 5, 4)
+
+    mask_data = np.zeros((6, 5, 4))
+    mask_data[1:-1, 1:-1, 1:-1] = 1
+
+    median_vol = np.median(func_data, axis=3)
+
+    quality = quality_timepoints_from_data(func_data, voxels_per_chunk=11)
+    ref_quality = [1 - spearmanr(func_data[..., t].ravel(),
+                                 median_vol.ravel())[0] for t in range(25)]
+    np.testing.assert_array_almost_equal(ref_quality, quality)
+    assert np.argmax(quality) == 7
+
+    quality = quality_timepoints_from_data(func_data, mask_data=mask_data)
+    ref_quality = [1 - spearmanr(func_data[..., t][mask_data == 1],
+                                 median_vol[mask_data == 1])[0]
+                   for t in range(25)]
+    np.testing.assert_array_almost_equal(ref_quality, quality)
+
+    quality = quality_timepoints_from_data(func_data, clip_level=1)
+    ref_quality = [1 - spearmanr(func_data[..., t][median_vol >= 1],
+                                 median_vol[median_vol >= 1])[0]
+                   for t in range(25)]
+    np.testing.assert_array_almost_equal(ref_quality, quality)
+
+
+@pytest.mark.quick
+def test_quality_timepoints_from_data_matches_afni():
+
+    import os
+    import pickle
+    import pkg_resources as p
+
+    import numpy as np
+    import nibabel as nb
+
+    from qap.temporal_qc import quality_timepoints_from_data
+
+    func_reorient = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                        "func_reorient.nii.gz"))
+
+    ref_out = p.resource_filename("qap", os.path.join(test_sub_dir, \
+                                  "quality_timepoints_output.p"))
+
+    # the 3dTqual reference run is not shipped with every checkout; the
+    # synthetic check above covers the implementation without it
+    for test_file in [func_reorient, ref_out]:
+        if not os.path.isfile(test_file):
+            pytest.skip("AFNI reference data not found: %s" % test_file)
+
+    func_data = nb.load(func_reorient).get_data().astype(np.float)
+    out_list = quality_timepoints_from_data(func_data)
+
+    with open(ref_out, "r") as f:
+        ref_list = pickle.load(f)
+
+    np.testing.assert_allclose(out_list, ref_list, atol=1e-4)
+
+
 @pytest.mark.quick
 def test_global_correlation():
 
@@ -131,3 +435,35 @@ def test_global_correlation():
     gcor = global_correlation(func_reorient, func_mask)
 
     nt.assert_almost_equal(gcor, 0.13903011798720202, decimal=4)
+
+
+@pytest.mark.quick
+def test_global_correlation_from_data():
+
+    import numpy as np
+    import scipy.stats
+
+    from qap.temporal_qc import global_correlation_from_data
+
+    np.random.seed(2)
+    func_data = 100 + np.random.randn(50, 37).astype(np.float32)
+    # a shared signal, and one constant voxel
+    func_data += np.sin(np.linspace(0, 10, 50))[:, np.newaxis].astype(
+        np.float32)
+    func_data[:, 5] = 100
+
+    # the reference: z-score each voxel with mstats, then average the
+    # voxels with any variance (mstats makes the constant voxel NaN)
+    ref_ts = np.asarray([scipy.stats.mstats.zscore(ts)
+                         for ts in func_data.T.astype(np.float64)])
+    assert np.isnan(ref_ts[5]).all()
+    avg_ts = np.ma.masked_invalid(ref_ts).mean(axis=0)
+    ref_gcor = avg_ts.dot(avg_ts) / len(avg_ts)
+
+    for voxels_per_chunk in [1, 8, 4096]:
+        gcor = global_correlation_from_data(func_data, voxels_per_chunk)
+        np.testing.assert_allclose(gcor, ref_gcor, rtol=1e-10)
+
+    # no voxel with any variance
+    assert np.isnan(global_correlation_from_data(func_data[:, 5:6]))
+    assert np.isnan(global_correlation_from_data(np.zeros((50, 0))))
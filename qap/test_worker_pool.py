@@ -0,0 +1,68 @@
+import pytest
+
+
+def imported_modules(modules):
+    import os
+    import sys
+    return os.getpid(), [module in sys.modules.keys() for module in modules]
+
+
+@pytest.mark.quick
+def test_get_warm_pool():
+
+    from qap.worker_pool import WARM_MODULES, get_warm_pool, \
+        close_warm_pools
+
+    pool = get_warm_pool(2)
+    assert get_warm_pool(2) is pool
+
+    pid, loaded = pool.apply(imported_modules, (WARM_MODULES,))
+    assert all(loaded)
+
+    close_warm_pools()
+    assert get_warm_pool(2) is not pool
+    close_warm_pools()
+
+
+@pytest.mark.quick
+def test_warm_multiproc_plugin():
+
+    import multiprocessing
+    from qap.worker_pool import WarmMultiProcPlugin, get_warm_pool, \
+        close_warm_pools
+
+    plugin = WarmMultiProcPlugin(plugin_args={"n_procs": 2, "memory_gb": 3})
+
+    assert plugin.processors == 2
+    assert plugin.memory_gb == 3
+    assert plugin.pool is get_warm_pool(2)
+
+    # the pool outlives the workflow run, and the pool MultiProc starts for
+    # each plugin is shut down
+    plugin._close()
+    workers = len(multiprocessing.active_children())
+    assert WarmMultiProcPlugin(plugin_args={"n_procs": 2}).pool is \
+        plugin.pool
+    assert len(multiprocessing.active_children()) == workers
+    close_warm_pools()
+
+
+@pytest.mark.quick
+def test_run_workflow_directly_warm_pool(tmpdir):
+
+    from qap.direct_executor import run_workflow_directly
+    from qap.test_direct_executor import build_test_workflow
+    from qap.worker_pool import get_warm_pool, close_warm_pools
+
+    worker_pids = []
+    for run in ["run_1", "run_2"]:
+        out_dir = str(tmpdir.join(run, "output"))
+        workflow = build_test_workflow(str(tmpdir.join(run, "work")),
+                                       out_dir)
+        outputs = run_workflow_directly(workflow, n_procs=2, warm_pool=True)
+        assert outputs["second_sub_002"]["out_value"] == 3
+        worker_pids.append(sorted([p.pid for p in get_warm_pool(2)._pool]))
+
+    # the same workers ran both workflows
+    assert worker_pids[0] == worker_pids[1]
+    close_warm_pools()
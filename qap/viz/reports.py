@@ -17,6 +17,43 @@ from matplotlib.backends.backend_pdf import PdfPages
 
 from .plotting import (plot_measures, plot_mosaic, plot_all,
                        plot_fd, plot_dist)
+from ..script_utils import read_qap_table
+
+
+# The QAP measures plotted in the reports, in groups sharing a plot
+MEASURE_GROUPS = {
+    'anatomical_spatial': [['CNR'],
+                           ['Cortical Contrast'],
+                           ['EFC'],
+                           ['FBER'],
+                           ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
+                           ['Qi1'],
+                           ['SNR']],
+    'functional_temporal': [['Fraction of Outliers (Mean)',
+                             'Fraction of Outliers (Median)',
+                             'Fraction of Outliers (Std Dev)',
+                             'Fraction of Outliers IQR'],
+                            ['GCOR'],
+                            ['Quality (Mean)', 'Quality (Median)',
+                             'Quality (Std Dev)', 'Quality IQR',
+                             'Quality percent outliers'],
+                            ['RMSD (Mean)', 'RMSD (Median)',
+                             'RMSD (Std Dev)', 'RMSD IQR'],
+                            ['Std. DVARS (Mean)', 'Std. DVARS (Median)',
+                             'Std. DVARS percent outliers',
+                             'Std. DVARs IQR']],
+    'functional_spatial': [['EFC'],
+                           ['FBER'],
+                           ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
+                           ['Ghost_%s' % a for a in ['x', 'y', 'z']],
+                           ['SNR']]
+}
+
+
+def _measure_groups(qap_type):
+    """Get a copy of the measure groups of a QAP type (the report writers
+    drop the measures missing from their table from the groups)."""
+    return [list(group) for group in MEASURE_GROUPS[qap_type]]
 
 
 def workflow_report(in_csv, qap_type, run_name, out_dir=None, out_file=None,
@@ -50,9 +87,12 @@ def workflow_report(in_csv, qap_type, run_name, out_dir=None, out_file=None,
         out_file = op.join(
             out_dir, qap_type + '_%s.pdf')
 
-    # Read csv file, sort and drop duplicates
-    df = pd.read_csv(in_csv, dtype={'Participant': str}).sort(
-        columns=['Participant', 'Session', 'Series'])
+    # Read the columns the report plots, sort and drop duplicates
+    columns = ['Participant', 'Session', 'Series']
+    for group in _measure_groups(qap_type.replace('qap_', '', 1)):
+        columns.extend(group)
+    df = read_qap_table(in_csv, columns).sort_values(
+        by=['Participant', 'Session', 'Series'])
 
     try:
         df.drop_duplicates(['Participant', 'Session', 'Series'], keep='last',
@@ -312,13 +352,7 @@ def _write_all_reports(df, groups, sc_split=False, condensed=True,
 
 def all_anatomical(df, sc_split=False, condensed=True,
                    out_file='anatomical.pdf'):
-    groups = [['CNR'],
-              ['Cortical Contrast'],
-              ['EFC'],
-              ['FBER'],
-              ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
-              ['Qi1'],
-              ['SNR']]
+    groups = _measure_groups('anatomical_spatial')
     return _write_all_reports(
         df, groups, sc_split=sc_split,
         condensed=condensed, out_file=out_file)
@@ -326,14 +360,7 @@ def all_anatomical(df, sc_split=False, condensed=True,
 
 def all_func_temporal(df, sc_split=False, condensed=True,
                       out_file='func_temporal.pdf'):
-    groups = [['Fraction of Outliers (Mean)', 'Fraction of Outliers (Median)',
-               'Fraction of Outliers (Std Dev)', 'Fraction of Outliers IQR'],
-              ['GCOR'],
-              ['Quality (Mean)', 'Quality (Median)', 'Quality (Std Dev)',
-               'Quality IQR', 'Quality percent outliers'],
-              ['RMSD (Mean)', 'RMSD (Median)', 'RMSD (Std Dev)', 'RMSD IQR'],
-              ['Std. DVARS (Mean)', 'Std. DVARS (Median)',
-               'Std. DVARS percent outliers', 'Std. DVARs IQR']]
+    groups = _measure_groups('functional_temporal')
     return _write_all_reports(
         df, groups, sc_split=sc_split,
         condensed=condensed, out_file=out_file)
@@ -341,11 +368,7 @@ def all_func_temporal(df, sc_split=False, condensed=True,
 
 def all_func_spatial(df, sc_split=False, condensed=False,
                      out_file='func_spatial.pdf'):
-    groups = [['EFC'],
-              ['FBER'],
-              ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
-              ['Ghost_%s' % a for a in ['x', 'y', 'z']],
-              ['SNR']]
+    groups = _measure_groups('functional_spatial')
     return _write_all_reports(
         df, groups, sc_split=sc_split,
         condensed=condensed, out_file=out_file)
@@ -354,13 +377,7 @@ def all_func_spatial(df, sc_split=False, condensed=False,
 def qap_anatomical_spatial(
         df, subject=None, sc_split=False, condensed=True,
         out_file='anatomical.pdf'):
-    groups = [['CNR'],
-              ['Cortical Contrast'],
-              ['EFC'],
-              ['FBER'],
-              ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
-              ['Qi1'],
-              ['SNR']]
+    groups = _measure_groups('anatomical_spatial')
     return _write_report(
         df, groups, sub_id=subject, sc_split=sc_split, condensed=condensed,
         out_file=out_file)
@@ -369,14 +386,7 @@ def qap_anatomical_spatial(
 def qap_functional_temporal(
         df, subject=None, sc_split=False, condensed=True,
         out_file='func_temporal.pdf'):
-    groups = [['Fraction of Outliers (Mean)', 'Fraction of Outliers (Median)',
-               'Fraction of Outliers (Std Dev)', 'Fraction of Outliers IQR'],
-              ['GCOR'],
-              ['Quality (Mean)', 'Quality (Median)', 'Quality (Std Dev)',
-               'Quality IQR', 'Quality percent outliers'],
-              ['RMSD (Mean)', 'RMSD (Median)', 'RMSD (Std Dev)', 'RMSD IQR'],
-              ['Std. DVARS (Mean)', 'Std. DVARS (Median)',
-               'Std. DVARS percent outliers', 'Std. DVARs IQR']]
+    groups = _measure_groups('functional_temporal')
     return _write_report(
         df, groups, sub_id=subject, sc_split=sc_split, condensed=condensed,
         out_file=out_file)
@@ -385,11 +395,7 @@ def qap_functional_temporal(
 def qap_functional_spatial(
         df, subject=None, sc_split=False, condensed=True,
         out_file='func_spatial.pdf'):
-    groups = [['EFC'],
-              ['FBER'],
-              ['FWHM', 'FWHM_x', 'FWHM_y', 'FWHM_z'],
-              ['Ghost_%s' % a for a in ['x', 'y', 'z']],
-              ['SNR']]
+    groups = _measure_groups('functional_spatial')
     return _write_report(
         df, groups, sub_id=subject, sc_split=sc_split, condensed=condensed,
         out_file=out_file)
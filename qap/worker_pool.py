@@ -0,0 +1,110 @@
+import os
+import atexit
+
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin, NonDaemonPool
+
+
+# the modules the Function nodes' bodies import - loaded once per worker
+WARM_MODULES = ["numpy",
+                "scipy",
+                "scipy.ndimage",
+                "scipy.stats",
+                "nibabel",
+                "nipype.interfaces.utility",
+                "qap.qap_utils",
+                "qap.spatial_qc",
+                "qap.temporal_qc",
+                "qap.dvars",
+                "qap.script_utils",
+                "qap.qap_workflows_utils"]
+
+# the warm pools of the current process, by process ID and size
+_warm_pools = {}
+
+
+def warm_up_worker(modules=None):
+    """Import the modules used by the Function nodes, so that the node bodies
+    run by this worker do not pay for the imports.
+
+    :type modules: list
+    :param modules: (default: WARM_MODULES) The names of the modules to
+                    import.
+    """
+
+    import importlib
+
+    if modules is None:
+        modules = WARM_MODULES
+
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # the node importing it will report the problem
+            pass
+
+
+def get_warm_pool(n_procs):
+    """Get this process's pool of pre-imported worker processes, starting it
+    on first use.
+
+    - The pool is kept for the life of the process, so it is shared by every
+      workflow (participant and bundle) the process runs.
+    - The workers are non-daemonic, like Nipype's MultiProc workers, so that
+      the nodes can start processes of their own.
+    - A process forked from one holding a pool (a bundle run in its own
+      process) starts its own pool instead of using its parent's.
+
+    :type n_procs: int
+    :param n_procs: The number of worker processes.
+    :rtype: multiprocessing.pool.Pool
+    :return: The warm worker pool.
+    """
+
+    key = (os.getpid(), n_procs)
+    if key not in _warm_pools.keys():
+        _warm_pools[key] = NonDaemonPool(processes=n_procs,
+                                         initializer=warm_up_worker)
+    return _warm_pools[key]
+
+
+def close_warm_pools():
+    """Shut down this process's warm worker pools."""
+
+    for key in _warm_pools.keys():
+        pool = _warm_pools.pop(key)
+        if key[0] == os.getpid():
+            pool.close()
+            pool.join()
+
+
+atexit.register(close_warm_pools)
+
+
+class WarmMultiProcPlugin(MultiProcPlugin):
+    """Nipype's MultiProc plugin, running the nodes on the process's warm
+    worker pool instead of on a new pool for every workflow run.
+
+    - The same plugin_args as MultiProc are accepted. The plugin is set up
+      by MultiProc itself, and the pool it starts is then closed and
+      swapped for the warm one. Nipype releases which do not run the nodes
+      on a multiprocessing pool keep their own pool.
+    """
+
+    def __init__(self, plugin_args=None):
+
+        super(WarmMultiProcPlugin, self).__init__(plugin_args=plugin_args)
+
+        from multiprocessing.pool import Pool
+
+        self._warm = isinstance(getattr(self, "pool", None), Pool)
+        if self._warm:
+            self.pool.close()
+            self.pool.join()
+            self.pool = get_warm_pool(self.processors)
+
+    def _close(self):
+        if self._warm:
+            # the pool is kept for the next workflow
+            return True
+        return super(WarmMultiProcPlugin, self)._close()
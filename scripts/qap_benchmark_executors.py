@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+
+def add_one(in_value):
+    return in_value + 1
+
+
+def build_synthetic_workflow(base_dir, num_chains, chain_length):
+
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.utility as niu
+
+    workflow = pe.Workflow(name="benchmark_executors")
+    workflow.base_dir = base_dir
+
+    for chain in range(num_chains):
+        previous = None
+        for step in range(chain_length):
+            node = pe.Node(niu.Function(input_names=["in_value"],
+                                        output_names=["out_value"],
+                                        function=add_one),
+                           name="step_%d_chain_%d" % (step, chain))
+            if previous is None:
+                node.inputs.in_value = 0
+            else:
+                workflow.connect(previous, "out_value", node, "in_value")
+            previous = node
+
+    return workflow
+
+
+def time_synthetic_run(engine, work_dir, num_chains, chain_length, n_procs):
+
+    import os
+    import shutil
+    import time
+    from qap.direct_executor import run_workflow_directly
+
+    base_dir = os.path.join(work_dir, engine)
+    if os.path.isdir(base_dir):
+        shutil.rmtree(base_dir)
+
+    workflow = build_synthetic_workflow(base_dir, num_chains, chain_length)
+
+    start = time.time()
+    if engine == "direct":
+        run_workflow_directly(workflow, n_procs=n_procs)
+    elif n_procs > 1:
+        workflow.run(plugin="MultiProc", plugin_args={"n_procs": n_procs})
+    else:
+        workflow.run(plugin="Linear")
+
+    return time.time() - start
+
+
+def time_pipeline_run(engine, work_dir, pipeline_config, data_config):
+
+    import os
+    import shutil
+    import time
+    import yaml
+    from qap.cli import QAProtocolCLI
+    from qap.script_utils import read_yml_file
+
+    config = read_yml_file(pipeline_config)
+    config["execution_engine"] = engine
+    config["pipeline_name"] = "benchmark_%s" % engine
+    config["output_directory"] = os.path.join(work_dir, engine, "output")
+    config["working_directory"] = os.path.join(work_dir, engine, "working")
+    config["write_report"] = False
+    config.pop("result_cache_dir", None)
+
+    if os.path.isdir(os.path.join(work_dir, engine)):
+        shutil.rmtree(os.path.join(work_dir, engine))
+    os.makedirs(os.path.join(work_dir, engine))
+
+    config_file = os.path.join(work_dir, engine, "pipeline_config.yml")
+    with open(config_file, "wt") as f:
+        f.write(yaml.dump(config, default_flow_style=False))
+
+    start = time.time()
+    QAProtocolCLI(parse_args=False).run(config_file, data_config)
+
+    return time.time() - start
+
+
+def main():
+
+    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the run times of "
+                                     "the Nipype execution engine and the "
+                                     "direct executor.")
+    parser.add_argument("work_dir", type=str,
+                        help="a scratch directory for the benchmark runs")
+    parser.add_argument("--pipeline_config", type=str,
+                        help="time a real QAP run with this pipeline "
+                        "configuration file, instead of a synthetic "
+                        "workflow")
+    parser.add_argument("--data_config", type=str,
+                        help="the data configuration file for the real QAP "
+                        "run")
+    parser.add_argument("--num_chains", type=int, default=8,
+                        help="the number of independent node chains in the "
+                        "synthetic workflow (default: 8)")
+    parser.add_argument("--chain_length", type=int, default=25,
+                        help="the number of nodes in each chain of the "
+                        "synthetic workflow (default: 25)")
+    parser.add_argument("--n_procs", type=int, default=1,
+                        help="the number of processors for the synthetic "
+                        "workflow runs (default: 1)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="the number of times to time each engine "
+                        "(default: 3)")
+
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir)
+
+    if args.pipeline_config and not args.data_config:
+        parser.error("--data_config is required with --pipeline_config")
+
+    timings = {}
+    for engine in ["nipype", "direct"]:
+        timings[engine] = []
+        for repeat in range(args.repeats):
+            if args.pipeline_config:
+                elapsed = time_pipeline_run(engine, work_dir,
+                                            os.path.abspath(
+                                                args.pipeline_config),
+                                            os.path.abspath(
+                                                args.data_config))
+            else:
+                elapsed = time_synthetic_run(engine, work_dir,
+                                             args.num_chains,
+                                             args.chain_length, args.n_procs)
+            timings[engine].append(elapsed)
+
+    if args.pipeline_config:
+        print "\nQAP run: %s" % os.path.abspath(args.pipeline_config)
+    else:
+        print "\nSynthetic workflow: %d chains of %d nodes, %d processor(s)" \
+              % (args.num_chains, args.chain_length, args.n_procs)
+    for engine in ["nipype", "direct"]:
+        print "%s: best %.2f s, mean %.2f s over %d run(s)" \
+              % (engine, min(timings[engine]),
+                 sum(timings[engine]) / len(timings[engine]), args.repeats)
+    print "speed-up: %.2fx\n" % (min(timings["nipype"]) /
+                                 min(timings["direct"]))
+
+
+if __name__ == "__main__":
+    main()
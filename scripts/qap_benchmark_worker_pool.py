@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+
+def short_node_body(in_value):
+    # imports like the QAP Function nodes' bodies, then very little work
+    import numpy as np
+    import nibabel as nb
+    from qap.spatial_qc import snr
+    from qap.temporal_qc import global_correlation
+    from qap.qap_utils import read_nifti_image
+    return in_value + 1
+
+
+def run_function_node(node_dir):
+
+    import nipype.interfaces.utility as niu
+    from qap.direct_executor import run_node_interface
+
+    interface = niu.Function(input_names=["in_value"],
+                             output_names=["out_value"],
+                             function=short_node_body)
+    interface.inputs.in_value = 1
+    return run_node_interface(interface, node_dir)["out_value"]
+
+
+def time_import_in_new_interpreter():
+
+    import subprocess
+    import sys
+    import time
+    from qap.worker_pool import WARM_MODULES
+
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c",
+                           "import %s" % ", ".join(WARM_MODULES)])
+    return time.time() - start
+
+
+def time_new_pool_per_node(work_dir, num_nodes):
+
+    import os
+    import time
+    from nipype.pipeline.plugins.multiproc import NonDaemonPool
+
+    start = time.time()
+    for node_idx in range(num_nodes):
+        # what a MultiProc run pays for every workflow, and what a short
+        # node pays when its worker has not imported anything yet
+        pool = NonDaemonPool(processes=1)
+        pool.apply(run_function_node,
+                   (os.path.join(work_dir, "new_%d" % node_idx),))
+        pool.close()
+        pool.join()
+    return (time.time() - start) / num_nodes
+
+
+def time_warm_pool_per_node(work_dir, num_nodes):
+
+    import os
+    import time
+    from qap.worker_pool import get_warm_pool
+
+    pool = get_warm_pool(1)
+    # wait for the worker to finish warming up
+    pool.apply(run_function_node, (os.path.join(work_dir, "warm_up"),))
+
+    start = time.time()
+    for node_idx in range(num_nodes):
+        pool.apply(run_function_node,
+                   (os.path.join(work_dir, "warm_%d" % node_idx),))
+    return (time.time() - start) / num_nodes
+
+
+def main():
+
+    import os
+    import argparse
+    from qap.worker_pool import close_warm_pools
+
+    parser = argparse.ArgumentParser(description="Measure the per-node "
+                                     "start-up overhead of short Function "
+                                     "nodes with and without the warm "
+                                     "worker pool.")
+    parser.add_argument("work_dir", type=str,
+                        help="a scratch directory for the node runs")
+    parser.add_argument("--num_nodes", type=int, default=50,
+                        help="the number of nodes to run for each "
+                        "measurement (default: 50)")
+
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    import_time = time_import_in_new_interpreter()
+    new_pool_time = time_new_pool_per_node(work_dir, args.num_nodes)
+    warm_pool_time = time_warm_pool_per_node(work_dir, args.num_nodes)
+    close_warm_pools()
+
+    print "\nPer-node overhead over %d short Function nodes:" \
+          % args.num_nodes
+    print "importing the node modules in a new interpreter: %.1f ms" \
+          % (1000 * import_time)
+    print "new worker pool per node: %.1f ms" % (1000 * new_pool_time)
+    print "warm worker pool: %.1f ms" % (1000 * warm_pool_time)
+    print "speed-up: %.1fx\n" % (new_pool_time / warm_pool_time)
+
+
+if __name__ == "__main__":
+    main()
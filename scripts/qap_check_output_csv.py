@@ -22,7 +22,8 @@ def main():
 
     args = parser.parse_args()
 
-    csv_df = csv_to_pandas_df(args.output_csv)
+    csv_df = csv_to_pandas_df(args.output_csv,
+                              ["Participant", "Session", "Series"])
     data_dict = read_yml_file(args.data_config)
 
     new_dict = check_csv_missing_subs(csv_df, data_dict, args.data_type)
@@ -5,7 +5,7 @@ def main():
 
     import os
     import argparse
-    from qap.script_utils import gather_json_info, json_to_csv
+    from qap.script_utils import update_json_csvs
     from qap.qap_utils import raise_smart_exception
 
     parser = argparse.ArgumentParser()
@@ -18,11 +18,22 @@ def main():
     parser.add_argument("--with_full_reports", action='store_true',
                         default=False, help="Write the summary report and "
                         "the individual participant reports as well.")
+    parser.add_argument("--num_threads", type=int, default=8,
+                        help="The number of JSON files to read at once "
+                        "(default: 8).")
+    parser.add_argument("--rebuild", action='store_true', default=False,
+                        help="Re-read every JSON file and write the CSV "
+                        "files from scratch, instead of only reading the "
+                        "JSON files changed since the last run.")
+    parser.add_argument("--parquet", action='store_true', default=False,
+                        help="Also write each table in the Parquet format "
+                        "alongside the CSV file (requires PyArrow), for "
+                        "loading only the columns needed.")
 
     args = parser.parse_args()
 
-    json_dict = gather_json_info(args.output_dir)
-    json_to_csv(json_dict)
+    update_json_csvs(args.output_dir, num_threads=args.num_threads,
+                     rebuild=args.rebuild, write_parquet=args.parquet)
 
     if args.with_group_reports or args.with_full_reports:
         from qap.viz.reports import workflow_report
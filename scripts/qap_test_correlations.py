@@ -6,17 +6,18 @@ def main():
     import argparse
 
     from qap.script_utils import csv_to_pandas_df, read_txt_file, \
-                                 qap_csv_correlations
+                                 qap_csv_correlations, \
+                                 qap_csv_correlation_columns
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument("old_csv", type=str, \
-                            help="path to the QAP CSV output file from a " \
-                                 "previous run or version")
+                            help="path to the QAP CSV (or Parquet) output " \
+                                 "file from a previous run or version")
 
     parser.add_argument("new_csv", type=str, \
-                            help="path to the QAP CSV output file from the " \
-                                 "current run or version")
+                            help="path to the QAP CSV (or Parquet) output " \
+                                 "file from the current run or version")
                                 
     parser.add_argument("--replacements", type=str, \
                             help="text file containing column name pairs " \
@@ -27,15 +28,16 @@ def main():
 
     args = parser.parse_args()
 
-    # run it!
-    old_data = csv_to_pandas_df(args.old_csv)
-    new_data = csv_to_pandas_df(args.new_csv)
-
     if args.replacements:
     	replacements = read_txt_file(args.replacements)
     else:
         replacements = None
 
+    # run it! (loading only the columns compared)
+    columns = qap_csv_correlation_columns(replacements)
+    old_data = csv_to_pandas_df(args.old_csv, columns)
+    new_data = csv_to_pandas_df(args.new_csv, columns)
+
     correlations_dict = qap_csv_correlations(old_data, new_data, replacements)
 
     print "\nQAP Results Correlations (Pearson's r)"
@@ -38,7 +38,7 @@ def main():
                     'jmespath (>=0.9.0)', 'matplotlib (>=1.5.1)', 
                     'networkx (>=1.11)', 'nibabel (>=2.0.2)', 
                     'nitime (>=0.6)', 'nipype (>=0.12.1)', 
-                    'nose (>=1.3.7)', 'numpy (>=1.11.0)', 'pandas (>=0.18.1)',
+                    'nose (>=1.3.7)', 'numpy (>=1.11.0)', 'pandas (>=0.21.0)',
                     'prov (>=1.4.0)', 'pyparsing (>=2.1.4)', 
                     'python_dateutil (>=2.5.3)', 'pytz (>=2016.4)', 
                     'reportlab (>=3.3.0)', 'scipy (>=0.17.1)', 
@@ -56,7 +56,7 @@ def main():
                     'jmespath >=0.9.0', 'matplotlib >=1.5.1', 
                     'networkx >=1.11', 'nibabel >=2.0.2', 
                     'nitime >=0.6', 'nipype >=0.12.1', 
-                    'nose >=1.3.7', 'pandas >=0.18.1',
+                    'nose >=1.3.7', 'pandas >=0.21.0',
                     'prov >=1.4.0', 'pyparsing >=2.1.4', 
                     'python-dateutil >=2.5.3', 'pytz >=2016.4', 
                     'reportlab >=3.3.0', 'scipy >=0.17.1', 